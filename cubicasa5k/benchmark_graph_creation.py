@@ -0,0 +1,156 @@
+from math import sqrt
+import os
+import time
+import numpy as np
+import cubicasa5k.labels as ccl
+import cubicasa5k.samples as samples
+from tool.graph_creation import create_graph
+from absl import app
+from absl import flags
+from absl import logging
+
+flags.DEFINE_string("cubicasa5k_root",
+    default=None,
+    help="CubiCasa5k dataset root folder.",
+    required=True)
+
+flags.DEFINE_enum("dataset_split",
+    default="val",
+    enum_values=["train", "val", "test"],
+    help="Dataset split whose samples are benchmarked.")
+
+flags.DEFINE_integer("num_samples",
+    default=50,
+    help="Number of samples to benchmark.")
+
+FLAGS = flags.FLAGS
+
+
+_LABEL_DIVISOR = 256
+_LABELS = (ccl.Label.ROOM, ccl.Label.DOOR)
+
+
+def _get_pixel_neibs(img_array, i, j):
+    neibs = []
+
+    if i-1 >= 0:
+        neibs.append(img_array[i-1, j])
+    if i+1 < img_array.shape[0]:
+        neibs.append(img_array[i+1, j])
+    if j-1 >= 0:
+        neibs.append(img_array[i, j-1])
+    if j+1 < img_array.shape[1]:
+        neibs.append(img_array[i, j+1])
+
+    return neibs
+
+
+def _create_graph_loop(panoptic_pred, instance_center_pred, label_divisor, labels):
+    """The per-pixel graph creation of the tool, used as the reference."""
+    elem_id_to_center_pred_max = {}
+    elem_id_to_center = {}
+    elem_id_graph = {}
+
+    for i in range(panoptic_pred.shape[0]):
+        for j in range(panoptic_pred.shape[1]):
+            elem_id = panoptic_pred[i][j]
+            label = elem_id // label_divisor
+            if label not in labels:
+                continue
+
+            if instance_center_pred[i][j] > elem_id_to_center_pred_max.get(elem_id, -1.0):
+                elem_id_to_center_pred_max[elem_id] = instance_center_pred[i][j]
+                elem_id_to_center[elem_id] = (j, i)
+
+            neibs = _get_pixel_neibs(panoptic_pred, i, j)
+
+            for neib in neibs:
+                if neib == elem_id:
+                    continue
+                neib_label = neib // label_divisor
+                if neib_label not in labels:
+                    continue
+                if (elem_id, neib) not in elem_id_graph:
+                    elem_id_graph[(elem_id, neib)] = 1.0
+
+    # The tool numbered the nodes in ascending element id order.
+    node_id_to_elem_id = {}
+    elem_id_to_node_id = {}
+    node_id = 0
+
+    for elem_id in sorted(np.unique(panoptic_pred).tolist()):
+        if elem_id // label_divisor not in labels:
+            continue
+        node_id += 1
+        node_id_to_elem_id[node_id] = elem_id
+        elem_id_to_node_id[elem_id] = node_id
+
+    node_id_to_center = {elem_id_to_node_id[elem_id]: center for elem_id, center in elem_id_to_center.items()}
+
+    graph = {}
+
+    for elem_id, neib in elem_id_graph.keys():
+        edge = (elem_id_to_node_id[elem_id], elem_id_to_node_id[neib])
+        center1 = node_id_to_center[edge[0]]
+        center2 = node_id_to_center[edge[1]]
+        x = center1[0] - center2[0]
+        y = center1[1] - center2[1]
+        graph[edge] = sqrt(x*x + y*y)
+
+    return node_id_to_elem_id, node_id_to_center, graph
+
+
+def _to_python(node_id_to_elem_id, node_id_to_center, graph):
+    """Converts the numpy scalars of a graph to python ones, to compare them."""
+    node_id_to_elem_id = {int(k): int(v) for k, v in node_id_to_elem_id.items()}
+    node_id_to_center = {int(k): (int(v[0]), int(v[1])) for k, v in node_id_to_center.items()}
+    graph = {(int(k[0]), int(k[1])): float(v) for k, v in graph.items()}
+
+    return node_id_to_elem_id, node_id_to_center, graph
+
+
+def _time(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main(_):
+    logging.get_absl_handler().setFormatter(None)
+
+    sample_dir_names = samples.get_sample_dir_names(FLAGS.cubicasa5k_root, FLAGS.dataset_split)
+    sample_dir_names = sample_dir_names[:FLAGS.num_samples]
+    rng = np.random.RandomState(0)
+
+    loop_times = []
+    vectorized_times = []
+
+    for sample_dir_name in sample_dir_names:
+        _, labels_array = samples.create_sample_arrays(os.path.join(FLAGS.cubicasa5k_root, sample_dir_name))
+        panoptic_pred = samples.create_panoptic_label(labels_array, _LABEL_DIVISOR)
+        # Random center scores, rounded so that many elements have tied maxima.
+        instance_center_pred = np.round(rng.rand(*panoptic_pred.shape), 2).astype(np.float32)
+
+        loop_graph, loop_time = _time(_create_graph_loop, panoptic_pred, instance_center_pred,
+            _LABEL_DIVISOR, _LABELS)
+        vectorized_graph, vectorized_time = _time(create_graph, panoptic_pred, instance_center_pred,
+            _LABEL_DIVISOR, _LABELS)
+
+        if _to_python(*loop_graph) != _to_python(*vectorized_graph):
+            raise ValueError("{}: the graphs differ".format(sample_dir_name))
+
+        logging.info("{}: {} nodes, {} edges, loop {:.3f}s, vectorized {:.3f}s".format(sample_dir_name,
+            len(vectorized_graph[0]), len(vectorized_graph[2]) // 2, loop_time, vectorized_time))
+        loop_times.append(loop_time)
+        vectorized_times.append(vectorized_time)
+
+    logging.info("{} samples, identical graphs".format(len(sample_dir_names)))
+    logging.info("loop: mean {:.3f}s, median {:.3f}s per sample".format(
+        np.mean(loop_times), np.median(loop_times)))
+    logging.info("vectorized: mean {:.3f}s, median {:.3f}s per sample".format(
+        np.mean(vectorized_times), np.median(vectorized_times)))
+    logging.info("Speedup: {:.1f}x".format(np.sum(loop_times) / np.sum(vectorized_times)))
+
+
+if __name__ == '__main__':
+    app.run(main)
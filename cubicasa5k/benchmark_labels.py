@@ -0,0 +1,123 @@
+from collections import defaultdict
+import io
+import os
+import time
+import numpy as np
+import cubicasa5k.labels as ccl
+import cubicasa5k.samples as samples
+from xml.dom import minidom
+from skimage.draw import polygon
+from PIL import Image
+from absl import app
+from absl import flags
+from absl import logging
+
+flags.DEFINE_string("cubicasa5k_root",
+    default=None,
+    help="CubiCasa5k dataset root folder.",
+    required=True)
+
+flags.DEFINE_enum("dataset_split",
+    default="val",
+    enum_values=["train", "val", "test"],
+    help="Dataset split whose samples are benchmarked.")
+
+flags.DEFINE_integer("num_samples",
+    default=50,
+    help="Number of samples to benchmark.")
+
+FLAGS = flags.FLAGS
+
+
+def _create_labels_array_dom(img_array, svg_file_path):
+    """The minidom based label builder, used as the reference."""
+    instance_ids = defaultdict(int)
+    height, width, nchannel = img_array.shape
+    labels_array = np.zeros((height, width, nchannel), dtype=np.uint8)
+
+    svg = minidom.parse(svg_file_path)
+
+    for e in svg.getElementsByTagName('g'):
+        svg_id = e.getAttribute("id")
+
+        if svg_id in ("Wall", "Railing", "Window", "Door"):
+            label = ccl.svg_label_to_label[svg_id]
+            if svg_id == "Door":
+                instance_ids[label] += 1
+        elif "Space " in e.getAttribute("class"):
+            label = e.getAttribute("class").split(" ")[1]
+            label = ccl.svg_label_to_label[label]
+            instance_ids[label] += 1
+        else:
+            continue
+
+        pol = next(p for p in e.childNodes if p.nodeName == "polygon")
+        points = pol.getAttribute("points").split(' ')
+        points = points[:-1]
+
+        X, Y = np.array([]), np.array([])
+        for a in points:
+            x, y = a.split(',')
+            X = np.append(X, np.round(float(x)))
+            Y = np.append(Y, np.round(float(y)))
+
+        rr, cc = polygon(X, Y)
+        s = np.column_stack((cc, rr))
+        s = s[s[:, 0] < height]
+        s = s[s[:, 1] < width]
+        cc, rr = s[:, 0], s[:, 1]
+
+        instance_id = instance_ids[label]
+        labels_array[cc, rr, 0] = label
+        labels_array[cc, rr, 1] = instance_id // 256
+        labels_array[cc, rr, 2] = instance_id % 256
+
+    return labels_array
+
+
+def _encode_png(array):
+    f = io.BytesIO()
+    Image.fromarray(array).save(f, format="png")
+    return f.getvalue()
+
+
+def _time(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main(_):
+    logging.get_absl_handler().setFormatter(None)
+
+    sample_dir_names = samples.get_sample_dir_names(FLAGS.cubicasa5k_root, FLAGS.dataset_split)
+    sample_dir_names = sample_dir_names[:FLAGS.num_samples]
+
+    dom_times = []
+    stream_times = []
+
+    for sample_dir_name in sample_dir_names:
+        sample_dir_path = os.path.join(FLAGS.cubicasa5k_root, sample_dir_name)
+        img_array = samples.create_img_array(os.path.join(sample_dir_path, "F1_scaled.png"))
+        svg_file_path = os.path.join(sample_dir_path, "model.svg")
+
+        dom_labels, dom_time = _time(_create_labels_array_dom, img_array, svg_file_path)
+        stream_labels, stream_time = _time(samples.create_labels_array, img_array, svg_file_path)
+
+        if _encode_png(dom_labels) != _encode_png(stream_labels):
+            raise ValueError("{}: the labels differ".format(sample_dir_name))
+
+        logging.info("{}: dom {:.3f}s, stream {:.3f}s".format(sample_dir_name, dom_time, stream_time))
+        dom_times.append(dom_time)
+        stream_times.append(stream_time)
+
+    logging.info("{} samples, identical labels".format(len(sample_dir_names)))
+    logging.info("dom: mean {:.3f}s, median {:.3f}s per sample".format(
+        np.mean(dom_times), np.median(dom_times)))
+    logging.info("stream: mean {:.3f}s, median {:.3f}s per sample".format(
+        np.mean(stream_times), np.median(stream_times)))
+    logging.info("Speedup: {:.1f}x".format(np.sum(dom_times) / np.sum(stream_times)))
+
+
+if __name__ == '__main__':
+    app.run(main)
@@ -0,0 +1,106 @@
+import glob
+import os
+import tempfile
+import time
+import tensorflow as tf
+from absl import app
+from absl import flags
+from absl import logging
+from deeplab2 import common
+from deeplab2.data import data_utils
+
+flags.DEFINE_string("input_pattern",
+    default=None,
+    help="Glob pattern of the TFRecords to benchmark, e.g. "
+    "datasets/deeplab2/cubicasa5k/tf_records/val*.tfrecord.",
+    required=True)
+
+flags.DEFINE_string("input_compression_type",
+    default="",
+    help="Compression of the input TFRecords.")
+
+flags.DEFINE_integer("num_records",
+    default=200,
+    help="Number of records to benchmark.")
+
+flags.DEFINE_integer("num_repeats",
+    default=3,
+    help="Number of times every measurement is repeated, the best is kept.")
+
+FLAGS = flags.FLAGS
+
+
+_COMPRESSION_TYPES = ("", "ZLIB", "GZIP")
+
+
+def _read_samples(input_pattern, compression_type, num_records):
+    """Returns the (image data, file name, panoptic label) of the records."""
+    decoder = data_utils.SegmentationDecoder(is_panoptic_dataset=True)
+    samples = []
+
+    dataset = tf.data.TFRecordDataset(sorted(glob.glob(input_pattern)), compression_type=compression_type)
+    for serialized_example in dataset.take(num_records):
+        example = tf.train.Example.FromString(serialized_example.numpy())
+        image_data = example.features.feature[common.KEY_ENCODED_IMAGE].bytes_list.value[0]
+        decoded = decoder(serialized_example)
+        samples.append((image_data, decoded["image_name"].numpy(), decoded["label"].numpy()[:, :, 0]))
+
+    return samples
+
+
+def _write_records(file_path, samples, label_format, compression_type):
+    options = tf.io.TFRecordOptions(compression_type=compression_type)
+
+    start = time.perf_counter()
+    with tf.io.TFRecordWriter(file_path, options) as tfrecord_writer:
+        for image_data, image_name, label in samples:
+            label_data = data_utils.encode_panoptic_label(label, label_format)
+            example = data_utils.create_tfexample(image_data, "png", image_name, label_data, label_format)
+            tfrecord_writer.write(example.SerializeToString())
+
+    return time.perf_counter() - start
+
+
+def _time_dataset(dataset, num_repeats):
+    best = float("inf")
+    for _ in range(num_repeats):
+        start = time.perf_counter()
+        for _ in dataset:
+            pass
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(_):
+    logging.get_absl_handler().setFormatter(None)
+
+    samples = _read_samples(FLAGS.input_pattern, FLAGS.input_compression_type, FLAGS.num_records)
+    logging.info("Benchmarking {} records".format(len(samples)))
+
+    decoder = data_utils.SegmentationDecoder(is_panoptic_dataset=True)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for label_format in data_utils.PANOPTIC_LABEL_FORMATS:
+            for compression_type in _COMPRESSION_TYPES:
+                file_path = os.path.join(tmp_dir, "{}_{}.tfrecord".format(label_format, compression_type))
+                write_time = _write_records(file_path, samples, label_format, compression_type)
+                size = os.path.getsize(file_path)
+
+                dataset = tf.data.TFRecordDataset(file_path, compression_type=compression_type)
+                read_time = _time_dataset(dataset, FLAGS.num_repeats)
+                # The decoding cost is the parsing and decoding of the label,
+                # on top of the reading.
+                decode_time = _time_dataset(dataset.map(decoder), FLAGS.num_repeats) - read_time
+
+                logging.info(
+                    "{:5s} {:4s}: {:8.2f} MB ({:6.1f} KB per record), write {:6.2f}s, "
+                    "read {:8.1f} records/s, decode {:6.2f} ms per record".format(
+                        label_format, compression_type or "none", size / (1 << 20),
+                        size / len(samples) / (1 << 10), write_time, len(samples) / read_time,
+                        1000 * decode_time / len(samples)))
+
+                os.remove(file_path)
+
+
+if __name__ == '__main__':
+    app.run(main)
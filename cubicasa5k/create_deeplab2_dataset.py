@@ -1,19 +1,15 @@
-from collections import defaultdict
+import hashlib
+import json
+import multiprocessing
 import os
-import numpy as np
-import cv2
 import tensorflow as tf
 import shutil
-import cubicasa5k.labels as ccl
+import cubicasa5k.samples as samples
 from tqdm import tqdm
-from xml.dom import minidom
-from skimage.draw import polygon
 from PIL import Image
 from absl import app
 from absl import flags
 from absl import logging
-from enum import Enum
-from collections import defaultdict
 
 flags.DEFINE_string("cubicasa5k_root", 
     default=None, 
@@ -25,156 +21,186 @@ flags.DEFINE_string("output_dir",
     help="Path to save dataset for deeplab2.",
     required=True)
 
+flags.DEFINE_integer("num_workers",
+    default=1,
+    help="Number of worker processes converting the samples.")
+
+flags.DEFINE_bool("overwrite",
+    default=False,
+    help="Delete output_dir and convert every sample again. Otherwise the "
+    "samples recorded in the manifest, whose inputs and outputs did not "
+    "change, are skipped.")
+
 FLAGS = flags.FLAGS
 
 
-_DATASET_SPLIT_SIZES = {
-    "train" : 4200,
-    "val" : 400,
-    "test" : 400,
-}
+# Bump it when the conversion changes, so that the existing samples are
+# converted again.
+_CONVERSION_VERSION = 1
+_MANIFEST_FILE_NAME = "manifest.jsonl"
+_INPUT_FILE_NAMES = ("F1_scaled.png", "model.svg")
+_OUTPUT_FILE_NAMES = ("image.png", "labels.png")
 
-_MAX_IMG_SIZE = 1024
 
+def _save_as_png(array, file_path):
+    img = Image.fromarray(array)
+    img.save(file_path)
 
-class Channel(int, Enum):
-    R = 0
-    G = 1
-    B = 2
 
+def _create_sample(sample_dir_path, new_sample_dir_path):
+    new_img_file_path = os.path.join(new_sample_dir_path, "image.png")
+    labels_file_path = os.path.join(new_sample_dir_path, "labels.png")
 
-def _create_img_array(img_file_path):
-    img_array = cv2.imread(img_file_path)
+    img_array, labels_array = samples.create_sample_arrays(sample_dir_path)
+    
+    _save_as_png(img_array, new_img_file_path)
+    _save_as_png(labels_array, labels_file_path)
     
-    return cv2.cvtColor(img_array, cv2.COLOR_BGR2RGB)  # correct color channels
 
+def _get_file_checksum(file_path):
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
 
-def _get_points(e):
-    pol = next(p for p in e.childNodes if p.nodeName == "polygon")
-    points = pol.getAttribute("points").split(' ')
-    points = points[:-1]
 
-    X, Y = np.array([]), np.array([])
-    for a in points:
-        x, y = a.split(',')
-        X = np.append(X, np.round(float(x)))
-        Y = np.append(Y, np.round(float(y)))
+def _get_input_checksum(sample_dir_path):
+    h = hashlib.sha256()
+    h.update("{} {}".format(_CONVERSION_VERSION, samples.MAX_IMG_SIZE).encode())
+    for file_name in _INPUT_FILE_NAMES:
+        h.update(_get_file_checksum(os.path.join(sample_dir_path, file_name)).encode())
+    return h.hexdigest()
 
-    return X, Y
 
+def _get_output_checksums(new_sample_dir_path):
+    return {file_name: _get_file_checksum(os.path.join(new_sample_dir_path, file_name))
+        for file_name in _OUTPUT_FILE_NAMES}
 
-    
-def _clip_outside(rr, cc, height, width):
-    s = np.column_stack((rr, cc))
-    s = s[s[:, 0] < height]
-    s = s[s[:, 1] < width]
 
-    return s[:, 0], s[:, 1]
+def _is_converted(entry, input_checksum, new_sample_dir_path):
+    if entry is None or entry["input"] != input_checksum:
+        return False
 
+    for file_name in _OUTPUT_FILE_NAMES:
+        if not os.path.isfile(os.path.join(new_sample_dir_path, file_name)):
+            return False
 
-def _create_labels_array(img_array, svg_file_path):
-    instance_ids = defaultdict(int)
-    height, width, nchannel = img_array.shape
-    labels_array = np.zeros((height, width, nchannel), dtype=np.uint8)
-    
-    svg = minidom.parse(svg_file_path)
-    
-    for e in svg.getElementsByTagName('g'):
-        svg_id = e.getAttribute("id")
-
-        if svg_id in ("Wall", "Railing", "Window", "Door"):
-            label = ccl.svg_label_to_label[svg_id]
-            if svg_id == "Door":
-                instance_ids[label] += 1
-        elif "Space " in e.getAttribute("class"):
-            label = e.getAttribute("class").split(" ")[1]
-            label = ccl.svg_label_to_label[label]
-            instance_ids[label] += 1
-        else:
-            continue
+    return _get_output_checksums(new_sample_dir_path) == entry["outputs"]
 
-        X, Y = _get_points(e)
-        rr, cc = polygon(X, Y)
-        cc, rr = _clip_outside(cc, rr, height, width)
 
-        instance_id = instance_ids[label]
-        labels_array[cc, rr, Channel.R] = label
-        labels_array[cc, rr, Channel.G] = instance_id // 256
-        labels_array[cc, rr, Channel.B] = instance_id % 256
-    
-    return labels_array
+def _load_manifest(output_dir):
+    """Returns a dict sample_dir_name -> last manifest entry of the sample."""
+    manifest = {}
+    manifest_file_path = os.path.join(output_dir, _MANIFEST_FILE_NAME)
+    if not os.path.isfile(manifest_file_path):
+        return manifest
 
+    with open(manifest_file_path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # The last line of an interrupted run may be truncated.
+                continue
+            manifest[entry["sample"]] = entry
 
-def _save_as_png(array, file_path):
-    img = Image.fromarray(array)
-    img.save(file_path)
+    return manifest
 
 
-def _resize_image(array, method):
-    height, width, _ = array.shape
-    if height <= _MAX_IMG_SIZE and width <= _MAX_IMG_SIZE:
-        return array
+def _init_worker():
+    # The samples are converted in parallel, so every worker uses one thread.
+    tf.config.threading.set_intra_op_parallelism_threads(1)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
 
-    if method == tf.image.ResizeMethod.BILINEAR:
-        array = array.astype(np.float64)
-    array = np.expand_dims(array, axis=0)
 
-    size = (_MAX_IMG_SIZE, _MAX_IMG_SIZE)
-    array = tf.image.resize(array, size=size, method=method, preserve_aspect_ratio=True)
+def _convert_sample(args):
+    """Converts a sample unless the manifest shows that it is up to date.
 
-    array = np.squeeze(array, axis=0)
-    if method == tf.image.ResizeMethod.BILINEAR:
-        array = array.astype(np.uint8)
-    
-    return array
+    Returns:
+      The manifest entry of the sample and whether it was converted.
+    """
+    sample_dir_name, cubicasa5k_root, output_dir, entry = args
 
+    sample_dir_path = os.path.join(cubicasa5k_root, sample_dir_name)
+    new_sample_dir_path = os.path.join(output_dir, sample_dir_name)
 
-def _create_sample(sample_dir_path, new_sample_dir_path):
-    img_file_path = os.path.join(sample_dir_path, "F1_scaled.png")
-    svg_file_path = os.path.join(sample_dir_path, "model.svg")
-    
-    new_img_file_path = os.path.join(new_sample_dir_path, "image.png")
-    labels_file_path = os.path.join(new_sample_dir_path, "labels.png")
-    
-    img_array = _create_img_array(img_file_path)
-    labels_array = _create_labels_array(img_array, svg_file_path)
+    input_checksum = _get_input_checksum(sample_dir_path)
+    if _is_converted(entry, input_checksum, new_sample_dir_path):
+        return entry, False
 
-    img_array = _resize_image(img_array, tf.image.ResizeMethod.BILINEAR)
-    labels_array = _resize_image(labels_array, tf.image.ResizeMethod.NEAREST_NEIGHBOR)
-    
-    _save_as_png(img_array, new_img_file_path)
-    _save_as_png(labels_array, labels_file_path)
-    
+    tf.io.gfile.makedirs(new_sample_dir_path)
+    _create_sample(sample_dir_path, new_sample_dir_path)
 
-def _create_dataset(cubicasa5k_root, output_dir, dataset_split):
+    entry = {
+        "sample": sample_dir_name,
+        "input": input_checksum,
+        "outputs": _get_output_checksums(new_sample_dir_path),
+    }
+
+    return entry, True
+
+
+def _create_dataset(cubicasa5k_root, output_dir, dataset_split, manifest, manifest_file, pool):
     logging.info("Creating dataset split {}".format(dataset_split))
     
     txt_file_path = os.path.join(cubicasa5k_root, dataset_split + ".txt")
     shutil.copy(txt_file_path, output_dir)
-    
-    with open(txt_file_path) as f:
-        samples_num = _DATASET_SPLIT_SIZES[dataset_split]
-        
-        for sample_dir_name in tqdm(f.readlines()[:samples_num]):
-            sample_dir_name = os.path.normpath(sample_dir_name[1:-1])
-            sample_dir_path = os.path.join(cubicasa5k_root, sample_dir_name)
-            new_sample_dir_path = os.path.join(output_dir, sample_dir_name)
-            tf.io.gfile.makedirs(new_sample_dir_path)
-            
-            _create_sample(sample_dir_path, new_sample_dir_path)
+
+    sample_dir_names = samples.get_sample_dir_names(cubicasa5k_root, dataset_split)
+    args = [(name, cubicasa5k_root, output_dir, manifest.get(name)) for name in sample_dir_names]
+
+    if pool is not None:
+        results = pool.imap_unordered(_convert_sample, args, chunksize=4)
+    else:
+        results = map(_convert_sample, args)
+
+    converted_num = 0
+
+    for entry, converted in tqdm(results, total=len(args)):
+        if not converted:
+            continue
+        converted_num += 1
+        manifest[entry["sample"]] = entry
+        # Every sample is recorded as soon as it is converted, so that an
+        # interrupted run resumes from where it stopped.
+        manifest_file.write(json.dumps(entry) + "\n")
+        manifest_file.flush()
+
+    logging.info("Converted {} samples, skipped {} up to date samples".format(
+        converted_num, len(args) - converted_num))
 
 
 def main(_):
     logging.get_absl_handler().setFormatter(None)
 
-    try:
-        shutil.rmtree(FLAGS.output_dir)
-    except:
-        pass
+    if FLAGS.overwrite:
+        try:
+            shutil.rmtree(FLAGS.output_dir)
+        except:
+            pass
     tf.io.gfile.makedirs(FLAGS.output_dir)
-    
-    for dataset_split in ("train", "val", "test"):
-        _create_dataset(FLAGS.cubicasa5k_root, FLAGS.output_dir, dataset_split)
+
+    manifest = _load_manifest(FLAGS.output_dir)
+
+    if FLAGS.num_workers > 1:
+        # TensorFlow is not fork-safe, so the workers are spawned.
+        ctx = multiprocessing.get_context("spawn")
+        pool = ctx.Pool(FLAGS.num_workers, initializer=_init_worker)
+    else:
+        pool = None
+
+    manifest_file_path = os.path.join(FLAGS.output_dir, _MANIFEST_FILE_NAME)
+
+    try:
+        with open(manifest_file_path, "a") as manifest_file:
+            for dataset_split in ("train", "val", "test"):
+                _create_dataset(FLAGS.cubicasa5k_root, FLAGS.output_dir, dataset_split, manifest,
+                    manifest_file, pool)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
     
 
 if __name__ == '__main__':
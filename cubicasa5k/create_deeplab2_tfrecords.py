@@ -0,0 +1,181 @@
+import io
+import math
+import multiprocessing
+import os
+import shutil
+import tensorflow as tf
+import cubicasa5k.samples as samples
+from tqdm import tqdm
+from PIL import Image
+from absl import app
+from absl import flags
+from absl import logging
+from deeplab2.data import data_utils
+from deeplab2.data import dataset
+
+flags.DEFINE_string("cubicasa5k_root",
+    default=None,
+    help="CubiCasa5k dataset root folder.",
+    required=True)
+
+flags.DEFINE_string("output_dir",
+    default=None,
+    help="Path to save the TFRecords.",
+    required=True)
+
+flags.DEFINE_string("png_dir",
+    default=None,
+    help="If set, the image.png and labels.png of every sample are also saved "
+    "there, as create_deeplab2_dataset.py does.")
+
+flags.DEFINE_integer("num_workers",
+    default=1,
+    help="Number of worker processes. Every worker writes whole shards.")
+
+flags.DEFINE_enum("label_format",
+    default="raw",
+    enum_values=data_utils.PANOPTIC_LABEL_FORMATS,
+    help="Encoding of the panoptic label: int32 array (raw), 16-bit PNG (png16) "
+    "or run-length encoding (rle).")
+
+flags.DEFINE_enum("compression_type",
+    default="none",
+    enum_values=["none", "ZLIB", "GZIP"],
+    help="Compression of the TFRecord files. Set the same compression_type in "
+    "the dataset options of the config.")
+
+FLAGS = flags.FLAGS
+
+
+_SPLITS_TO_SIZES = dataset.CUBICASA5K_INFORMATION.splits_to_sizes
+_LABEL_DIVISOR = dataset.CUBICASA5K_INFORMATION.panoptic_label_divisor
+
+# The same shards as build_cubicasa5k_data.py writes.
+_NUM_SHARDS_MAP = {
+    "train" : 100,
+    "val" : 10,
+    "test" : 10,
+}
+
+
+def _encode_png(array):
+    f = io.BytesIO()
+    Image.fromarray(array).save(f, format="png")
+    return f.getvalue()
+
+
+def _create_example(cubicasa5k_root, sample_dir_name, dataset_split, png_dir, label_format):
+    sample_dir_path = os.path.join(cubicasa5k_root, sample_dir_name)
+    img_array, labels_array = samples.create_sample_arrays(sample_dir_path)
+
+    image_data = _encode_png(img_array)
+
+    if png_dir is not None:
+        new_sample_dir_path = os.path.join(png_dir, sample_dir_name)
+        tf.io.gfile.makedirs(new_sample_dir_path)
+        with open(os.path.join(new_sample_dir_path, "image.png"), "wb") as f:
+            f.write(image_data)
+        Image.fromarray(labels_array).save(os.path.join(new_sample_dir_path, "labels.png"))
+
+    if dataset_split == "test":
+        label_data, label_format = None, None
+    else:
+        # The label goes straight from the rasterised array to the record,
+        # without the png encoding and decoding of the two step pipeline.
+        panoptic_label = samples.create_panoptic_label(labels_array, _LABEL_DIVISOR)
+        label_data = data_utils.encode_panoptic_label(panoptic_label, label_format)
+
+    return data_utils.create_tfexample(image_data, "png", samples.get_sample_name(sample_dir_name),
+        label_data, label_format)
+
+
+def _init_worker():
+    # The shards are written in parallel, so every worker uses one thread.
+    tf.config.threading.set_intra_op_parallelism_threads(1)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def _write_shard(args):
+    (cubicasa5k_root, sample_dir_names, dataset_split, output_filename, png_dir, label_format,
+        compression_type) = args
+
+    # The shard is renamed when complete, so an interrupted run leaves no
+    # truncated shard behind.
+    tmp_filename = output_filename + ".tmp"
+    options = tf.io.TFRecordOptions(compression_type=compression_type)
+    with tf.io.TFRecordWriter(tmp_filename, options) as tfrecord_writer:
+        for sample_dir_name in sample_dir_names:
+            example = _create_example(cubicasa5k_root, sample_dir_name, dataset_split, png_dir,
+                label_format)
+            tfrecord_writer.write(example.SerializeToString())
+    tf.io.gfile.rename(tmp_filename, output_filename, overwrite=True)
+
+    return output_filename
+
+
+def _create_tfrecords(cubicasa5k_root, output_dir, dataset_split, png_dir, label_format,
+        compression_type, pool):
+    logging.info("Creating dataset split {}".format(dataset_split))
+
+    sample_dir_names = samples.get_sample_dir_names(cubicasa5k_root, dataset_split)
+
+    num_samples = len(sample_dir_names)
+    expected_dataset_size = _SPLITS_TO_SIZES[dataset_split]
+    if num_samples != expected_dataset_size:
+        raise ValueError("Expects %d samples, gets %d" % (expected_dataset_size, num_samples))
+
+    if png_dir is not None:
+        shutil.copy(os.path.join(cubicasa5k_root, dataset_split + ".txt"), png_dir)
+
+    num_shards = _NUM_SHARDS_MAP[dataset_split]
+    num_per_shard = int(math.ceil(num_samples / num_shards))
+
+    args = []
+    for shard_id in range(num_shards):
+        shard_filename = "%s-%05d-of-%05d.tfrecord" % (dataset_split, shard_id, num_shards)
+        start_idx = shard_id * num_per_shard
+        end_idx = min((shard_id + 1) * num_per_shard, num_samples)
+        args.append((cubicasa5k_root, sample_dir_names[start_idx:end_idx], dataset_split,
+            os.path.join(output_dir, shard_filename), png_dir, label_format, compression_type))
+
+    if pool is not None:
+        results = pool.imap_unordered(_write_shard, args)
+    else:
+        results = map(_write_shard, args)
+
+    for output_filename in tqdm(results, total=len(args)):
+        logging.debug("Created shard {}".format(output_filename))
+
+
+def main(_):
+    logging.get_absl_handler().setFormatter(None)
+
+    try:
+        shutil.rmtree(FLAGS.output_dir)
+    except:
+        pass
+    tf.io.gfile.makedirs(FLAGS.output_dir)
+    if FLAGS.png_dir is not None:
+        tf.io.gfile.makedirs(FLAGS.png_dir)
+
+    compression_type = "" if FLAGS.compression_type == "none" else FLAGS.compression_type
+
+    if FLAGS.num_workers > 1:
+        # TensorFlow is not fork-safe, so the workers are spawned.
+        ctx = multiprocessing.get_context("spawn")
+        pool = ctx.Pool(FLAGS.num_workers, initializer=_init_worker)
+    else:
+        pool = None
+
+    try:
+        for dataset_split in ("train", "val", "test"):
+            _create_tfrecords(FLAGS.cubicasa5k_root, FLAGS.output_dir, dataset_split, FLAGS.png_dir,
+                FLAGS.label_format, compression_type, pool)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+if __name__ == '__main__':
+    app.run(main)
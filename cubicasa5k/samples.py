@@ -0,0 +1,171 @@
+from collections import defaultdict
+import os
+import numpy as np
+import cv2
+import tensorflow as tf
+import cubicasa5k.labels as ccl
+import xml.etree.ElementTree as ET
+from skimage.draw import polygon
+
+
+DATASET_SPLIT_SIZES = {
+    "train" : 4200,
+    "val" : 400,
+    "test" : 400,
+}
+
+MAX_IMG_SIZE = 1024
+
+
+def create_img_array(img_file_path):
+    img_array = cv2.imread(img_file_path)
+    
+    return cv2.cvtColor(img_array, cv2.COLOR_BGR2RGB)  # correct color channels
+
+
+def _get_label(svg_id, svg_class):
+    if svg_id in ("Wall", "Railing", "Window", "Door"):
+        return ccl.svg_label_to_label[svg_id], svg_id == "Door"
+    elif "Space " in svg_class:
+        return ccl.svg_label_to_label[svg_class.split(" ")[1]], True
+    else:
+        return None, False
+
+
+def _parse_svg(svg_file_path):
+    """Returns the (label, instance_id, points) of the labelled g elements.
+
+    The elements are returned in document order, which is the order they
+    are drawn in, and points is the points attribute of the first polygon
+    child of each element.
+    """
+    instance_ids = defaultdict(int)
+    elems = []
+    # (is_g, index in elems of a labelled g or None) of every open element.
+    stack = []
+
+    for event, e in ET.iterparse(svg_file_path, events=("start", "end")):
+        tag = e.tag.rpartition("}")[2]
+
+        if event == "start":
+            index = None
+            if tag == "g":
+                label, is_new_instance = _get_label(e.get("id", ""), e.get("class", ""))
+                if label is not None:
+                    if is_new_instance:
+                        instance_ids[label] += 1
+                    index = len(elems)
+                    elems.append([label, instance_ids[label], None])
+            stack.append(index)
+            continue
+
+        stack.pop()
+        if tag == "polygon" and len(stack) > 0 and stack[-1] is not None:
+            elem = elems[stack[-1]]
+            if elem[2] is None:
+                elem[2] = e.get("points", "")
+        e.clear()
+
+    for elem in elems:
+        if elem[2] is None:
+            raise ValueError("{}: g element without polygon".format(svg_file_path))
+
+    return elems
+
+
+def _parse_points(points_strs):
+    """Parses the points attributes of all the polygons at once.
+
+    Returns:
+      A list with the rounded (X, Y) coordinates of every polygon.
+    """
+    # The points end with a space, so the last token is dropped.
+    points = [points_str.split(" ")[:-1] for points_str in points_strs]
+    counts = np.array([len(p) for p in points], dtype=np.int64)
+
+    coords = ",".join(",".join(p) for p in points if len(p) > 0)
+    if len(coords) == 0:
+        return [(np.array([]), np.array([])) for _ in points]
+    coords = np.round(np.array(coords.split(","), dtype=np.float64)).reshape(-1, 2)
+
+    splits = np.split(coords, np.cumsum(counts)[:-1])
+
+    return [(xy[:, 0], xy[:, 1]) for xy in splits]
+
+
+def create_labels_array(img_array, svg_file_path):
+    height, width, nchannel = img_array.shape
+    labels_array = np.zeros((height, width, nchannel), dtype=np.uint8)
+
+    elems = _parse_svg(svg_file_path)
+    points = _parse_points([points_str for _, _, points_str in elems])
+
+    for (label, instance_id, _), (X, Y) in zip(elems, points):
+        if len(X) == 0:
+            continue
+        # X is the column and Y the row, polygon() clips them to the image.
+        cc, rr = polygon(X, Y, shape=(width, height))
+        labels_array[rr, cc] = (label, instance_id // 256, instance_id % 256)
+    
+    return labels_array
+
+
+def resize_image(array, method):
+    height, width, _ = array.shape
+    if height <= MAX_IMG_SIZE and width <= MAX_IMG_SIZE:
+        return array
+
+    if method == tf.image.ResizeMethod.BILINEAR:
+        array = array.astype(np.float64)
+    array = np.expand_dims(array, axis=0)
+
+    size = (MAX_IMG_SIZE, MAX_IMG_SIZE)
+    array = tf.image.resize(array, size=size, method=method, preserve_aspect_ratio=True)
+
+    array = np.squeeze(array, axis=0)
+    if method == tf.image.ResizeMethod.BILINEAR:
+        array = array.astype(np.uint8)
+    
+    return array
+
+
+def create_sample_arrays(sample_dir_path):
+    """Returns the resized image and labels arrays of a CubiCasa5k sample."""
+    img_file_path = os.path.join(sample_dir_path, "F1_scaled.png")
+    svg_file_path = os.path.join(sample_dir_path, "model.svg")
+
+    img_array = create_img_array(img_file_path)
+    labels_array = create_labels_array(img_array, svg_file_path)
+
+    img_array = resize_image(img_array, tf.image.ResizeMethod.BILINEAR)
+    labels_array = resize_image(labels_array, tf.image.ResizeMethod.NEAREST_NEIGHBOR)
+
+    return img_array, labels_array
+
+
+def get_sample_dir_names(cubicasa5k_root, dataset_split):
+    txt_file_path = os.path.join(cubicasa5k_root, dataset_split + ".txt")
+
+    with open(txt_file_path) as f:
+        samples_num = DATASET_SPLIT_SIZES[dataset_split]
+        return [os.path.normpath(line[1:-1]) for line in f.readlines()[:samples_num]]
+
+
+def get_sample_name(sample_dir_name):
+    """Returns the name of a sample, e.g. high_quality_architectural_2003."""
+    path, dir2 = os.path.split(os.path.normpath(sample_dir_name))
+    _, dir1 = os.path.split(path)
+    return dir1 + "_" + dir2
+
+
+def create_panoptic_label(labels_array, label_divisor):
+    """Returns the int32 panoptic label of a labels array.
+
+    The R channel of the labels array is the semantic label and the G, B
+    channels the high and low byte of the instance id.
+    """
+    labels_array = labels_array.astype(np.int32)
+    semantic_label = labels_array[:, :, 0]
+    instance_label = labels_array[:, :, 1] * 256 + labels_array[:, :, 2]
+
+    return semantic_label * label_divisor + instance_label
@@ -89,6 +89,7 @@ IMAGE = 'image'
 IMAGE_NAME = 'image_name'
 SEQUENCE_ID = 'sequence_id'
 NEXT_IMAGE = 'next_image'
+IS_VALID_SAMPLE = 'is_valid_sample'
 
 # TfExample keys.
 KEY_ENCODED_IMAGE = 'image/encoded'
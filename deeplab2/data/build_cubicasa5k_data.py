@@ -1,4 +1,5 @@
 import math
+import multiprocessing
 import os
 import shutil
 
@@ -22,6 +23,18 @@ flags.DEFINE_string('output_dir', None,
                     'Path to save converted TFRecord of TensorFlow examples.',
                     required=True)
 
+flags.DEFINE_integer('num_workers', 1,
+                     'Number of worker processes. Every worker writes whole '
+                     'shards.')
+
+flags.DEFINE_enum('label_format', 'raw', data_utils.PANOPTIC_LABEL_FORMATS,
+                  'Encoding of the panoptic label: int32 array (raw), 16-bit '
+                  'PNG (png16) or run-length encoding (rle).')
+
+flags.DEFINE_enum('compression_type', 'none', ['none', 'ZLIB', 'GZIP'],
+                  'Compression of the TFRecord files. Set the same '
+                  'compression_type in the dataset options of the config.')
+
 _SPLITS_TO_SIZES = dataset.CUBICASA5K_INFORMATION.splits_to_sizes
 _LABEL_DIVISOR = dataset.CUBICASA5K_INFORMATION.panoptic_label_divisor
 
@@ -31,7 +44,6 @@ _DATA_FORMAT_MAP = {
     'image': 'png',
     'label': 'png',
 }
-_PANOPTIC_LABEL_FORMAT = 'raw'
 
 _DATASET_SPLIT_MAP = {
     "train" : 4200,
@@ -97,20 +109,26 @@ def _generate_panoptic_label(panoptic_annotation_file):
     return panoptic_label.astype(np.int32)
 
 
-def _create_panoptic_label(image_path):
+def _create_panoptic_label(image_path, label_format):
     panoptic_annotation_file = _get_panoptic_annotation(image_path)
     panoptic_label = _generate_panoptic_label(panoptic_annotation_file)
 
-    return panoptic_label.tobytes(), _PANOPTIC_LABEL_FORMAT
+    return data_utils.encode_panoptic_label(panoptic_label,
+                                            label_format), label_format
 
 
-def _convert_dataset(cubicasa5k_root, dataset_split, output_dir):
+def _convert_dataset(cubicasa5k_root, dataset_split, output_dir,
+                     label_format='raw', compression_type='', pool=None):
     """Converts the specified dataset split to TFRecord format.
     
     Args:
       cubicasa5k_root: String, path to CubiCasa5k dataset root folder.
       dataset_split: String, the dataset split (one of `train`, `val` and `test`).
       output_dir: String, directory to write output TFRecords to.
+      label_format: String, encoding of the panoptic label.
+      compression_type: String, compression of the TFRecords ('', 'ZLIB' or
+        'GZIP').
+      pool: Optional multiprocessing pool writing the shards in parallel.
     """
     image_files = _get_images(cubicasa5k_root, dataset_split)
 
@@ -123,32 +141,69 @@ def _convert_dataset(cubicasa5k_root, dataset_split, output_dir):
     num_shards = _NUM_SHARDS_MAP[dataset_split]
     num_per_shard = int(math.ceil(len(image_files) / num_shards))
 
+    args = []
     for shard_id in range(num_shards):
-        logging.info('Creating shard %d of %d.', shard_id+1, num_shards)
         shard_filename = '%s-%05d-of-%05d.tfrecord' % (
             dataset_split, shard_id, num_shards)
         output_filename = os.path.join(output_dir, shard_filename)
-        with tf.io.TFRecordWriter(output_filename) as tfrecord_writer:
-            start_idx = shard_id * num_per_shard
-            end_idx = min((shard_id + 1) * num_per_shard, num_images)
-            for i in tqdm(range(start_idx, end_idx)):
-                # Read the image.
-                with tf.io.gfile.GFile(image_files[i], 'rb') as f:
-                    image_data = f.read()
-    
-                if dataset_split == 'test':
-                    label_data, label_format = None, None
-                else:
-                    label_data, label_format = _create_panoptic_label(image_files[i])
-                 
-                # Convert to tf example.
-                image_name = _get_image_name(image_files[i])
-                example = data_utils.create_tfexample(image_data,
-                                                      _DATA_FORMAT_MAP['image'],
-                                                      image_name, label_data,
-                                                      label_format)
-                 
-                tfrecord_writer.write(example.SerializeToString())
+        start_idx = shard_id * num_per_shard
+        end_idx = min((shard_id + 1) * num_per_shard, num_images)
+        args.append((image_files[start_idx:end_idx], dataset_split,
+                     output_filename, label_format, compression_type))
+
+    # Every shard is written by a single worker in the order of image_files,
+    # so the output does not depend on the number of workers.
+    if pool is not None:
+        results = pool.imap(_write_shard, args)
+    else:
+        results = map(_write_shard, args)
+
+    for output_filename in tqdm(results, total=num_shards):
+        logging.debug('Created shard %s.', output_filename)
+
+
+def _init_worker():
+    # The shards are written in parallel, so every worker uses one thread.
+    tf.config.threading.set_intra_op_parallelism_threads(1)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def _write_shard(args):
+    """Writes the TFRecord of a shard.
+
+    Args:
+      args: Tuple of the image files of the shard, the dataset split, the
+        output file name, the label format and the compression type.
+
+    Returns:
+      The output file name.
+    """
+    (image_files, dataset_split, output_filename, label_format,
+     compression_type) = args
+
+    options = tf.io.TFRecordOptions(compression_type=compression_type)
+    with tf.io.TFRecordWriter(output_filename, options) as tfrecord_writer:
+        for image_file in image_files:
+            # Read the image.
+            with tf.io.gfile.GFile(image_file, 'rb') as f:
+                image_data = f.read()
+
+            if dataset_split == 'test':
+                label_data, record_label_format = None, None
+            else:
+                label_data, record_label_format = _create_panoptic_label(
+                    image_file, label_format)
+
+            # Convert to tf example.
+            image_name = _get_image_name(image_file)
+            example = data_utils.create_tfexample(image_data,
+                                                  _DATA_FORMAT_MAP['image'],
+                                                  image_name, label_data,
+                                                  record_label_format)
+
+            tfrecord_writer.write(example.SerializeToString())
+
+    return output_filename
 
 
 def main(unused_argv):
@@ -160,9 +215,26 @@ def main(unused_argv):
         pass
     tf.io.gfile.makedirs(FLAGS.output_dir)
     
-    for dataset_split in ('train', 'val', 'test'):
-        logging.info('Starts to processing dataset split %s.', dataset_split)
-        _convert_dataset(FLAGS.cubicasa5k_root, dataset_split, FLAGS.output_dir)
+    compression_type = ('' if FLAGS.compression_type == 'none' else
+                        FLAGS.compression_type)
+
+    if FLAGS.num_workers > 1:
+        # TensorFlow is not fork-safe, so the workers are spawned.
+        ctx = multiprocessing.get_context('spawn')
+        pool = ctx.Pool(FLAGS.num_workers, initializer=_init_worker)
+    else:
+        pool = None
+
+    try:
+        for dataset_split in ('train', 'val', 'test'):
+            logging.info('Starts to processing dataset split %s.', dataset_split)
+            _convert_dataset(FLAGS.cubicasa5k_root, dataset_split,
+                             FLAGS.output_dir, FLAGS.label_format,
+                             compression_type, pool)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
 
 if __name__ == '__main__':
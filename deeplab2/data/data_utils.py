@@ -26,6 +26,9 @@ import tensorflow as tf
 from deeplab2 import common
 
 _PANOPTIC_LABEL_FORMAT = 'raw'
+# Formats of the panoptic label: int32 array ('raw'), 16-bit grayscale PNG
+# ('png16') or int32 (value, run length) pairs of the flattened label ('rle').
+PANOPTIC_LABEL_FORMATS = ('raw', 'png16', 'rle')
 
 
 def read_image(image_data):
@@ -71,6 +74,49 @@ def get_image_dims(image_data, check_is_rgb=False):
   return height, width
 
 
+def encode_panoptic_label(label, label_format=_PANOPTIC_LABEL_FORMAT):
+  """Encodes a 2-D panoptic label.
+
+  Args:
+    label: A 2-D integer array.
+    label_format: String, one of PANOPTIC_LABEL_FORMATS.
+
+  Returns:
+    The encoded label bytes.
+
+  Raises:
+    ValueError: If the label does not fit in the format or the format is not
+      supported.
+  """
+  label = np.asarray(label)
+  if label.ndim != 2:
+    raise ValueError('Expects a 2-D label, gets shape %s' % (label.shape,))
+
+  if label_format == 'raw':
+    return label.astype(np.int32).tobytes()
+
+  if label_format == 'png16':
+    max_value = np.iinfo(np.uint16).max
+    if label.size > 0 and (label.min() < 0 or label.max() > max_value):
+      raise ValueError('Label values out of the 16-bit range: [%d, %d]' %
+                       (label.min(), label.max()))
+    buffer = io.BytesIO()
+    Image.fromarray(label.astype(np.uint16)).save(buffer, format='png')
+    return buffer.getvalue()
+
+  if label_format == 'rle':
+    flat_label = label.astype(np.int32).ravel()
+    if flat_label.size == 0:
+      return b''
+    run_starts = np.flatnonzero(
+        np.concatenate([[True], flat_label[1:] != flat_label[:-1]]))
+    run_lengths = np.diff(np.append(run_starts, flat_label.size))
+    runs = np.stack([flat_label[run_starts], run_lengths], axis=1)
+    return runs.astype(np.int32).tobytes()
+
+  raise ValueError('Unsupported panoptic label format: %s' % label_format)
+
+
 def _int64_list_feature(values):
   """Returns a TF-Feature of int64_list.
 
@@ -115,8 +161,8 @@ def create_features(image_data,
     filename: String, image filename.
     label_data: String or byte stream of (potentially) encoded label data. If
       None, we skip to write it to tf.train.Example.
-    label_format: String, label data format, should be either 'png' or 'raw'. If
-      None, we skip to write it to tf.train.Example.
+    label_format: String, label data format, should be either 'png' or one of
+      PANOPTIC_LABEL_FORMATS. If None, we skip to write it to tf.train.Example.
 
   Returns:
     A dictionary of feature name to tf.train.Feature maaping.
@@ -146,7 +192,7 @@ def create_features(image_data,
   if label_data is None:
     return feature_dict
 
-  if label_format == 'png':
+  if label_format in ('png', 'png16'):
     label_height, label_width = get_image_dims(label_data)
     if (label_height, label_width) != (height, width):
       raise ValueError('Image (%s) and label (%s) shape mismatch' %
@@ -157,6 +203,12 @@ def create_features(image_data,
     if len(label_data) != expected_label_size:
       raise ValueError('Expects raw label data length %d, gets %d' %
                        (expected_label_size, len(label_data)))
+  elif label_format == 'rle':
+    # Run-length encoded label stores int32 (value, run length) pairs.
+    runs = np.frombuffer(label_data, dtype=np.int32).reshape(-1, 2)
+    if runs[:, 1].sum() != height * width:
+      raise ValueError('Expects run-length encoded label of %d pixels, gets %d'
+                       % (height * width, runs[:, 1].sum()))
   else:
     raise ValueError('Unsupported label format: %s' % label_format)
 
@@ -320,6 +372,11 @@ class SegmentationDecoder(object):
     }
     if decode_groundtruth_label:
       self._keys_to_features[common.KEY_ENCODED_LABEL] = string_feature
+      if self._is_panoptic_dataset:
+        # Records written before the label format was stored are raw.
+        self._keys_to_features[common.KEY_LABEL_FORMAT] = (
+            tf.io.FixedLenFeature((), tf.string,
+                                  default_value=_PANOPTIC_LABEL_FORMAT))
     if self._is_video_dataset:
       self._keys_to_features[common.KEY_SEQUENCE_ID] = string_feature
       self._keys_to_features[common.KEY_FRAME_ID] = string_feature
@@ -347,17 +404,39 @@ class SegmentationDecoder(object):
     image.set_shape([None, None, 3])
     return image
 
-  def _decode_label(self, parsed_tensors, label_key):
+  def _decode_panoptic_label(self, parsed_tensors, label_key, label_format):
+    """Decodes panoptic label under label_key from parsed tensors."""
+    label_data = parsed_tensors[label_key]
+    label_shape = tf.stack([
+        parsed_tensors[common.KEY_IMAGE_HEIGHT],
+        parsed_tensors[common.KEY_IMAGE_WIDTH], 1
+    ])
+
+    def decode_raw():
+      return tf.io.decode_raw(label_data, out_type=tf.int32)
+
+    def decode_png16():
+      label = tf.io.decode_png(label_data, channels=1, dtype=tf.dtypes.uint16)
+      return tf.reshape(tf.cast(label, tf.int32), [-1])
+
+    def decode_rle():
+      runs = tf.reshape(tf.io.decode_raw(label_data, out_type=tf.int32),
+                        [-1, 2])
+      return tf.repeat(runs[:, 0], runs[:, 1])
+
+    flattened_label = tf.case(
+        [(tf.equal(label_format, 'png16'), decode_png16),
+         (tf.equal(label_format, 'rle'), decode_rle)],
+        default=decode_raw, exclusive=True)
+    return tf.reshape(flattened_label, label_shape)
+
+  def _decode_label(self, parsed_tensors, label_key, label_format=None):
     """Decodes segmentation label under label_key from parsed tensors."""
     if self._is_panoptic_dataset:
-      flattened_label = tf.io.decode_raw(
-          parsed_tensors[label_key], out_type=tf.int32)
-      label_shape = tf.stack([
-          parsed_tensors[common.KEY_IMAGE_HEIGHT],
-          parsed_tensors[common.KEY_IMAGE_WIDTH], 1
-      ])
-      label = tf.reshape(flattened_label, label_shape)
-      return label
+      if label_format is None:
+        label_format = tf.constant(_PANOPTIC_LABEL_FORMAT)
+      return self._decode_panoptic_label(parsed_tensors, label_key,
+                                         label_format)
 
     label = tf.io.decode_image(parsed_tensors[label_key], channels=1)
     label.set_shape([None, None, 1])
@@ -377,9 +456,13 @@ class SegmentationDecoder(object):
             tf.cast(parsed_tensors[common.KEY_IMAGE_WIDTH], dtype=tf.int32),
     }
     return_dict['label'] = None
+    label_format = None
+    if self._decode_groundtruth_label and self._is_panoptic_dataset:
+      label_format = parsed_tensors[common.KEY_LABEL_FORMAT]
     if self._decode_groundtruth_label:
       return_dict['label'] = self._decode_label(parsed_tensors,
-                                                common.KEY_ENCODED_LABEL)
+                                                common.KEY_ENCODED_LABEL,
+                                                label_format)
     if self._is_video_dataset:
       return_dict['sequence'] = parsed_tensors[common.KEY_SEQUENCE_ID]
     if self._use_two_frames:
@@ -387,13 +470,13 @@ class SegmentationDecoder(object):
           parsed_tensors, common.KEY_ENCODED_PREV_IMAGE)
       if self._decode_groundtruth_label:
         return_dict['prev_label'] = self._decode_label(
-            parsed_tensors, common.KEY_ENCODED_PREV_LABEL)
+            parsed_tensors, common.KEY_ENCODED_PREV_LABEL, label_format)
     if self._use_next_frame:
       return_dict['next_image'] = self._decode_image(
           parsed_tensors, common.KEY_ENCODED_NEXT_IMAGE)
       if self._decode_groundtruth_label:
         return_dict['next_label'] = self._decode_label(
-            parsed_tensors, common.KEY_ENCODED_NEXT_LABEL)
+            parsed_tensors, common.KEY_ENCODED_NEXT_LABEL, label_format)
     if self._is_depth_dataset and self._decode_groundtruth_label:
       return_dict['depth'] = self._decode_label(
           parsed_tensors, common.KEY_ENCODED_DEPTH)
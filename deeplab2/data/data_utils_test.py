@@ -89,6 +89,44 @@ class DataUtilsTest(tf.test.TestCase):
     decoded_label = parsed_tensors['label'].numpy()
     np.testing.assert_array_equal(label, decoded_label[..., 0])
 
+  def test_encode_and_decode_compressed_panoptic(self):
+    test_image_height = 31
+    test_image_width = 17
+    filename = 'dummy'
+
+    image = self._create_test_image(test_image_height, test_image_width)
+    # Create dummy panoptic label with long runs and 16-bit values.
+    label = (image[..., 0].astype(np.int32) // 64) * 256
+    label[5:9, :] = 3 * 256 + 7
+
+    parser = data_utils.SegmentationDecoder(is_panoptic_dataset=True)
+    for label_format in data_utils.PANOPTIC_LABEL_FORMATS:
+      example = data_utils.create_tfexample(
+          image_data=_encode_png_image(image),
+          image_format='png', filename=filename,
+          label_data=data_utils.encode_panoptic_label(label, label_format),
+          label_format=label_format)
+      parsed_tensors = parser(example.SerializeToString())
+
+      decoded_label = parsed_tensors['label'].numpy()
+      self.assertEqual(decoded_label.dtype, np.int32)
+      np.testing.assert_array_equal(label, decoded_label[..., 0])
+
+  def test_encode_panoptic_label_out_of_png16_range(self):
+    label = np.full((2, 3), 1 << 16, dtype=np.int32)
+    with self.assertRaises(ValueError):
+      data_utils.encode_panoptic_label(label, 'png16')
+
+  def test_rle_label_size_mismatch(self):
+    image = self._create_test_image(4, 5)
+    label_data = data_utils.encode_panoptic_label(
+        np.zeros((4, 4), dtype=np.int32), 'rle')
+    with self.assertRaises(ValueError):
+      data_utils.create_tfexample(
+          image_data=_encode_png_image(image),
+          image_format='png', filename='dummy',
+          label_data=label_data, label_format='rle')
+
 
 if __name__ == '__main__':
   tf.test.main()
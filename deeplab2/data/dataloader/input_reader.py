@@ -17,10 +17,41 @@
 
 import tensorflow as tf
 
+from deeplab2 import common
+
 _NUM_INPUTS_PROCESSED_CONCURRENTLY = 32
 _SHUFFLE_BUFFER_SIZE = 1000
 
 
+def _pad_to_multiple_of_batch_size(dataset, batch_size):
+  """Pads a dataset of dicts to a multiple of batch_size examples.
+
+  Every example gets a boolean common.IS_VALID_SAMPLE entry. The padding
+  examples are copies of the first example, with common.IS_VALID_SAMPLE set to
+  False, so that consumers can ignore them.
+
+  Args:
+    dataset: A tf.data.Dataset of dicts.
+    batch_size: The batch size.
+
+  Returns:
+    A tf.data.Dataset whose number of examples is a multiple of batch_size.
+  """
+  def set_is_valid(is_valid):
+    def fn(sample):
+      sample = dict(sample)
+      sample[common.IS_VALID_SAMPLE] = tf.constant(is_valid)
+      return sample
+    return fn
+
+  padding = dataset.take(1).map(set_is_valid(False)).repeat(batch_size - 1)
+  dataset = dataset.map(set_is_valid(True)).concatenate(padding)
+  # The windows keep all the examples and drop the padding past the last
+  # multiple of batch_size.
+  return dataset.window(batch_size, drop_remainder=True).flat_map(
+      tf.data.Dataset.zip)
+
+
 class InputReader(object):
   """Input function that creates a dataset from files."""
 
@@ -29,7 +60,8 @@ class InputReader(object):
                decoder_fn,
                generator_fn=None,
                use_panoptic_copy_paste=False,
-               is_training=False):
+               is_training=False,
+               compression_type=''):
     """Initializes the input reader.
 
     Args:
@@ -42,14 +74,17 @@ class InputReader(object):
       use_panoptic_copy_paste: If the panoptic_copy_paste augmentation is used
         or not (default: False).
       is_training: If this dataset is used for training or not (default: False).
+      compression_type: The compression of the TFRecord files, one of '' (no
+        compression), 'ZLIB' or 'GZIP' (default: '').
     """
     self._file_pattern = file_pattern
     self._is_training = is_training
     self._decoder_fn = decoder_fn
     self._generator_fn = generator_fn
     self._use_panoptic_copy_paste = use_panoptic_copy_paste
+    self._compression_type = compression_type
 
-  def __call__(self, batch_size=1, max_num_examples=-1):
+  def __call__(self, batch_size=1, max_num_examples=-1, pad_remainder=False):
     """Provides tf.data.Dataset object.
 
     Args:
@@ -57,10 +92,17 @@ class InputReader(object):
       max_num_examples: Positive integer or -1. If positive, the returned
         dataset will only take (at most) this number of examples and raise
         tf.errors.OutOfRangeError after that (default: -1).
+      pad_remainder: If True, the last batch is completed with padding examples
+        instead of being dropped, and every example has a common.IS_VALID_SAMPLE
+        entry, False for the padding (default: False).
 
     Returns:
       tf.data.Dataset object.
     """
+    def read_tfrecords(filename):
+      return tf.data.TFRecordDataset(
+          filename, compression_type=self._compression_type)
+
     def decode_dataset():
       dataset = tf.data.Dataset.list_files(
           self._file_pattern, shuffle=self._is_training)
@@ -75,7 +117,7 @@ class InputReader(object):
       # During evaluation, read input in consecutive order for tasks requiring
       # such behavior.
       dataset = dataset.interleave(
-          map_func=tf.data.TFRecordDataset,
+          map_func=read_tfrecords,
           cycle_length=(_NUM_INPUTS_PROCESSED_CONCURRENTLY
                         if self._is_training else 1),
           num_parallel_calls=tf.data.experimental.AUTOTUNE,
@@ -102,6 +144,8 @@ class InputReader(object):
         dataset = tf.data.Dataset.zip((dataset, panoptic_copy_pate_dataset))
       dataset = dataset.map(
           self._generator_fn, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+    if pad_remainder:
+      dataset = _pad_to_multiple_of_batch_size(dataset, batch_size)
     dataset = dataset.batch(batch_size, drop_remainder=True)
     dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
     return dataset
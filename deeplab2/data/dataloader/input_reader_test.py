@@ -0,0 +1,48 @@
+# coding=utf-8
+# Copyright 2022 The Deeplab2 Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for input_reader."""
+
+from absl.testing import parameterized
+import tensorflow as tf
+
+from deeplab2 import common
+from deeplab2.data.dataloader import input_reader
+
+
+class InputReaderTest(tf.test.TestCase, parameterized.TestCase):
+
+  @parameterized.parameters((5, 1, 5), (5, 2, 6), (5, 4, 8), (6, 3, 6),
+                            (2, 4, 4))
+  def test_pad_to_multiple_of_batch_size(self, num_examples, batch_size,
+                                         expected_num_examples):
+    dataset = tf.data.Dataset.range(num_examples).map(
+        lambda x: {common.IMAGE_NAME: x})
+    dataset = input_reader._pad_to_multiple_of_batch_size(dataset, batch_size)
+    samples = list(dataset.as_numpy_iterator())
+
+    self.assertLen(samples, expected_num_examples)
+    self.assertEqual(
+        [sample[common.IMAGE_NAME] for sample in samples[:num_examples]],
+        list(range(num_examples)))
+    for sample in samples[:num_examples]:
+      self.assertTrue(sample[common.IS_VALID_SAMPLE])
+    for sample in samples[num_examples:]:
+      self.assertFalse(sample[common.IS_VALID_SAMPLE])
+      self.assertEqual(sample[common.IMAGE_NAME], 0)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -224,6 +224,37 @@ class PanopticSampleGeneratorTest(tf.test.TestCase):
             offset_weights,
             self._test_target_data_dir + 'offset_weights.png'))
 
+  def test_vectorized_gt_center_and_offset_match_per_instance_loop(self):
+    tf.random.set_seed(0)
+    np.random.seed(0)
+    small_instances = {'threshold': 40, 'weight': 3.0}
+    dataset_info = dataset.CITYSCAPES_PANOPTIC_INFORMATION._asdict()
+    generator = sample_generator.PanopticSampleGenerator(
+        dataset_info,
+        focus_small_instances=small_instances,
+        is_training=True,
+        crop_size=[41, 53])
+    label_divisor = dataset_info['panoptic_label_divisor']
+    semantic_label = np.random.choice(
+        [0, 11, 13, dataset_info['ignore_label']], size=(41, 53, 1))
+    instance_label = np.random.randint(0, 6, size=(41, 53, 1))
+    panoptic_label = tf.convert_to_tensor(
+        semantic_label * label_divisor + instance_label, dtype=tf.int32)
+    semantic_weights = tf.ones_like(panoptic_label, dtype=tf.float32)
+
+    center, offset, weights, _, _, _ = (
+        generator._generate_gt_center_and_offset(panoptic_label,
+                                                 semantic_weights))
+    # A next-frame label makes the generator loop over the instances.
+    (expected_center, expected_offset, expected_weights, _, _,
+     _) = generator._generate_gt_center_and_offset(
+         panoptic_label, semantic_weights,
+         next_panoptic_label=panoptic_label)
+
+    np.testing.assert_array_equal(center.numpy(), expected_center.numpy())
+    np.testing.assert_array_equal(offset.numpy(), expected_offset.numpy())
+    np.testing.assert_array_equal(weights.numpy(), expected_weights.numpy())
+
   def test_input_generator_eval(self):
     tf.random.set_seed(0)
     np.random.seed(0)
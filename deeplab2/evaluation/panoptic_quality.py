@@ -29,12 +29,36 @@ import numpy as np
 import tensorflow as tf
 
 
+# The maximum length of the arrays counted with np.bincount: the largest
+# panoptic label + 1, and the number of (groundtruth, predicted) segment pairs.
+_MAX_BINCOUNT_LENGTH = 1 << 24
+
+
 def _ids_to_counts(id_array: np.ndarray) -> Mapping[int, int]:
   """Given a numpy array, a mapping from each unique entry to its count."""
   ids, counts = np.unique(id_array, return_counts=True)
   return dict(zip(ids, counts))
 
 
+def _dense_id_lookup_table(
+    id_array: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+  """Relabels the entries of a numpy array of non-negative integers densely.
+
+  Args:
+    id_array: A numpy array of non-negative integers.
+
+  Returns:
+    ids: The sorted unique entries.
+    dense_ids: An array mapping every entry of ids to its index in ids.
+  """
+  is_present = np.zeros(id_array.max() + 1, dtype=bool)
+  is_present[id_array] = True
+  ids = np.flatnonzero(is_present)
+  dense_ids = np.zeros(len(is_present), dtype=np.intp)
+  dense_ids[ids] = np.arange(len(ids))
+  return ids, dense_ids
+
+
 class PanopticQuality(tf.keras.metrics.Metric):
   """Metric class for Panoptic Quality.
 
@@ -109,14 +133,21 @@ class PanopticQuality(tf.keras.metrics.Metric):
       The value of the metrics (iou, tp, fn, fp) over all comparisons, as a
       float scalar.
     """
+    gt_panoptic_array = gt_panoptic_label.numpy()
+    pred_panoptic_array = pred_panoptic_label.numpy()
+    result = self._compare_and_accumulate_with_bincount(gt_panoptic_array,
+                                                        pred_panoptic_array)
+    if result is not None:
+      return result
+
     iou_per_class = np.zeros(self.num_classes, dtype=np.float64)
     tp_per_class = np.zeros(self.num_classes, dtype=np.float64)
     fn_per_class = np.zeros(self.num_classes, dtype=np.float64)
     fp_per_class = np.zeros(self.num_classes, dtype=np.float64)
 
     # Pre-calculate areas for all groundtruth and predicted segments.
-    gt_segment_areas = _ids_to_counts(gt_panoptic_label.numpy())
-    pred_segment_areas = _ids_to_counts(pred_panoptic_label.numpy())
+    gt_segment_areas = _ids_to_counts(gt_panoptic_array)
+    pred_segment_areas = _ids_to_counts(pred_panoptic_array)
 
     # We assume the ignored segment has instance id = 0.
     ignored_panoptic_id = self.ignored_label * self.max_instances_per_category
@@ -197,6 +228,119 @@ class PanopticQuality(tf.keras.metrics.Metric):
       fp_per_class[category] += 1
     return iou_per_class, tp_per_class, fn_per_class, fp_per_class
 
+  def _compare_and_accumulate_with_bincount(
+      self, gt_panoptic_label: np.ndarray, pred_panoptic_label: np.ndarray
+  ) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+    """Like compare_and_accumulate, with dense segment ids and np.bincount.
+
+    The segment ids are relabeled densely, so that the intersection areas of
+    all the (groundtruth, predicted) segment pairs are counted by a single
+    np.bincount and compared with array operations. The results are identical
+    to those of compare_and_accumulate.
+
+    Args:
+      gt_panoptic_label: A numpy array that combines label array from categories
+        and instances for ground truth.
+      pred_panoptic_label: A numpy array that combines label array from
+        categories and instances for the prediction.
+
+    Returns:
+      The value of the metrics (iou, tp, fn, fp) over all comparisons, or None
+      if the labels are not non-negative integers, are too large to be counted
+      with np.bincount, or have categories that are neither in
+      [0, num_classes) nor the ignored label.
+    """
+    for panoptic_label in (gt_panoptic_label, pred_panoptic_label):
+      if (not np.issubdtype(panoptic_label.dtype, np.integer) or
+          panoptic_label.size == 0 or panoptic_label.min() < 0 or
+          panoptic_label.max() >= _MAX_BINCOUNT_LENGTH):
+        return None
+
+    gt_ids, gt_dense_ids = _dense_id_lookup_table(gt_panoptic_label)
+    pred_ids, pred_dense_ids = _dense_id_lookup_table(pred_panoptic_label)
+    num_gt_segments = len(gt_ids)
+    num_pred_segments = len(pred_ids)
+    if num_gt_segments * num_pred_segments > _MAX_BINCOUNT_LENGTH:
+      return None
+
+    gt_categories = gt_ids // self.max_instances_per_category
+    pred_categories = pred_ids // self.max_instances_per_category
+    # np.bincount would silently count other categories in longer arrays.
+    for categories in (gt_categories, pred_categories):
+      if not np.all((categories < self.num_classes) |
+                    (categories == self.ignored_label)):
+        return None
+
+    # Counts the pixels of every (groundtruth segment, predicted segment) pair,
+    # indexed by gt_dense_id * num_pred_segments + pred_dense_id.
+    pair_id_array = np.take(gt_dense_ids * num_pred_segments,
+                            gt_panoptic_label.ravel())
+    pair_id_array += np.take(pred_dense_ids, pred_panoptic_label.ravel())
+    intersection_areas = np.bincount(
+        pair_id_array, minlength=num_gt_segments * num_pred_segments)
+    intersection_area_matrix = intersection_areas.reshape(
+        num_gt_segments, num_pred_segments)
+    gt_segment_areas = intersection_area_matrix.sum(axis=1)
+    pred_segment_areas = intersection_area_matrix.sum(axis=0)
+
+    # The overlap of every predicted segment with the ignored segment, which
+    # has instance id = 0.
+    ignored_panoptic_id = self.ignored_label * self.max_instances_per_category
+    ignored_index = np.searchsorted(gt_ids, ignored_panoptic_id)
+    if (ignored_index < num_gt_segments and
+        gt_ids[ignored_index] == ignored_panoptic_id):
+      prediction_ignored_overlap = intersection_area_matrix[ignored_index]
+    else:
+      prediction_ignored_overlap = np.zeros_like(pred_segment_areas)
+
+    # The intersecting segment pairs of the same category, in the order of the
+    # intersection ids of compare_and_accumulate, so that the IoUs are summed
+    # in the same order.
+    pair_ids = np.flatnonzero(intersection_areas)
+    gt_indices, pred_indices = np.divmod(pair_ids, num_pred_segments)
+    same_category = (
+        (gt_categories[gt_indices] == pred_categories[pred_indices]) &
+        (pred_categories[pred_indices] != self.ignored_label))
+    pair_ids = pair_ids[same_category]
+    gt_indices = gt_indices[same_category]
+    pred_indices = pred_indices[same_category]
+    pair_intersection_areas = intersection_areas[pair_ids]
+    # Union between the groundtruth and predicted segments being compared does
+    # not include the portion of the predicted segment that consists of
+    # groundtruth "void" pixels.
+    unions = (
+        gt_segment_areas[gt_indices] + pred_segment_areas[pred_indices] -
+        pair_intersection_areas - prediction_ignored_overlap[pred_indices])
+    ious = pair_intersection_areas / unions
+    matched = ious > 0.5
+    gt_indices = gt_indices[matched]
+    pred_indices = pred_indices[matched]
+    matched_categories = gt_categories[gt_indices]
+
+    iou_per_class = np.bincount(
+        matched_categories, weights=ious[matched],
+        minlength=self.num_classes).astype(np.float64)
+    tp_per_class = np.bincount(
+        matched_categories, minlength=self.num_classes).astype(np.float64)
+
+    # Failing to detect a void segment is not a false negative.
+    gt_unmatched = gt_categories != self.ignored_label
+    gt_unmatched[gt_indices] = False
+    fn_per_class = np.bincount(
+        gt_categories[gt_unmatched],
+        minlength=self.num_classes).astype(np.float64)
+
+    # A false positive is not penalized if is mostly ignored in the
+    # groundtruth.
+    pred_unmatched = (
+        (pred_categories != self.ignored_label) &
+        (prediction_ignored_overlap / pred_segment_areas <= 0.5))
+    pred_unmatched[pred_indices] = False
+    fp_per_class = np.bincount(
+        pred_categories[pred_unmatched],
+        minlength=self.num_classes).astype(np.float64)
+    return iou_per_class, tp_per_class, fn_per_class, fp_per_class
+
   def update_state(
       self,
       y_true: tf.Tensor,
@@ -15,6 +15,7 @@
 
 """Tests for panoptic_quality metrics."""
 import collections
+from unittest import mock
 
 from absl import logging
 import numpy as np
@@ -209,6 +210,64 @@ class PanopticQualityMetricTest(tf.test.TestCase):
     # fp
     self.assertAlmostEqual(result[5], 2. / 3, places=4)
 
+  def test_bincount_matches_unique_based_comparison(self):
+    np.random.seed(0)
+    max_instances_per_category = 256
+    ignored_label = 255
+    pq_obj = panoptic_quality.PanopticQuality(
+        num_classes=4,
+        max_instances_per_category=max_instances_per_category,
+        ignored_label=ignored_label,
+        offset=256 * 256 * 256)
+
+    # Blocky maps, so that some segments match.
+    gt_class = np.random.randint(0, 4, (6, 8)).repeat(5, 0).repeat(5, 1)
+    gt_class[np.random.rand(30, 40) < 0.1] = ignored_label
+    gt_instance = np.random.randint(0, 3, (6, 8)).repeat(5, 0).repeat(5, 1)
+    pred_class = np.where(
+        np.random.rand(30, 40) < 0.2, np.random.randint(0, 4, (30, 40)),
+        gt_class)
+    pred_instance = np.where(
+        np.random.rand(30, 40) < 0.2, np.random.randint(0, 3, (30, 40)),
+        gt_instance)
+    y_true = combine_maps(gt_class, gt_instance, max_instances_per_category)
+    y_pred = combine_maps(pred_class, pred_instance, max_instances_per_category)
+
+    result = pq_obj.compare_and_accumulate(y_true, y_pred)
+    # Labels beyond _MAX_BINCOUNT_LENGTH fall back to the np.unique counts.
+    with mock.patch.object(panoptic_quality, '_MAX_BINCOUNT_LENGTH', 0):
+      expected_result = pq_obj.compare_and_accumulate(y_true, y_pred)
+
+    self.assertGreater(np.sum(expected_result[1]), 0)
+    for value, expected_value in zip(result, expected_result):
+      np.testing.assert_array_equal(value, expected_value)
+
+  def test_bincount_skips_categories_out_of_range(self):
+    max_instances_per_category = 256
+    ignored_label = 255
+    pq_obj = panoptic_quality.PanopticQuality(
+        num_classes=4,
+        max_instances_per_category=max_instances_per_category,
+        ignored_label=ignored_label,
+        offset=256 * 256 * 256)
+
+    gt_class = np.array([[0, 1], [3, ignored_label]])
+    instance = np.array([[0, 1], [1, 0]])
+    gt_panoptic_label = gt_class * max_instances_per_category + instance
+    self.assertIsNotNone(
+        pq_obj._compare_and_accumulate_with_bincount(gt_panoptic_label,
+                                                     gt_panoptic_label))
+
+    # Category 4 is neither a class nor the ignored label.
+    pred_class = np.array([[0, 1], [4, ignored_label]])
+    pred_panoptic_label = pred_class * max_instances_per_category + instance
+    self.assertIsNone(
+        pq_obj._compare_and_accumulate_with_bincount(gt_panoptic_label,
+                                                     pred_panoptic_label))
+    self.assertIsNone(
+        pq_obj._compare_and_accumulate_with_bincount(pred_panoptic_label,
+                                                     gt_panoptic_label))
+
 
 if __name__ == '__main__':
   tf.test.main()
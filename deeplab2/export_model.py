@@ -16,13 +16,14 @@
 r"""Script to export deeplab model to saved model."""
 
 import functools
-from typing import Any, MutableMapping, Sequence, Text
+from typing import Any, Mapping, MutableMapping, Sequence, Text
 
 from absl import app
 from absl import flags
 import tensorflow as tf
 
 from google.protobuf import text_format
+from deeplab2 import common
 from deeplab2 import config_pb2
 from deeplab2.data import dataset
 from deeplab2.data.preprocessing import input_preprocessing
@@ -53,17 +54,156 @@ _FLAGS_MERGE_WITH_TF_OP = flags.DEFINE_boolean(
     'paper, but the saved model would require specifically compiled TensorFlow '
     'to run.')
 
+_FLAGS_TILE_OVERLAP = flags.DEFINE_integer(
+    'tile_overlap',
+    default=128,
+    help='Overlap in pixels of neighbouring crops in the tiled inference, '
+    'which runs crops of the eval crop size over the input at its native '
+    'resolution instead of resizing it. At most half of the crop size.')
+
+_FLAGS_TILE_BATCH_SIZE = flags.DEFINE_integer(
+    'tile_batch_size',
+    default=4,
+    help='Number of crops run together in the tiled inference.')
+
+_FLAGS_OUTPUT_KEYS = flags.DEFINE_list(
+    'output_keys',
+    default=[],
+    help='Comma-separated keys of the results returned by the exported model, '
+    'e.g. panoptic_pred,instance_center_pred. The results which are not '
+    'returned are not upsampled to input size. All the results are returned '
+    'if empty.')
+
+_FLAGS_TTA_SCALES = flags.DEFINE_list(
+    'tta_scales',
+    default=['0.75', '1.0', '1.25'],
+    help='Comma-separated scales of the test-time augmentation signature '
+    '`tta`, which averages the predictions of the input resized by every '
+    'scale. The other signatures run a single scale. No `tta` signature is '
+    'exported if empty.')
+
+_FLAGS_TTA_ADD_FLIPPED_IMAGES = flags.DEFINE_boolean(
+    'tta_add_flipped_images',
+    default=True,
+    help='Whether the `tta` signature also averages the predictions of the '
+    'horizontally flipped input at every scale.')
+
+# Padding value of the tiled inference, the mean pixel value.
+_PAD_VALUE = 127.5
+
+# The inference options of the single-scale signatures.
+_SINGLE_SCALE_OPTIONS = {'eval_scales': [1.0], 'add_flipped_images': False}
+
+
+def _get_num_tiles(size, tile_size, stride):
+  """Returns the number of tiles of stride `stride` covering `size` pixels."""
+  return (tf.maximum(size - tile_size, 0) + stride - 1) // stride + 1
+
+
+def _get_blending_window(size, overlap):
+  """Returns the 1-D weights of a tile, linearly ramping over the overlaps."""
+  ramp = (tf.range(size, dtype=tf.float32) + 0.5) / overlap
+  return tf.minimum(tf.minimum(ramp, tf.reverse(ramp, [0])), 1.0)
+
+
+def _get_crops(image, y, xs, crop_height, crop_width):
+  """Returns the float crops of the image at row y and columns xs.
+
+  The crops past the bottom or right border of the image are padded with
+  _PAD_VALUE, so that the image itself is never padded or cast as a whole.
+  """
+
+  def _get_crop(x):
+    crop = tf.cast(image[y:y + crop_height, x:x + crop_width, :], tf.float32)
+    return tf.pad(crop, [[0, crop_height - tf.shape(crop)[0]],
+                         [0, crop_width - tf.shape(crop)[1]], [0, 0]],
+                  constant_values=_PAD_VALUE)
+
+  crops = tf.map_fn(_get_crop, xs, fn_output_signature=tf.float32)
+  return tf.ensure_shape(crops, [None, crop_height, crop_width, 3])
+
+
+def _stitch_columns(tiles, stride):
+  """Overlap-adds a row of tiles.
+
+  Args:
+    tiles: A tf.Tensor of shape [num_cols, tile_height, tile_width, depth],
+      where tile i starts at column i * stride.
+    stride: An integer, the horizontal stride of the tiles.
+
+  Returns:
+    A tf.Tensor of shape [tile_height, (num_cols - 1) * stride + tile_width,
+      depth] with the sum of the tiles.
+  """
+  tile_height, tile_width, depth = tiles.get_shape().as_list()[1:]
+  overlap = tile_width - stride
+  heads = tiles[:, :, :stride, :]
+  tails = tiles[:, :, stride:, :]
+  # The tail of every tile overlaps the head of the next one.
+  prev_tails = tf.concat([tf.zeros_like(tails[:1]), tails[:-1]], axis=0)
+  blocks = heads + tf.pad(prev_tails,
+                          [[0, 0], [0, 0], [0, stride - overlap], [0, 0]])
+  strip = tf.reshape(tf.transpose(blocks, [1, 0, 2, 3]),
+                     [tile_height, -1, depth])
+  return tf.concat([strip, tails[-1]], axis=1)
+
+
+def _normalize_block(block, y, height, width):
+  """Crops a block of blended rows starting at row y to the image.
+
+  Args:
+    block: A tf.Tensor of shape [rows, padded_width, depth + 1], with the
+      weighted sums of the maps followed by the sum of the weights.
+    y: An integer, the image row of the first row of the block.
+    height: An integer, the height of the image.
+    width: An integer, the width of the image.
+
+  Returns:
+    A tf.Tensor of shape [min(rows, max(height - y, 0)), width, depth] with the
+      blended maps.
+  """
+  block = block[:tf.clip_by_value(height - y, 0, tf.shape(block)[0]), :width]
+  return block[:, :, :-1] / block[:, :, -1:]
+
+
+def _pad_to_size(prediction, height, width):
+  """Pads a prediction of shape [1, h, w, ...] to [height, width, ...]."""
+  paddings = [[0, height - tf.shape(prediction)[1]],
+              [0, width - tf.shape(prediction)[2]]]
+  paddings += [[0, 0]] * (prediction.get_shape().rank - 3)
+  return tf.pad(prediction[0], paddings)
+
 
 class DeepLabModule(tf.Module):
   """Class that runs DeepLab inference end-to-end."""
 
   def __init__(self, config: config_pb2.ExperimentOptions, ckpt_path: Text,
-               use_tf_op: bool = False):
+               use_tf_op: bool = False, tile_overlap: int = 128,
+               tile_batch_size: int = 4, output_keys: Sequence[Text] = (),
+               tta_scales: Sequence[float] = (0.75, 1.0, 1.25),
+               tta_add_flipped_images: bool = True):
     super().__init__(name='DeepLabModule')
 
     dataset_options = config.eval_dataset_options
     dataset_name = dataset_options.dataset
     crop_height, crop_width = dataset_options.crop_size
+    if not 0 < tile_overlap <= min(crop_height, crop_width) // 2:
+      raise ValueError('tile_overlap (%d) must be in (0, %d].' %
+                       (tile_overlap, min(crop_height, crop_width) // 2))
+    if tile_batch_size < 1:
+      raise ValueError('tile_batch_size (%d) must be at least 1.' %
+                       tile_batch_size)
+    self._crop_height = crop_height
+    self._crop_width = crop_width
+    self._tile_overlap = tile_overlap
+    self._tile_batch_size = tile_batch_size
+    self._output_keys = list(output_keys)
+    self._tta_options = {
+        'eval_scales': list(tta_scales),
+        'add_flipped_images': tta_add_flipped_images
+    }
+    self._num_classes = dataset.MAP_NAME_TO_DATASET_INFO[
+        dataset_name].num_classes
 
     config.evaluator_options.merge_semantic_and_instance_with_tf_op = use_tf_op
     # Disable drop path and recompute grad as they are only used in training.
@@ -75,8 +215,18 @@ class DeepLabModule(tf.Module):
     meta_architecture = config.model_options.WhichOneof('meta_architecture')
     self._is_motion_deeplab = meta_architecture == 'motion_deeplab'
     self._is_vip_deeplab = meta_architecture == 'vip_deeplab'
+    # The tiled inference post-processes the stitched Panoptic-DeepLab maps.
+    self._supports_tiling = meta_architecture == 'panoptic_deeplab'
+    # The two-frame architectures are only exported with batch size of 1.
+    self._supports_batching = not (self._is_motion_deeplab or
+                                   self._is_vip_deeplab)
+    # MaX-DeepLab does not support multi-scale inference, and the two-frame
+    # architectures are only exported at a single scale.
+    self._supports_tta = bool(tta_scales) and meta_architecture not in (
+        'max_deeplab', 'motion_deeplab', 'vip_deeplab')
 
-    # For now we only support batch size of 1 for saved model.
+    # The model is built with batch size of 1, but batch_call runs it on
+    # batches of any size.
     input_shape = train_lib.build_deeplab_model(
         deeplab_model, (crop_height, crop_width), batch_size=1)
     self._input_depth = input_shape[-1]
@@ -98,14 +248,63 @@ class DeepLabModule(tf.Module):
         resize_factor=dataset_options.resize_factor,
         is_training=False)
 
+  @property
+  def supports_tiling(self) -> bool:
+    return self._supports_tiling
+
+  @property
+  def supports_batching(self) -> bool:
+    return self._supports_batching
+
+  @property
+  def supports_tta(self) -> bool:
+    return self._supports_tta
+
+  def _select_outputs(
+      self, outputs: MutableMapping[Text, Any]) -> MutableMapping[Text, Any]:
+    """Returns the results in output_keys, or all of them if it is empty."""
+    if not self._output_keys:
+      return outputs
+    unknown_keys = [key for key in self._output_keys if key not in outputs]
+    if unknown_keys:
+      raise ValueError('Unknown output keys %s, the model returns %s.' %
+                       (unknown_keys, sorted(outputs.keys())))
+    return {key: outputs[key] for key in self._output_keys}
+
   def get_input_spec(self):
     """Returns TensorSpec of input tensor needed for inference."""
     # We expect a single 3D, uint8 tensor with shape [height, width, channels].
     return tf.TensorSpec(shape=[None, None, self._input_depth], dtype=tf.uint8)
 
+  def get_batch_input_spec(self):
+    """Returns TensorSpecs of the input tensors needed for batch inference."""
+    # We expect a 4D, uint8 tensor with shape [batch, height, width, channels]
+    # and the [height, width] of every image in the batch.
+    return (tf.TensorSpec(shape=[None, None, None, self._input_depth],
+                          dtype=tf.uint8),
+            tf.TensorSpec(shape=[None, 2], dtype=tf.int32))
+
   @tf.function
   def __call__(self, input_tensor: tf.Tensor) -> MutableMapping[Text, Any]:
-    """Performs a forward pass.
+    """Performs a forward pass at a single scale.
+
+    Args:
+      input_tensor: An uint8 input tensor of type tf.Tensor with shape [height,
+        width, channels].
+
+    Returns:
+      A dictionary containing the results of the specified DeepLab architecture.
+      The results are bilinearly upsampled to input size before returning.
+    """
+    return self._predict(input_tensor, _SINGLE_SCALE_OPTIONS)
+
+  @tf.function
+  def tta_call(self, input_tensor: tf.Tensor) -> MutableMapping[Text, Any]:
+    """Performs a forward pass with test-time augmentation.
+
+    Like `__call__`, but the predictions are averaged over the tta_scales, and
+    the horizontal flips if tta_add_flipped_images. The flipped images run in
+    the same batch as the images.
 
     Args:
       input_tensor: An uint8 input tensor of type tf.Tensor with shape [height,
@@ -115,6 +314,12 @@ class DeepLabModule(tf.Module):
       A dictionary containing the results of the specified DeepLab architecture.
       The results are bilinearly upsampled to input size before returning.
     """
+    return self._predict(input_tensor, self._tta_options)
+
+  def _predict(self, input_tensor: tf.Tensor,
+               inference_options: Mapping[Text, Any]
+               ) -> MutableMapping[Text, Any]:
+    """Performs a forward pass with the given options of DeepLab.call."""
     input_size = [tf.shape(input_tensor)[0], tf.shape(input_tensor)[1]]
 
     if self._is_motion_deeplab or self._is_vip_deeplab:
@@ -131,11 +336,194 @@ class DeepLabModule(tf.Module):
 
     resized_size = tf.shape(resized_image)[0:2]
     # Making input tensor to 4D to fit model input requirements.
-    outputs = self._model(tf.expand_dims(processed_image, 0), training=False)
+    outputs = self._model(tf.expand_dims(processed_image, 0), training=False,
+                          **inference_options)
     # We only undo-preprocess for those defined in tuples in model/utils.py.
-    return utils.undo_preprocessing(outputs, resized_size,
+    return utils.undo_preprocessing(self._select_outputs(outputs), resized_size,
                                     input_size)
 
+  @tf.function
+  def batch_call(self, input_tensor: tf.Tensor,
+                 input_sizes: tf.Tensor) -> MutableMapping[Text, Any]:
+    """Performs a forward pass on a batch of images.
+
+    Every image is preprocessed as in `__call__`, and the network and the
+    post-processing run once on the whole batch.
+
+    Args:
+      input_tensor: An uint8 input tensor of type tf.Tensor with shape [batch,
+        height, width, channels], where image i occupies the top left
+        input_sizes[i] pixels and the rest is padding.
+      input_sizes: An int32 tensor of type tf.Tensor with shape [batch, 2],
+        containing the [height, width] of every image.
+
+    Returns:
+      A dictionary containing the results of the specified DeepLab architecture
+      which are upsampled by `__call__`, with shape [batch, height, width, ...].
+      The results of image i are bilinearly upsampled to input_sizes[i] and
+      occupy the top left of the outputs, and the rest is zero.
+    """
+    padded_height = tf.shape(input_tensor)[1]
+    padded_width = tf.shape(input_tensor)[2]
+
+    def _preprocess(inputs):
+      image, input_size = inputs
+      (resized_image, processed_image, _, _, _, _) = self._preprocess_fn(
+          image=image[:input_size[0], :input_size[1], :])
+      return processed_image, tf.shape(resized_image)[0:2]
+
+    processed_images, resized_sizes = tf.map_fn(
+        _preprocess, (input_tensor, input_sizes),
+        fn_output_signature=(tf.float32, tf.int32))
+    outputs = self._model(
+        tf.ensure_shape(
+            processed_images,
+            [None, self._crop_height, self._crop_width, self._input_depth]),
+        training=False, **_SINGLE_SCALE_OPTIONS)
+    outputs = {
+        key: value for key, value in self._select_outputs(outputs).items()
+        if key in utils.PREDICTIONS_TO_UNDO_PREPROCESSING
+    }
+
+    def _undo_preprocessing(i):
+      image_outputs = utils.undo_preprocessing(
+          {key: value[i:i + 1] for key, value in outputs.items()},
+          resized_sizes[i], input_sizes[i])
+      return {
+          key: _pad_to_size(value, padded_height, padded_width)
+          for key, value in image_outputs.items()
+      }
+
+    return tf.map_fn(
+        _undo_preprocessing,
+        tf.range(tf.shape(input_tensor)[0]),
+        fn_output_signature={
+            key: tf.TensorSpec(None, value.dtype)
+            for key, value in outputs.items()
+        })
+
+  def _predict_crops(self, crops: tf.Tensor) -> tf.Tensor:
+    """Returns the dense predictions of a batch of crops, concatenated.
+
+    The channels are the semantic logits, the center heatmap, the offsets and
+    a channel of ones, which becomes the blending weight.
+    """
+    outputs = self._model(crops, training=False, post_process=False,
+                          **_SINGLE_SCALE_OPTIONS)
+    center_heatmap = tf.expand_dims(outputs[common.PRED_CENTER_HEATMAP_KEY], 3)
+    return tf.concat([
+        outputs[common.PRED_SEMANTIC_LOGITS_KEY], center_heatmap,
+        outputs[common.PRED_OFFSET_MAP_KEY], tf.ones_like(center_heatmap)
+    ], axis=3)
+
+  @tf.function
+  def tiled_call(self, input_tensor: tf.Tensor) -> MutableMapping[Text, Any]:
+    """Performs a forward pass over overlapping crops at native resolution.
+
+    The input is covered by crops of the eval crop size, which overlap by
+    tile_overlap pixels and are run tile_batch_size at a time. The semantic
+    logits, center heatmaps and offsets of the crops are blended with weights
+    ramping linearly over the overlaps, one row of crops at a time, and the
+    post-processing runs once on the blended maps, so the instance ids are
+    consistent across the crop borders.
+
+    The rows are normalized as soon as the next row of crops has been added.
+    Unless the semantic logits or probabilities are returned, only their
+    argmax is kept, so the full resolution maps are the semantic prediction,
+    the center heatmap and the offsets.
+
+    Args:
+      input_tensor: An uint8 input tensor of type tf.Tensor with shape [height,
+        width, channels].
+
+    Returns:
+      A dictionary containing the results of Panoptic-DeepLab at input size.
+    """
+    tile_height, tile_width = self._crop_height, self._crop_width
+    overlap = self._tile_overlap
+    stride_height = tile_height - overlap
+    stride_width = tile_width - overlap
+    num_classes = self._num_classes
+    depth = num_classes + 4
+    keep_semantic_logits = not self._output_keys or any(
+        key in self._output_keys for key in (common.PRED_SEMANTIC_LOGITS_KEY,
+                                             common.PRED_SEMANTIC_PROBS_KEY))
+
+    height = tf.shape(input_tensor)[0]
+    width = tf.shape(input_tensor)[1]
+    num_rows = _get_num_tiles(height, tile_height, stride_height)
+    num_cols = _get_num_tiles(width, tile_width, stride_width)
+    padded_width = (num_cols - 1) * stride_width + tile_width
+
+    window = (tf.expand_dims(_get_blending_window(tile_height, overlap), 1) *
+              tf.expand_dims(_get_blending_window(tile_width, overlap), 0))
+    window = window[tf.newaxis, :, :, tf.newaxis]
+
+    # Every row of crops completes stride_height rows of the maps, and the
+    # bottom overlap of the last row completes the rest.
+    maps = tf.TensorArray(
+        tf.float32, size=num_rows + 1, infer_shape=False,
+        element_shape=[None, None, depth - 1 if keep_semantic_logits else 3])
+    semantic = tf.TensorArray(
+        tf.int32, size=num_rows + 1, infer_shape=False,
+        element_shape=[None, None])
+
+    def _write_block(index, block, maps, semantic):
+      block = _normalize_block(block, index * stride_height, height, width)
+      if keep_semantic_logits:
+        return maps.write(index, block), semantic
+      return (maps.write(index, block[:, :, num_classes:]),
+              semantic.write(index, tf.argmax(
+                  block[:, :, :num_classes], axis=2, output_type=tf.int32)))
+
+    # The bottom overlap of the previous row of crops.
+    carry = tf.zeros([overlap, padded_width, depth])
+    for row in tf.range(num_rows):
+      y = row * stride_height
+      tiles = tf.TensorArray(
+          tf.float32, size=num_cols,
+          element_shape=[tile_height, tile_width, depth])
+      for start in tf.range(0, num_cols, self._tile_batch_size):
+        cols = tf.range(start,
+                        tf.minimum(start + self._tile_batch_size, num_cols))
+        crops = _get_crops(input_tensor, y, cols * stride_width, tile_height,
+                           tile_width)
+        tiles = tiles.scatter(cols, self._predict_crops(crops) * window)
+      strip = _stitch_columns(tiles.stack(), stride_width)
+      maps, semantic = _write_block(
+          row, strip[:stride_height] +
+          tf.pad(carry, [[0, stride_height - overlap], [0, 0], [0, 0]]),
+          maps, semantic)
+      carry = strip[stride_height:]
+    maps, semantic = _write_block(num_rows, carry, maps, semantic)
+
+    maps = maps.concat()[tf.newaxis]
+    if keep_semantic_logits:
+      semantic_logits = maps[:, :, :, :num_classes]
+      semantic_probs = semantic_logits
+      if (not self._output_keys or
+          common.PRED_SEMANTIC_PROBS_KEY in self._output_keys):
+        semantic_probs = tf.nn.softmax(semantic_logits)
+      # Otherwise the post-processor, which only takes the argmax, is given
+      # the logits, which saves the full resolution softmax.
+      result_dict = {
+          common.PRED_SEMANTIC_LOGITS_KEY: semantic_logits,
+          common.PRED_SEMANTIC_PROBS_KEY: semantic_probs,
+          common.PRED_CENTER_HEATMAP_KEY:
+              maps[:, :, :, num_classes:num_classes + 1],
+          common.PRED_OFFSET_MAP_KEY: maps[:, :, :, num_classes + 1:],
+      }
+    else:
+      result_dict = {
+          common.PRED_SEMANTIC_KEY: semantic.concat()[tf.newaxis],
+          common.PRED_CENTER_HEATMAP_KEY: maps[:, :, :, :1],
+          common.PRED_OFFSET_MAP_KEY: maps[:, :, :, 1:],
+      }
+    result_dict.update(self._model.post_process(result_dict))
+    result_dict[common.PRED_CENTER_HEATMAP_KEY] = tf.squeeze(
+        result_dict[common.PRED_CENTER_HEATMAP_KEY], axis=3)
+    return self._select_outputs(result_dict)
+
 
 def main(argv: Sequence[str]) -> None:
   if len(argv) > 1:
@@ -146,9 +534,25 @@ def main(argv: Sequence[str]) -> None:
     text_format.Parse(f.read(), config)
 
   module = DeepLabModule(
-      config, _FLAGS_CKPT_PATH.value, _FLAGS_MERGE_WITH_TF_OP.value)
+      config, _FLAGS_CKPT_PATH.value, _FLAGS_MERGE_WITH_TF_OP.value,
+      _FLAGS_TILE_OVERLAP.value, _FLAGS_TILE_BATCH_SIZE.value,
+      _FLAGS_OUTPUT_KEYS.value,
+      [float(scale) for scale in _FLAGS_TTA_SCALES.value],
+      _FLAGS_TTA_ADD_FLIPPED_IMAGES.value)
 
-  signatures = module.__call__.get_concrete_function(module.get_input_spec())
+  signatures = {
+      'serving_default':
+          module.__call__.get_concrete_function(module.get_input_spec()),
+  }
+  if module.supports_batching:
+    signatures['serving_batch'] = module.batch_call.get_concrete_function(
+        *module.get_batch_input_spec())
+  if module.supports_tiling:
+    signatures['tiled'] = module.tiled_call.get_concrete_function(
+        module.get_input_spec())
+  if module.supports_tta:
+    signatures['tta'] = module.tta_call.get_concrete_function(
+        module.get_input_spec())
   tf.saved_model.save(
       module, _FLAGS_OUTPUT_PATH.value, signatures=signatures)
 
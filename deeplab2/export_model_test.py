@@ -0,0 +1,166 @@
+# coding=utf-8
+# Copyright 2022 The Deeplab2 Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the tiled inference of export_model.py."""
+
+from absl.testing import parameterized
+import numpy as np
+import tensorflow as tf
+
+from deeplab2 import common
+from deeplab2 import export_model
+
+_NUM_CLASSES = 2
+# The semantic logits, the center heatmap and the offsets.
+_NUM_MAPS = _NUM_CLASSES + 3
+_CROP_HEIGHT = 17
+_CROP_WIDTH = 21
+_TILE_OVERLAP = 4
+
+
+class _FakeModel(object):
+  """Stands for the DeepLab model, whose post-processing returns nothing."""
+
+  def post_process(self, result_dict):
+    del result_dict
+    return {}
+
+
+class _FakeTiledModule(export_model.DeepLabModule):
+  """DeepLabModule whose crops are predicted by random linear maps.
+
+  The predictions also depend on the mean of every crop, so that neighbouring
+  crops predict different values on their overlaps.
+  """
+
+  def __init__(self, tile_batch_size, output_keys):
+    tf.Module.__init__(self, name='FakeTiledModule')
+    self._crop_height = _CROP_HEIGHT
+    self._crop_width = _CROP_WIDTH
+    self._tile_overlap = _TILE_OVERLAP
+    self._tile_batch_size = tile_batch_size
+    self._output_keys = list(output_keys)
+    self._num_classes = _NUM_CLASSES
+    self._model = _FakeModel()
+    self._map_weights = np.random.rand(3, _NUM_MAPS).astype(np.float32)
+    self._map_biases = np.random.rand(_NUM_MAPS).astype(np.float32)
+
+  def _predict_crops(self, crops):
+    maps = (tf.einsum('nhwc,cd->nhwd', crops / 255., self._map_weights) +
+            tf.reduce_mean(crops, axis=[1, 2, 3], keepdims=True) / 255. *
+            self._map_biases)
+    return tf.concat([maps, tf.ones_like(maps[:, :, :, :1])], axis=3)
+
+
+def _get_window(size):
+  ramp = (np.arange(size) + 0.5) / _TILE_OVERLAP
+  return np.minimum(np.minimum(ramp, ramp[::-1]), 1.0)
+
+
+def _blend_directly(module, image):
+  """Accumulates the weighted prediction of every crop in a full canvas."""
+  height, width = image.shape[:2]
+  stride_height = _CROP_HEIGHT - _TILE_OVERLAP
+  stride_width = _CROP_WIDTH - _TILE_OVERLAP
+  num_rows = -(-max(height - _CROP_HEIGHT, 0) // stride_height) + 1
+  num_cols = -(-max(width - _CROP_WIDTH, 0) // stride_width) + 1
+  padded_height = (num_rows - 1) * stride_height + _CROP_HEIGHT
+  padded_width = (num_cols - 1) * stride_width + _CROP_WIDTH
+
+  padded_image = np.full((padded_height, padded_width, 3),
+                         export_model._PAD_VALUE, dtype=np.float32)
+  padded_image[:height, :width] = image
+  window = np.outer(_get_window(_CROP_HEIGHT), _get_window(_CROP_WIDTH))
+  sums = np.zeros((padded_height, padded_width, _NUM_MAPS))
+  weights = np.zeros((padded_height, padded_width, 1))
+  for row in range(num_rows):
+    for col in range(num_cols):
+      y = row * stride_height
+      x = col * stride_width
+      crop = padded_image[y:y + _CROP_HEIGHT, x:x + _CROP_WIDTH]
+      prediction = module._predict_crops(crop[np.newaxis]).numpy()[0]
+      sums[y:y + _CROP_HEIGHT, x:x + _CROP_WIDTH] += (
+          prediction[:, :, :-1] * window[:, :, np.newaxis])
+      weights[y:y + _CROP_HEIGHT, x:x + _CROP_WIDTH] += (
+          window[:, :, np.newaxis])
+  return (sums / weights)[:height, :width]
+
+
+class ExportModelTest(tf.test.TestCase, parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    np.random.seed(0)
+    tf.random.set_seed(0)
+
+  def test_stitch_columns_matches_direct_sum(self):
+    stride = 5
+    tiles = np.random.rand(4, 3, 8, 2).astype(np.float32)
+    expected = np.zeros((3, 3 * stride + 8, 2), dtype=np.float32)
+    for i, tile in enumerate(tiles):
+      expected[:, i * stride:i * stride + 8] += tile
+
+    self.assertAllClose(
+        export_model._stitch_columns(tf.constant(tiles), stride), expected)
+
+  @parameterized.parameters(
+      # Larger than one crop, with partial crops on both borders.
+      (40, 50, 2),
+      # Smaller than one crop.
+      (10, 12, 4),
+      # Exactly one crop.
+      (17, 21, 1),
+      # A single row, and a single column, of crops.
+      (13, 70, 3),
+      (60, 9, 2),
+  )
+  def test_tiled_call_matches_direct_accumulation(self, height, width,
+                                                  tile_batch_size):
+    module = _FakeTiledModule(tile_batch_size, output_keys=())
+    image = np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+    expected = _blend_directly(module, image)
+
+    result = module.tiled_call(tf.constant(image))
+
+    self.assertAllClose(result[common.PRED_SEMANTIC_LOGITS_KEY][0],
+                        expected[:, :, :_NUM_CLASSES], rtol=1e-5, atol=1e-5)
+    self.assertAllClose(result[common.PRED_CENTER_HEATMAP_KEY][0],
+                        expected[:, :, _NUM_CLASSES], rtol=1e-5, atol=1e-5)
+    self.assertAllClose(result[common.PRED_OFFSET_MAP_KEY][0],
+                        expected[:, :, _NUM_CLASSES + 1:], rtol=1e-5,
+                        atol=1e-5)
+
+  @parameterized.parameters((40, 50), (10, 12))
+  def test_tiled_call_keeps_only_semantic_argmax(self, height, width):
+    module = _FakeTiledModule(
+        2, output_keys=(common.PRED_SEMANTIC_KEY,
+                        common.PRED_CENTER_HEATMAP_KEY,
+                        common.PRED_OFFSET_MAP_KEY))
+    image = np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+    expected = _blend_directly(module, image)
+
+    result = module.tiled_call(tf.constant(image))
+
+    self.assertAllEqual(result[common.PRED_SEMANTIC_KEY][0],
+                        np.argmax(expected[:, :, :_NUM_CLASSES], axis=2))
+    self.assertAllClose(result[common.PRED_CENTER_HEATMAP_KEY][0],
+                        expected[:, :, _NUM_CLASSES], rtol=1e-5, atol=1e-5)
+    self.assertAllClose(result[common.PRED_OFFSET_MAP_KEY][0],
+                        expected[:, :, _NUM_CLASSES + 1:], rtol=1e-5,
+                        atol=1e-5)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -16,7 +16,7 @@
 """This file contains the DeepLab meta architecture."""
 import collections
 import functools
-from typing import Any, Dict, Text, Tuple
+from typing import Any, Dict, Optional, Sequence, Text, Tuple
 
 from absl import logging
 import tensorflow as tf
@@ -109,7 +109,10 @@ class DeepLab(tf.keras.Model):
 
   def call(self,
            input_tensor: tf.Tensor,
-           training: bool = False) -> Dict[Text, Any]:
+           training: bool = False,
+           post_process: bool = True,
+           eval_scales: Optional[Sequence[float]] = None,
+           add_flipped_images: Optional[bool] = None) -> Dict[Text, Any]:
     """Performs a forward pass.
 
     Args:
@@ -117,11 +120,30 @@ class DeepLab(tf.keras.Model):
         width, channels]. The input tensor should contain batches of RGB images.
       training: A boolean flag indicating whether training behavior should be
         used (default: False).
+      post_process: A boolean flag indicating whether the post-processing
+        should be performed in evaluation mode (default: True). If False, only
+        the dense predictions are returned, e.g. to post-process them with
+        `post_process` after stitching the predictions of several crops.
+      eval_scales: An optional sequence of floats overriding the eval_scales of
+        the evaluator options in evaluation mode (default: None).
+      add_flipped_images: An optional boolean overriding the
+        add_flipped_images of the evaluator options in evaluation mode
+        (default: None).
 
     Returns:
       A dictionary containing the results of the specified DeepLab architecture.
       The results are bilinearly upsampled to input size before returning.
+
+    Raises:
+      ValueError: If MaX-DeepLab is used with multi-scale inference.
     """
+    if eval_scales is None:
+      eval_scales = self._eval_scales
+    if add_flipped_images is None:
+      add_flipped_images = self._add_flipped_images
+    if self._is_max_deeplab and (add_flipped_images or len(eval_scales) > 1):
+      raise ValueError(
+          'MaX-DeepLab does not support multi-scale inference yet.')
     # Normalize the input in the same way as Inception. We normalize it outside
     # the encoder so that we can extend encoders to different backbones without
     # copying the normalization to each encoder. We normalize it after data
@@ -142,8 +164,8 @@ class DeepLab(tf.keras.Model):
       result_dict = collections.defaultdict(list)
       # Evaluation mode where one could perform multi-scale inference.
       scale_1_pool_size = self.get_pool_size()
-      logging.info('Eval with scales %s', self._eval_scales)
-      for eval_scale in self._eval_scales:
+      logging.info('Eval with scales %s', eval_scales)
+      for eval_scale in eval_scales:
         # Get the scaled images/pool_size for each scale.
         scaled_images, scaled_pool_size = (
             self._scale_images_and_pool_size(
@@ -152,36 +174,36 @@ class DeepLab(tf.keras.Model):
         self.set_pool_size(tuple(scaled_pool_size))
         logging.info('Eval scale %s; setting pooling size to %s',
                      eval_scale, scaled_pool_size)
+        if add_flipped_images:
+          # The flipped images are run in the same batch as the images, so that
+          # every scale takes a single forward pass.
+          scaled_images = tf.concat(
+              [scaled_images, tf.reverse(scaled_images, [2])], axis=0)
         pred_dict = self._decoder(
             self._encoder(scaled_images, training=training), training=training)
-        # MaX-DeepLab skips this resizing and upsamples the mask outputs in
-        # self._post_processor.
-        pred_dict = self._resize_predictions(
-            pred_dict,
-            target_h=input_h,
-            target_w=input_w)
-        # Change the semantic logits to probabilities with softmax. Note
-        # one should remove semantic logits for faster inference. We still
-        # keep them since they will be used to compute evaluation loss.
-        pred_dict[common.PRED_SEMANTIC_PROBS_KEY] = tf.nn.softmax(
-            pred_dict[common.PRED_SEMANTIC_LOGITS_KEY])
-        # Store the predictions from each scale.
-        for output_type, output_value in pred_dict.items():
-          result_dict[output_type].append(output_value)
-        if self._add_flipped_images:
-          pred_dict_reverse = self._decoder(
-              self._encoder(tf.reverse(scaled_images, [2]), training=training),
-              training=training)
-          pred_dict_reverse = self._resize_predictions(
-              pred_dict_reverse,
+        if add_flipped_images:
+          pred_dict_reverse = {}
+          for output_type, output_value in list(pred_dict.items()):
+            pred_dict[output_type], pred_dict_reverse[output_type] = tf.split(
+                output_value, 2, axis=0)
+          pred_dicts = [(pred_dict, False), (pred_dict_reverse, True)]
+        else:
+          pred_dicts = [(pred_dict, False)]
+        for pred_dict, reverse in pred_dicts:
+          # MaX-DeepLab skips this resizing and upsamples the mask outputs in
+          # self._post_processor.
+          pred_dict = self._resize_predictions(
+              pred_dict,
               target_h=input_h,
               target_w=input_w,
-              reverse=True)
-          # Change the semantic logits to probabilities with softmax.
-          pred_dict_reverse[common.PRED_SEMANTIC_PROBS_KEY] = tf.nn.softmax(
-              pred_dict_reverse[common.PRED_SEMANTIC_LOGITS_KEY])
+              reverse=reverse)
+          # Change the semantic logits to probabilities with softmax. Note
+          # one should remove semantic logits for faster inference. We still
+          # keep them since they will be used to compute evaluation loss.
+          pred_dict[common.PRED_SEMANTIC_PROBS_KEY] = tf.nn.softmax(
+              pred_dict[common.PRED_SEMANTIC_LOGITS_KEY])
           # Store the predictions from each scale.
-          for output_type, output_value in pred_dict_reverse.items():
+          for output_type, output_value in pred_dict.items():
             result_dict[output_type].append(output_value)
       # Set back the pool_size for scale 1.0, the original setting.
       self.set_pool_size(tuple(scale_1_pool_size))
@@ -190,13 +212,26 @@ class DeepLab(tf.keras.Model):
         result_dict[output_type] = tf.reduce_mean(
             tf.stack(output_value, axis=0), axis=0)
       # Post-process the results.
-      result_dict.update(self._post_processor(result_dict))
+      if post_process:
+        result_dict.update(self._post_processor(result_dict))
 
     if common.PRED_CENTER_HEATMAP_KEY in result_dict:
       result_dict[common.PRED_CENTER_HEATMAP_KEY] = tf.squeeze(
           result_dict[common.PRED_CENTER_HEATMAP_KEY], axis=3)
     return result_dict
 
+  def post_process(self, result_dict: Dict[Text, Any]) -> Dict[Text, Any]:
+    """Post-processes dense predictions.
+
+    Args:
+      result_dict: A dictionary of dense predictions in the format used by the
+        post-processor, i.e. before the center heatmap is squeezed.
+
+    Returns:
+      The post-processed dict of tf.Tensor.
+    """
+    return self._post_processor(result_dict)
+
   def reset_pooling_layer(self):
     """Resets the ASPP pooling layer to global average pooling."""
     self._decoder.reset_pooling_layer()
@@ -208,6 +208,29 @@ class DeeplabTest(tf.test.TestCase):
         num_params += params
     self.assertEqual(num_params, 61900200)  # 61.9M in the paper.
 
+  def test_deeplab_batched_flipped_images_match_separate_predictions(self):
+    model, experiment_options = _create_model_from_test_proto(
+        'example_cityscapes_deeplabv3.textproto')
+    train_crop_size = tuple(
+        experiment_options.train_dataset_options.crop_size)
+    input_tensor = tf.random.uniform(
+        shape=(1, train_crop_size[0], train_crop_size[1], 3), maxval=255)
+
+    resulting_dict = model(
+        input_tensor, eval_scales=[1.0], add_flipped_images=True)
+    # The predictions of the image and of its flip, run one at a time.
+    single_scale_options = dict(eval_scales=[1.0], add_flipped_images=False)
+    semantic_probs = model(
+        input_tensor, **single_scale_options)[common.PRED_SEMANTIC_PROBS_KEY]
+    flipped_semantic_probs = model(
+        tf.reverse(input_tensor, [2]),
+        **single_scale_options)[common.PRED_SEMANTIC_PROBS_KEY]
+    expected_semantic_probs = (
+        semantic_probs + tf.reverse(flipped_semantic_probs, [2])) / 2
+
+    self.assertAllClose(resulting_dict[common.PRED_SEMANTIC_PROBS_KEY],
+                        expected_semantic_probs, atol=1e-5)
+
   def test_deeplab_errors(self):
     proto_filename = os.path.join(
         _CONFIG_PATH, 'example_cityscapes_panoptic_deeplab.textproto')
@@ -16,7 +16,7 @@
 """This file contains functions to post-process Panoptic-DeepLab results."""
 
 import functools
-from typing import Tuple, Dict, Text
+from typing import Dict, Optional, Text, Tuple
 
 import tensorflow as tf
 
@@ -25,6 +25,10 @@ from deeplab2 import config_pb2
 from deeplab2.data import dataset
 from deeplab2.model import utils
 
+# The number of center to pixel distances computed at once when assigning the
+# pixels to their closest center (16 MB of float32).
+_MAX_DISTANCES_PER_CHUNK = 1 << 22
+
 
 def _get_semantic_predictions(semantic_logits: tf.Tensor) -> tf.Tensor:
   """Computes the semantic classes from the predictions.
@@ -87,14 +91,22 @@ def _get_instance_centers_from_heatmap(
   return centers, center_heatmap
 
 
-def _find_closest_center_per_pixel(centers: tf.Tensor,
-                                   center_offsets: tf.Tensor) -> tf.Tensor:
+def _find_closest_center_per_pixel(
+    centers: tf.Tensor,
+    center_offsets: tf.Tensor,
+    max_distances_per_chunk: int = _MAX_DISTANCES_PER_CHUNK) -> tf.Tensor:
   """Assigns all pixels to their closest center.
 
+  The pixels are processed in chunks, so that at most max_distances_per_chunk
+  distances are computed at once, instead of the [N, height * width] distance
+  matrix, which does not fit in memory for many centers on large images.
+
   Args:
     centers: A tf.Tensor of shape [N, 2] containing N centers with coordinate
       order (y, x).
     center_offsets: A tf.Tensor of shape [height, width, 2].
+    max_distances_per_chunk: An integer specifying the maximum number of center
+      to pixel distances computed at once.
 
   Returns:
     A tf.Tensor of shape [height, width] containing the index of the closest
@@ -102,6 +114,7 @@ def _find_closest_center_per_pixel(centers: tf.Tensor,
   """
   height = tf.shape(center_offsets)[0]
   width = tf.shape(center_offsets)[1]
+  num_pixels = height * width
 
   x_coord, y_coord = tf.meshgrid(tf.range(width), tf.range(height))
   coord = tf.stack([y_coord, x_coord], axis=-1)
@@ -109,15 +122,30 @@ def _find_closest_center_per_pixel(centers: tf.Tensor,
   center_per_pixel = tf.cast(coord, tf.float32) + center_offsets
 
   # centers: [N, 2] -> [N, 1, 2].
-  # center_per_pixel: [H, W, 2] -> [1, H*W, 2].
+  # center_per_pixel: [H, W, 2] -> [num_chunks, chunk_size, 2], padded.
+  num_centers = tf.shape(centers)[0]
   centers = tf.cast(tf.expand_dims(centers, 1), tf.float32)
-  center_per_pixel = tf.reshape(center_per_pixel, [height*width, 2])
-  center_per_pixel = tf.expand_dims(center_per_pixel, 0)
+  chunk_size = tf.maximum(max_distances_per_chunk // num_centers, 1)
+  num_chunks = (num_pixels + chunk_size - 1) // chunk_size
+  center_per_pixel = tf.reshape(center_per_pixel, [num_pixels, 2])
+  center_per_pixel = tf.pad(
+      center_per_pixel, [[0, num_chunks * chunk_size - num_pixels], [0, 0]])
+  center_per_pixel = tf.reshape(center_per_pixel, [num_chunks, chunk_size, 2])
 
-  # distances: [N, H*W].
-  distances = tf.norm(centers - center_per_pixel, axis=-1)
+  def _find_closest_center(chunk):
+    # distances: [N, chunk_size].
+    distances = tf.norm(centers - tf.expand_dims(chunk, 0), axis=-1)
+    return tf.argmin(distances, axis=0)
 
-  return tf.reshape(tf.argmin(distances, axis=0), [height, width])
+  # The chunks are processed one at a time to bound the memory.
+  closest_centers = tf.map_fn(
+      _find_closest_center,
+      center_per_pixel,
+      fn_output_signature=tf.int64,
+      parallel_iterations=1)
+
+  return tf.reshape(
+      tf.reshape(closest_centers, [-1])[:num_pixels], [height, width])
 
 
 def _get_instances_from_heatmap_and_offset(
@@ -192,12 +220,14 @@ def _get_panoptic_predictions(
     center_offsets: tf.Tensor, center_threshold: float,
     thing_class_ids: tf.Tensor, label_divisor: int, stuff_area_limit: int,
     void_label: int, nms_kernel_size: int, keep_k_centers: int,
-    merge_semantic_and_instance_with_tf_op: bool
+    merge_semantic_and_instance_with_tf_op: bool,
+    semantic_prediction: Optional[tf.Tensor] = None
 ) -> Tuple[tf.Tensor, tf.Tensor, tf.Tensor, tf.Tensor, tf.Tensor]:
   """Computes the semantic class and instance ID per pixel.
 
   Args:
-    semantic_logits: A tf.Tensor of shape [batch, height, width, classes].
+    semantic_logits: A tf.Tensor of shape [batch, height, width, classes]. Not
+      used if semantic_prediction is given.
     center_heatmap: A tf.Tensor of shape [batch, height, width, 1].
     center_offsets: A tf.Tensor of shape [batch, height, width, 2].
     center_threshold: A float setting the threshold for the center heatmap.
@@ -218,6 +248,9 @@ def _get_panoptic_predictions(
       successfully compile the provided TensorFlow implementation. To reproduce
       our results, please use the provided TensorFlow implementation `merge_ops`
       (i.e., set to True).
+    semantic_prediction: An optional tf.Tensor of shape [batch, height, width]
+      with the semantic class of every pixel, which saves the argmax of
+      semantic_logits when the caller has already computed it.
 
   Returns:
     A tuple of:
@@ -227,8 +260,9 @@ def _get_panoptic_predictions(
     - the centermap prediction as tf.Tensor with shape [batch, height, width].
     - the instance score maps as tf.Tensor with shape [batch, height, width].
   """
-  semantic_prediction = _get_semantic_predictions(semantic_logits)
-  batch_size = tf.shape(semantic_logits)[0]
+  if semantic_prediction is None:
+    semantic_prediction = _get_semantic_predictions(semantic_logits)
+  batch_size = tf.shape(semantic_prediction)[0]
 
   instance_map_lists = tf.TensorArray(
       tf.int32, size=batch_size, dynamic_size=False)
@@ -236,6 +270,8 @@ def _get_panoptic_predictions(
       tf.float32, size=batch_size, dynamic_size=False)
   instance_score_map_lists = tf.TensorArray(
       tf.float32, size=batch_size, dynamic_size=False)
+  panoptic_prediction_lists = tf.TensorArray(
+      tf.int32, size=batch_size, dynamic_size=False)
 
   for i in tf.range(batch_size):
     (instance_map, center_map,
@@ -247,6 +283,13 @@ def _get_panoptic_predictions(
     center_map_lists = center_map_lists.write(i, center_map)
     instance_score_map_lists = instance_score_map_lists.write(
         i, instance_score_map)
+    if not merge_semantic_and_instance_with_tf_op:
+      # The python merge only supports batch size of 1, so it runs per image.
+      panoptic_prediction_lists = panoptic_prediction_lists.write(
+          i, _merge_semantic_and_instance_maps(
+              semantic_prediction[i:i + 1, ...],
+              tf.expand_dims(instance_map, 0), thing_class_ids,
+              label_divisor, stuff_area_limit, void_label)[0])
 
   # This does not work with unknown shapes.
   instance_maps = instance_map_lists.stack()
@@ -261,9 +304,7 @@ def _get_panoptic_predictions(
         semantic_prediction, instance_maps, thing_class_ids, label_divisor,
         stuff_area_limit, void_label)
   else:
-    panoptic_prediction = _merge_semantic_and_instance_maps(
-        semantic_prediction, instance_maps, thing_class_ids, label_divisor,
-        stuff_area_limit, void_label)
+    panoptic_prediction = panoptic_prediction_lists.stack()
   return (panoptic_prediction, semantic_prediction, instance_maps, center_maps,
           instance_score_maps)
 
@@ -296,6 +337,10 @@ def _merge_semantic_and_instance_maps(
   please use the provided TensorFlow implementation (i.e., not use this
   function, but the `merge_ops.merge_semantic_and_instance_maps`).
 
+  The majority votes of all the instances are computed at once, from a joint
+  histogram of the instance and semantic labels, so the cost grows with the
+  number of pixels but not with the number of instances.
+
   Args:
     semantic_prediction: A tf.Tensor of shape [batch, height, width].
     instance_maps: A tf.Tensor of shape [batch, height, width].
@@ -317,67 +362,62 @@ def _merge_semantic_and_instance_maps(
   semantic_prediction = tf.ensure_shape(semantic_prediction, prediction_shape)
   instance_maps = tf.ensure_shape(instance_maps, prediction_shape)
 
-  # Default panoptic_prediction to have semantic label = void_label.
-  panoptic_prediction = tf.ones_like(
-      semantic_prediction) * void_label * label_divisor
+  semantic = tf.reshape(semantic_prediction, [-1])
+  instances = tf.reshape(instance_maps, [-1])
+  num_classes = tf.maximum(tf.reduce_max(semantic) + 1, 1)
 
-  # Start to paste predicted `thing` regions to panoptic_prediction.
   # Infer `thing` segmentation regions from semantic prediction.
-  semantic_thing_segmentation = tf.zeros_like(semantic_prediction,
-                                              dtype=tf.bool)
-  for thing_class in thing_class_ids:
-    semantic_thing_segmentation = tf.math.logical_or(
-        semantic_thing_segmentation,
-        semantic_prediction == thing_class)
-  # Keep track of how many instances for each semantic label.
-  num_instance_per_semantic_label = tf.TensorArray(
-      tf.int32, size=0, dynamic_size=True, clear_after_read=False)
-  instance_ids, _ = tf.unique(tf.reshape(instance_maps, [-1]))
-  for instance_id in instance_ids:
-    # Instance ID 0 is reserved for crowd region.
-    if instance_id == 0:
-      continue
-    thing_mask = tf.math.logical_and(instance_maps == instance_id,
-                                     semantic_thing_segmentation)
-    if tf.reduce_sum(tf.cast(thing_mask, tf.int32)) == 0:
-      continue
-    semantic_bin_counts = tf.math.bincount(
-        tf.boolean_mask(semantic_prediction, thing_mask))
-    semantic_majority = tf.cast(
-        tf.math.argmax(semantic_bin_counts), tf.int32)
-
-    while num_instance_per_semantic_label.size() <= semantic_majority:
-      num_instance_per_semantic_label = num_instance_per_semantic_label.write(
-          num_instance_per_semantic_label.size(), 0)
-
-    new_instance_id = (
-        num_instance_per_semantic_label.read(semantic_majority) + 1)
-    num_instance_per_semantic_label = num_instance_per_semantic_label.write(
-        semantic_majority, new_instance_id)
-    panoptic_prediction = tf.where(
-        thing_mask,
-        tf.ones_like(panoptic_prediction) * semantic_majority * label_divisor
-        + new_instance_id,
-        panoptic_prediction)
-
-  # Done with `num_instance_per_semantic_label` tensor array.
-  num_instance_per_semantic_label.close()
-
-  # Start to paste predicted `stuff` regions to panoptic prediction.
-  instance_stuff_regions = instance_maps == 0
-  semantic_ids, _ = tf.unique(tf.reshape(semantic_prediction, [-1]))
-  for semantic_id in semantic_ids:
-    if tf.reduce_sum(tf.cast(thing_class_ids == semantic_id, tf.int32)) > 0:
-      continue
-    # Check stuff area.
-    stuff_mask = tf.math.logical_and(semantic_prediction == semantic_id,
-                                     instance_stuff_regions)
-    stuff_area = tf.reduce_sum(tf.cast(stuff_mask, tf.int32))
-    if stuff_area >= stuff_area_limit:
-      panoptic_prediction = tf.where(
-          stuff_mask,
-          tf.ones_like(panoptic_prediction) * semantic_id * label_divisor,
-          panoptic_prediction)
+  is_thing_class = tf.math.bincount(
+      tf.cast(thing_class_ids, tf.int32),
+      minlength=num_classes,
+      maxlength=num_classes) > 0
+  semantic_thing_segmentation = tf.gather(is_thing_class, semantic)
+  # Instance ID 0 is reserved for crowd region.
+  thing_mask = tf.math.logical_and(semantic_thing_segmentation,
+                                   instances != 0)
+
+  # Count the semantic labels of every instance with a single bincount over
+  # the (instance, semantic label) pairs of the `thing` pixels. The instances
+  # are indexed in the order of their first pixel, as returned by tf.unique.
+  instance_ids, instance_index = tf.unique(instances)
+  num_instances = tf.size(instance_ids)
+  semantic_bin_counts = tf.reshape(
+      tf.math.bincount(
+          tf.boolean_mask(instance_index * num_classes + semantic, thing_mask),
+          minlength=num_instances * num_classes,
+          maxlength=num_instances * num_classes),
+      [num_instances, num_classes])
+  has_thing_pixels = tf.reduce_sum(semantic_bin_counts, axis=1) > 0
+  semantic_majority = tf.math.argmax(
+      semantic_bin_counts, axis=1, output_type=tf.int32)
+
+  # Every instance gets the next instance ID of its semantic majority, in the
+  # order of the instances. Instances without `thing` pixels are skipped.
+  majority_one_hot = tf.one_hot(
+      semantic_majority, num_classes, dtype=tf.int32) * tf.expand_dims(
+          tf.cast(has_thing_pixels, tf.int32), 1)
+  new_instance_ids = tf.gather(
+      tf.cumsum(majority_one_hot, axis=0), semantic_majority, batch_dims=1)
+  instance_panoptic_ids = semantic_majority * label_divisor + new_instance_ids
+
+  # `stuff` regions are kept only if their area is at least stuff_area_limit.
+  stuff_mask = tf.math.logical_and(
+      tf.math.logical_not(semantic_thing_segmentation), instances == 0)
+  stuff_areas = tf.math.bincount(
+      tf.boolean_mask(semantic, stuff_mask),
+      minlength=num_classes,
+      maxlength=num_classes)
+  stuff_mask = tf.math.logical_and(
+      stuff_mask, tf.gather(stuff_areas >= stuff_area_limit, semantic))
+
+  # Default panoptic_prediction to have semantic label = void_label, and paste
+  # the `thing` and `stuff` regions.
+  panoptic_prediction = tf.where(
+      thing_mask, tf.gather(instance_panoptic_ids, instance_index),
+      tf.where(stuff_mask, semantic * label_divisor,
+               tf.ones_like(semantic) * void_label * label_divisor))
+  panoptic_prediction = tf.reshape(panoptic_prediction,
+                                   tf.shape(semantic_prediction))
 
   return panoptic_prediction
 
@@ -442,7 +482,8 @@ class PostProcessor(tf.keras.layers.Layer):
     Args:
       result_dict: A dictionary of tf.Tensor containing model results. The dict
       has to contain
-        - common.PRED_SEMANTIC_PROBS_KEY,
+        - common.PRED_SEMANTIC_PROBS_KEY, or common.PRED_SEMANTIC_KEY if the
+          semantic prediction is already computed,
         - common.PRED_CENTER_HEATMAP_KEY,
         - common.PRED_OFFSET_MAP_KEY,
 
@@ -461,7 +502,8 @@ class PostProcessor(tf.keras.layers.Layer):
      processed_dict[common.PRED_INSTANCE_CENTER_KEY],
      processed_dict[common.PRED_INSTANCE_SCORES_KEY]
     ) = self._post_processor(
-        result_dict[common.PRED_SEMANTIC_PROBS_KEY],
+        result_dict.get(common.PRED_SEMANTIC_PROBS_KEY),
         result_dict[common.PRED_CENTER_HEATMAP_KEY],
-        result_dict[common.PRED_OFFSET_MAP_KEY])
+        result_dict[common.PRED_OFFSET_MAP_KEY],
+        semantic_prediction=result_dict.get(common.PRED_SEMANTIC_KEY))
     return processed_dict
@@ -20,6 +20,37 @@ import tensorflow as tf
 from deeplab2.model.post_processor import panoptic_deeplab
 
 
+def _merge_semantic_and_instance_maps_per_instance(
+    semantic_prediction, instance_maps, thing_class_ids, label_divisor,
+    stuff_area_limit, void_label):
+  """Merges the maps one instance and one semantic label at a time."""
+  panoptic_prediction = np.full_like(semantic_prediction,
+                                     void_label * label_divisor)
+  semantic_thing_segmentation = np.isin(semantic_prediction, thing_class_ids)
+  num_instance_per_semantic_label = {}
+  _, first_indices = np.unique(instance_maps, return_index=True)
+  for instance_id in instance_maps.ravel()[np.sort(first_indices)]:
+    if instance_id == 0:
+      continue
+    thing_mask = (instance_maps == instance_id) & semantic_thing_segmentation
+    if not thing_mask.any():
+      continue
+    semantic_majority = np.argmax(
+        np.bincount(semantic_prediction[thing_mask]))
+    new_instance_id = num_instance_per_semantic_label.get(
+        semantic_majority, 0) + 1
+    num_instance_per_semantic_label[semantic_majority] = new_instance_id
+    panoptic_prediction[thing_mask] = (
+        semantic_majority * label_divisor + new_instance_id)
+  for semantic_id in np.unique(semantic_prediction):
+    if semantic_id in thing_class_ids:
+      continue
+    stuff_mask = (semantic_prediction == semantic_id) & (instance_maps == 0)
+    if stuff_mask.sum() >= stuff_area_limit:
+      panoptic_prediction[stuff_mask] = semantic_id * label_divisor
+  return panoptic_prediction
+
+
 class PostProcessingTest(tf.test.TestCase):
 
   def test_py_func_merge_semantic_and_instance_maps_can_run(self):
@@ -78,6 +109,55 @@ class PostProcessingTest(tf.test.TestCase):
     np.testing.assert_equal(expected_panoptic_prediction.numpy(),
                             panoptic_prediction.numpy())
 
+  def test_merge_semantic_and_instance_maps_matches_per_instance_merge(self):
+    np.random.seed(0)
+    batch = 1
+    height = 31
+    width = 17
+    semantic_prediction = np.random.randint(0, 6, (batch, height, width))
+    instance_maps = np.random.randint(0, 40, (batch, height, width))
+    thing_class_ids = [1, 3, 4]
+    label_divisor = 256
+    stuff_area_limit = 20
+    void_label = 255
+    expected_panoptic_prediction = (
+        _merge_semantic_and_instance_maps_per_instance(
+            semantic_prediction, instance_maps, thing_class_ids,
+            label_divisor, stuff_area_limit, void_label))
+    panoptic_prediction = panoptic_deeplab._merge_semantic_and_instance_maps(
+        tf.convert_to_tensor(semantic_prediction, dtype=tf.int32),
+        tf.convert_to_tensor(instance_maps, dtype=tf.int32),
+        tf.convert_to_tensor(thing_class_ids), label_divisor,
+        stuff_area_limit, void_label)
+    np.testing.assert_equal(expected_panoptic_prediction,
+                            panoptic_prediction.numpy())
+
+  def test_find_closest_center_per_pixel_in_chunks(self):
+    tf.random.set_seed(0)
+    height = 13
+    width = 11
+    num_centers = 7
+    centers = tf.random.uniform((num_centers, 2),
+                                minval=0,
+                                maxval=min(height, width),
+                                dtype=tf.int32)
+    center_offsets = tf.random.uniform((height, width, 2),
+                                       minval=-5.0,
+                                       maxval=5.0)
+
+    # A single chunk computes the whole [N, height * width] distance matrix.
+    expected_closest_centers = (
+        panoptic_deeplab._find_closest_center_per_pixel(
+            centers, center_offsets,
+            max_distances_per_chunk=num_centers * height * width))
+    # 10 pixels per chunk, with a padded last chunk.
+    closest_centers = panoptic_deeplab._find_closest_center_per_pixel(
+        centers, center_offsets, max_distances_per_chunk=num_centers * 10)
+
+    self.assertSequenceEqual(closest_centers.shape, (height, width))
+    np.testing.assert_array_equal(expected_closest_centers.numpy(),
+                                  closest_centers.numpy())
+
   def test_gets_panoptic_predictions_with_score(self):
     batch = 1
     height = 5
@@ -136,6 +216,70 @@ class PostProcessingTest(tf.test.TestCase):
     np.testing.assert_array_almost_equal(instance_scores,
                                          expected_instance_scores)
 
+  def test_batched_panoptic_predictions_match_single_predictions(self):
+    batch = 2
+    height = 7
+    width = 9
+    classes = 4
+
+    tf.random.set_seed(0)
+    semantic_logits = tf.random.uniform((batch, height, width, classes))
+    center_heatmap = tf.random.uniform((batch, height, width, 1))
+    center_offsets = tf.random.uniform((batch, height, width, 2),
+                                       minval=-3.0,
+                                       maxval=3.0)
+    post_processor_args = dict(
+        center_threshold=0.5,
+        thing_class_ids=tf.convert_to_tensor([1, 2]),
+        label_divisor=256,
+        stuff_area_limit=2,
+        void_label=classes,
+        nms_kernel_size=3,
+        keep_k_centers=4,
+        merge_semantic_and_instance_with_tf_op=False)
+
+    batched_result = panoptic_deeplab._get_panoptic_predictions(
+        semantic_logits, center_heatmap, center_offsets, **post_processor_args)
+    for i in range(batch):
+      result = panoptic_deeplab._get_panoptic_predictions(
+          semantic_logits[i:i + 1], center_heatmap[i:i + 1],
+          center_offsets[i:i + 1], **post_processor_args)
+      for batched_output, output in zip(batched_result, result):
+        np.testing.assert_array_equal(batched_output[i:i + 1].numpy(),
+                                      output.numpy())
+
+  def test_panoptic_predictions_with_given_semantic_prediction(self):
+    batch = 1
+    height = 7
+    width = 9
+    classes = 4
+
+    tf.random.set_seed(0)
+    semantic_logits = tf.random.uniform((batch, height, width, classes))
+    center_heatmap = tf.random.uniform((batch, height, width, 1))
+    center_offsets = tf.random.uniform((batch, height, width, 2),
+                                       minval=-3.0,
+                                       maxval=3.0)
+    post_processor_args = dict(
+        center_threshold=0.5,
+        thing_class_ids=tf.convert_to_tensor([1, 2]),
+        label_divisor=256,
+        stuff_area_limit=2,
+        void_label=classes,
+        nms_kernel_size=3,
+        keep_k_centers=4,
+        merge_semantic_and_instance_with_tf_op=False)
+
+    expected_result = panoptic_deeplab._get_panoptic_predictions(
+        semantic_logits, center_heatmap, center_offsets, **post_processor_args)
+    result = panoptic_deeplab._get_panoptic_predictions(
+        None, center_heatmap, center_offsets,
+        semantic_prediction=tf.argmax(semantic_logits, axis=-1,
+                                      output_type=tf.int32),
+        **post_processor_args)
+    for expected_output, output in zip(expected_result, result):
+      np.testing.assert_array_equal(output.numpy(), expected_output.numpy())
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -42,6 +42,10 @@ _PREDICTION_WITH_BILINEAR_UPSAMPLING = (
     common.PRED_OFFSET_MAP_KEY,
 )
 
+# The predictions which are cropped and resized by undo_preprocessing.
+PREDICTIONS_TO_UNDO_PREPROCESSING = (
+    _PREDICTION_WITH_NEAREST_UPSAMPLING + _PREDICTION_WITH_BILINEAR_UPSAMPLING)
+
 _INPUT_WITH_NEAREST_UPSAMPLING = (
     common.GT_INSTANCE_CENTER_KEY,
 )
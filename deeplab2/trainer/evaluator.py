@@ -20,8 +20,14 @@ some redundant outputs, e.g., visualization results, evaluation loss, and so
 on. We still compute them in this implementation with the goal to provide more
 detailed information for research development. One should remove those
 redundant outputs for a faster inference speed.
+
+The outputs of the evaluation steps are reduced (metric accumulation and saving
+of predictions) by a background thread, so that the next steps do not wait for
+them.
 """
 
+import collections
+from concurrent import futures
 import os
 import orbit
 import tensorflow as tf
@@ -58,11 +64,14 @@ class Evaluator(orbit.StandardEvaluator):
     self._strategy = tf.distribute.get_strategy()
 
     self._supported_tasks = utils.get_supported_tasks(config)
+    # Every replica evaluates one example per step, so that the evaluation is
+    # sharded across the replicas.
     eval_dataset = runner_utils.create_dataset(
         config.eval_dataset_options,
         is_training=False,
         only_semantic_annotations=(common.TASK_PANOPTIC_SEGMENTATION
-                                   not in self._supported_tasks))
+                                   not in self._supported_tasks),
+        batch_size=self._strategy.num_replicas_in_sync)
     eval_dataset = orbit.utils.make_distributed_dataset(self._strategy,
                                                         eval_dataset)
     evaluator_options_override = orbit.StandardEvaluatorOptions(
@@ -76,6 +85,14 @@ class Evaluator(orbit.StandardEvaluator):
     self._enable_visualization = config.evaluator_options.save_predictions
     self._num_vis_samples = config.evaluator_options.num_vis_samples
     self._save_raw_predictions = config.evaluator_options.save_raw_predictions
+    # A single thread reduces the step outputs in order, as the metrics are not
+    # thread-safe.
+    self._max_pending_reduce_steps = (
+        config.evaluator_options.max_pending_reduce_steps)
+    self._reduce_executor = None
+    if self._max_pending_reduce_steps > 0:
+      self._reduce_executor = futures.ThreadPoolExecutor(max_workers=1)
+    self._pending_reduces = collections.deque()
     self._decode_groundtruth_label = (
         config.eval_dataset_options.decode_groundtruth_label)
     if config.evaluator_options.HasField('override_save_dir'):
@@ -124,7 +141,19 @@ class Evaluator(orbit.StandardEvaluator):
           offset=_PANOPTIC_METRIC_OFFSET)
       self._eval_depth_metric = depth_metrics.DepthMetrics()
 
+  def _wait_for_pending_reduces(self, max_pending_reduces=0):
+    """Waits until at most max_pending_reduces reduces are pending.
+
+    Errors raised by the reduces are re-raised here.
+
+    Args:
+      max_pending_reduces: The number of reduces that may still be pending.
+    """
+    while len(self._pending_reduces) > max_pending_reduces:
+      self._pending_reduces.popleft().result()
+
   def _reset(self):
+    self._wait_for_pending_reduces()
     for metric in self._eval_loss_metric_dict.values():
       metric.reset_states()
     self._eval_iou_metric.reset_states()
@@ -164,7 +193,8 @@ class Evaluator(orbit.StandardEvaluator):
     """Implements one step of evaluation.
 
     Runs one step of evaluation with respect to the chosen strategy. In case of
-    a distributed strategy, the replica results are gathered and returned.
+    a distributed strategy, the results of the local replicas are gathered and
+    returned.
 
     Note that all operations within `_eval_step` are tf.function compatible, as
     they will be traced with tf.function. Any other/numpy operations are put in
@@ -176,7 +206,8 @@ class Evaluator(orbit.StandardEvaluator):
 
     Returns:
       An output which is passed as `step_outputs` argument into `eval_reduce`
-      function.
+      function: a list with the outputs of every local replica, where every
+      tensor is wrapped in a tuple of length 1.
     """
 
     def step_fn(inputs):
@@ -184,13 +215,26 @@ class Evaluator(orbit.StandardEvaluator):
       return step_outputs
 
     distributed_outputs = self._strategy.run(step_fn, args=(next(iterator),))
-    return tf.nest.map_structure(self._strategy.experimental_local_results,
-                                 distributed_outputs)
+    num_local_replicas = len(self._strategy.experimental_local_results(
+        distributed_outputs[common.IS_VALID_SAMPLE]))
+    return [
+        tf.nest.map_structure(
+            lambda x, i=i: (self._strategy.experimental_local_results(x)[i],),
+            distributed_outputs) for i in range(num_local_replicas)
+    ]
 
   def _eval_step(self, inputs):
     tf.assert_equal(
         tf.shape(inputs[common.IMAGE])[0], 1, 'Currently only a '
-        'batchsize of 1 is supported in evaluation due to resizing.')
+        'batchsize of 1 per replica is supported in evaluation due to '
+        'resizing.')
+    # The padding examples completing the last batch are computed, but do not
+    # count in the metrics.
+    if common.IS_VALID_SAMPLE in inputs:
+      is_valid = inputs[common.IS_VALID_SAMPLE]
+    else:
+      is_valid = tf.ones([1], dtype=tf.bool)
+    valid_weight = tf.cast(is_valid[0], tf.float32)
     outputs = self._model(inputs[common.IMAGE], training=False) #TODO Important
     raw_size = [
         inputs[common.GT_SIZE_RAW][0, 0], inputs[common.GT_SIZE_RAW][0, 1]
@@ -200,7 +244,7 @@ class Evaluator(orbit.StandardEvaluator):
         tf.shape(inputs[common.RESIZED_IMAGE])[2],
     ]
 
-    step_outputs = {}
+    step_outputs = {common.IS_VALID_SAMPLE: is_valid}
     if self._decode_groundtruth_label:
 
       loss_dict = self._loss(inputs, outputs)
@@ -210,7 +254,8 @@ class Evaluator(orbit.StandardEvaluator):
       }
 
       for name, value in average_loss_dict.items():
-        self._eval_loss_metric_dict[name].update_state(value)
+        self._eval_loss_metric_dict[name].update_state(
+            value, sample_weight=valid_weight)
 
       # We only undo-preprocess for those defined in tuples in model/utils.py.
       outputs = utils.undo_preprocessing(outputs, resized_size,
@@ -223,7 +268,7 @@ class Evaluator(orbit.StandardEvaluator):
           outputs[common.PRED_SEMANTIC_KEY],
           tf.where(
               tf.equal(inputs[common.GT_SEMANTIC_RAW], self._ignore_label), 0.0,
-              1.0))
+              valid_weight))
       if common.TASK_PANOPTIC_SEGMENTATION in self._supported_tasks:
         step_outputs[self._eval_pq_metric.name] = (
             inputs[common.GT_PANOPTIC_RAW], outputs[common.PRED_PANOPTIC_KEY])
@@ -269,6 +314,7 @@ class Evaluator(orbit.StandardEvaluator):
       A dictionary of `Tensors`, which will be written to logs and as
       TensorBoard summaries.
     """
+    self._wait_for_pending_reduces()
     if not self._decode_groundtruth_label:
       return {}
 
@@ -326,6 +372,12 @@ class Evaluator(orbit.StandardEvaluator):
   def eval_reduce(self, state=None, step_outputs=None):
     """A function to do the reduction on the evaluation outputs per step.
 
+    The PQ, AP_Mask, STQ, VPQ and depth metrics accumulate the outputs of all
+    the local replicas, except the padding examples. Unless
+    `max_pending_reduce_steps` is 0, this runs in a background thread and only
+    blocks when that many steps are already pending; `eval_end` waits for all of
+    them.
+
     Args:
       state: A maintained state throughout the evaluation.
       step_outputs: Outputs from the current evaluation step.
@@ -335,6 +387,23 @@ class Evaluator(orbit.StandardEvaluator):
       for the next step. After evaluation is finished, the output from last step
       will be passed into `eval_end` function.
     """
+    if self._reduce_executor is None:
+      self._reduce_step_outputs(step_outputs)
+    else:
+      self._wait_for_pending_reduces(self._max_pending_reduce_steps - 1)
+      self._pending_reduces.append(
+          self._reduce_executor.submit(self._reduce_step_outputs, step_outputs))
+    # We simply return state as it is, since our current implementation does not
+    # keep track of state between steps.
+    return state
+
+  def _reduce_step_outputs(self, step_outputs):
+    for replica_outputs in step_outputs:
+      if replica_outputs[common.IS_VALID_SAMPLE][0][0].numpy():
+        self._reduce_replica_outputs(replica_outputs)
+
+  def _reduce_replica_outputs(self, step_outputs):
+    """Reduces the outputs of one replica, see `eval_reduce`."""
     if self._save_raw_predictions:
       sequence = None
       if self._dataset_info.is_video_dataset:
@@ -352,7 +421,7 @@ class Evaluator(orbit.StandardEvaluator):
     if not self._decode_groundtruth_label:
       # The followed operations will all require decoding groundtruth label, and
       # thus we will simply return if decode_groundtruth_label is False.
-      return state
+      return
 
     if (self._enable_visualization and
         (self._sample_counter < self._num_vis_samples)):
@@ -405,6 +474,3 @@ class Evaluator(orbit.StandardEvaluator):
         batch_size = tf.shape(gt_depth)[0]
         for i in range(batch_size):
           self._eval_depth_metric.update_state(gt_depth[i], pred_depth[i])
-    # We simply return state as it is, since our current implementation does not
-    # keep track of state between steps.
-    return state
@@ -319,6 +319,92 @@ class EvaluatorTest(tf.test.TestCase):
     self.assertSequenceEqual(result['losses/eval_total_loss'].shape, ())
     self.assertEqual(result['losses/eval_total_loss'].numpy(), 0.0)
 
+  def test_ignores_padding_examples(self):
+    experiment_options_textproto = """
+      experiment_name: "evaluation_test"
+      eval_dataset_options {
+        dataset: "cityscapes_panoptic"
+        file_pattern: "EMPTY"
+        batch_size: 1
+        crop_size: 1025
+        crop_size: 2049
+        # Skip resizing.
+        min_resize_value: 0
+        max_resize_value: 0
+      }
+      evaluator_options {
+        continuous_eval_timeout: -1
+        stuff_area_limit: 2048
+        center_score_threshold: 0.1
+        nms_kernel: 13
+        save_predictions: false
+        save_raw_predictions: false
+      }
+    """
+    config = text_format.Parse(experiment_options_textproto,
+                               config_pb2.ExperimentOptions())
+
+    model_proto_filename = os.path.join(
+        _CONFIG_PATH, 'example_cityscapes_panoptic_deeplab.textproto')
+    model_config = _read_proto_file(model_proto_filename,
+                                    config_pb2.ExperimentOptions())
+    config.model_options.CopyFrom(model_config.model_options)
+    model = deeplab.DeepLab(config, dataset.CITYSCAPES_PANOPTIC_INFORMATION)
+    pool_size = (33, 65)
+    model.set_pool_size(pool_size)
+
+    loss_layer = _create_panoptic_deeplab_loss(
+        dataset.CITYSCAPES_PANOPTIC_INFORMATION)
+    global_step = tf.Variable(initial_value=0, dtype=tf.int64)
+
+    fake_datum = {
+        common.IMAGE:
+            tf.zeros([1, 1025, 2049, 3]),
+        common.RESIZED_IMAGE:
+            tf.zeros([1, 1025, 2049, 3]),
+        common.GT_SIZE_RAW:
+            tf.constant([[1025, 2049]], dtype=tf.int32),
+        common.GT_SEMANTIC_KEY:
+            tf.zeros([1, 1025, 2049], dtype=tf.int32),
+        common.GT_SEMANTIC_RAW:
+            tf.zeros([1, 1025, 2049], dtype=tf.int32),
+        common.GT_PANOPTIC_RAW:
+            tf.zeros([1, 1025, 2049], dtype=tf.int32),
+        common.GT_IS_CROWD_RAW:
+            tf.zeros([1, 1025, 2049], dtype=tf.uint8),
+        common.GT_INSTANCE_CENTER_KEY:
+            tf.zeros([1, 1025, 2049], dtype=tf.float32),
+        common.GT_INSTANCE_REGRESSION_KEY:
+            tf.zeros([1, 1025, 2049, 2], dtype=tf.float32),
+        common.IMAGE_NAME:
+            'fake',
+        common.SEMANTIC_LOSS_WEIGHT_KEY:
+            tf.zeros([1, 1025, 2049], dtype=tf.float32),
+        common.CENTER_LOSS_WEIGHT_KEY:
+            tf.zeros([1, 1025, 2049], dtype=tf.float32),
+        common.REGRESSION_LOSS_WEIGHT_KEY:
+            tf.zeros([1, 1025, 2049], dtype=tf.float32),
+        common.IS_VALID_SAMPLE:
+            tf.constant([False]),
+    }
+    fake_data = [fake_datum]
+
+    with tempfile.TemporaryDirectory() as model_dir:
+      with mock.patch.object(runner_utils, 'create_dataset'):
+        ev = evaluator.Evaluator(
+            config, model, loss_layer, global_step, model_dir)
+
+        state = ev.eval_begin()
+        step_outputs = ev.eval_step(iter(fake_data))
+        state = ev.eval_reduce(state, step_outputs)
+        result = ev.eval_end(state)
+
+    # The padding example does not count in any metric.
+    self.assertEqual(result['evaluation/iou/IoU'].numpy(), 0.0)
+    self.assertEqual(result['evaluation/pq/TP'], 0)
+    self.assertEqual(result['evaluation/pq/FN'], 0)
+    self.assertEqual(result['evaluation/pq/FP'], 0)
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -16,6 +16,7 @@
 """Utility functions for the trainer and evaluator runner."""
 from typing import Any
 from typing import Mapping
+from typing import Optional
 from typing import Union
 
 import tensorflow as tf
@@ -75,14 +76,19 @@ def maybe_load_checkpoint(initial_checkpoint: Union[str, None],
 
 def create_dataset(dataset_config: config_pb2.DatasetOptions,
                    is_training: bool,
-                   only_semantic_annotations: bool = False):
+                   only_semantic_annotations: bool = False,
+                   batch_size: Optional[int] = None):
   """Creates a tf.data.Dataset from the configuration.
 
+  The evaluation datasets keep all the examples: their last batch is completed
+  with padding examples, marked by common.IS_VALID_SAMPLE.
+
   Args:
     dataset_config: A dataset_pb2.DatasetOptions configuration.
     is_training: A flag specifying if the dataset is used for training.
     only_semantic_annotations: A flag specifying if only semantic segmentation
       ground-truth should be generated.
+    batch_size: An optional batch size overriding the one of dataset_config.
 
   Returns:
     A tf.data.Dataset.
@@ -132,9 +138,12 @@ def create_dataset(dataset_config: config_pb2.DatasetOptions,
       generator_fn=generator,
       use_panoptic_copy_paste=dataset_config.augmentations.HasField(
           'panoptic_copy_paste'),
-      is_training=is_training)
+      is_training=is_training,
+      compression_type=dataset_config.compression_type)
 
-  return reader(dataset_config.batch_size)
+  if batch_size is None:
+    batch_size = dataset_config.batch_size
+  return reader(batch_size, pad_remainder=not is_training)
 
 
 def create_loss_metric_dict(loss_names, prefix='train_'):
@@ -0,0 +1,299 @@
+import cubicasa5k.labels as ccl
+import glob
+import multiprocessing
+import os
+import time
+from absl import app
+from absl import flags
+from absl import logging
+from collections import defaultdict
+from detection import INFERENCE_MODES, LazyModel, detect_elements_batch
+from graph_creation import create_graph, euclidean_dist, get_elem_names
+from graph_io import save_graph
+from inference_cache import InferenceCache, get_model_fingerprint
+from routing import calc_paths
+from tqdm import tqdm
+
+flags.DEFINE_string("input",
+    default=None,
+    help="Directory or glob pattern of the floor plan images.",
+    required=True)
+
+flags.DEFINE_string("output_dir",
+    default=None,
+    help="Directory to save the graph xml files.",
+    required=True)
+
+flags.DEFINE_string("model_dir",
+    default=os.path.join(os.path.dirname(__file__), "model"),
+    help="Path of the exported SavedModel.")
+
+flags.DEFINE_enum("exit_rule",
+    default="none",
+    enum_values=["none", "outer_doors"],
+    help="Rule used to set the exits when an image has no exits file. "
+    "'outer_doors' marks every door that is connected to at most one room.")
+
+flags.DEFINE_string("exits_suffix",
+    default=".exits.txt",
+    help="Suffix of the exits file next to each image. Each line of the file "
+    "is either a node label (e.g. 'Door 3') or the 'x y' pixel position of "
+    "an exit, which is mapped to the nearest node.")
+
+flags.DEFINE_string("cache_dir",
+    default=None,
+    help="Directory of the inference cache. Images whose outputs are cached "
+    "skip the model. No cache is used if not set.")
+
+flags.DEFINE_integer("cache_max_size_mb",
+    default=4096,
+    help="Size of the inference cache, above which the least recently used "
+    "entries are evicted.")
+
+flags.DEFINE_enum("inference_mode",
+    default="default",
+    enum_values=list(INFERENCE_MODES),
+    help="'default' resizes every image to the training resolution, 'tiled' "
+    "runs overlapping crops at the native resolution, for large plans, 'tta' "
+    "averages several scales and flips, slower but more accurate. 'tiled' and "
+    "'tta' require a model exported with the corresponding signature.")
+
+flags.DEFINE_integer("batch_size",
+    default=1,
+    lower_bound=1,
+    help="Number of images run together by the model, with the batch signature "
+    "of the exported model. Only used with the 'default' inference mode.")
+
+flags.DEFINE_integer("num_workers",
+    default=1,
+    help="Number of worker processes. Each worker loads its own model.")
+
+FLAGS = flags.FLAGS
+
+
+_LABEL_DIVISOR = 256
+_IMG_EXTENSIONS = (".png", ".jpeg", ".jpg", ".bmp", ".gif")
+
+_model_dir = None
+_model: LazyModel = None
+_cache = None
+_inference_mode = "default"
+
+
+def _get_img_file_paths(input):
+    if os.path.isdir(input):
+        file_paths = [os.path.join(input, name) for name in os.listdir(input)]
+    else:
+        file_paths = glob.glob(input)
+
+    return sorted(p for p in file_paths if p.lower().endswith(_IMG_EXTENSIONS))
+
+
+def _init_worker(model_dir, cache_dir, cache_max_size_mb, inference_mode):
+    global _model_dir, _model, _cache, _inference_mode
+    _model_dir = model_dir
+    _inference_mode = inference_mode
+    # The model is loaded on the first cache miss of the worker.
+    _model = LazyModel(model_dir)
+    if cache_dir is not None:
+        _cache = InferenceCache(cache_dir, cache_max_size_mb << 20)
+
+
+def _detect_elements(img_file_paths):
+    model_fingerprint = get_model_fingerprint(_model_dir) if _cache is not None else None
+    results = detect_elements_batch(_model.get, img_file_paths, _cache, model_fingerprint,
+        _inference_mode)
+
+    return [(outputs["panoptic_pred"], outputs["instance_center_pred"], cache_hit)
+        for _, outputs, cache_hit in results]
+
+
+def _read_exits_file(exits_file_path, node_id_to_label, node_id_to_center):
+    exit_ids = []
+
+    with open(exits_file_path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                pos = tuple(float(v) for v in line.split())
+            except ValueError:
+                pos = None
+
+            if pos is not None and len(pos) == 2:
+                if len(node_id_to_center) == 0:
+                    logging.warning("No nodes to map the exit '%s' of %s to", line, exits_file_path)
+                    continue
+                exit_id = min(node_id_to_center, key=lambda id: euclidean_dist(node_id_to_center[id], pos))
+            else:
+                exit_id = next((id for id, label in node_id_to_label.items() if label == line), None)
+                if exit_id is None:
+                    logging.warning("Unknown exit '%s' in %s", line, exits_file_path)
+                    continue
+
+            if exit_id not in exit_ids:
+                exit_ids.append(exit_id)
+
+    return exit_ids
+
+
+def _get_outer_doors(node_id_to_elem_id, graph):
+    room_neibs_num = defaultdict(int)
+
+    for node_id, neib in graph.keys():
+        if node_id_to_elem_id[neib] // _LABEL_DIVISOR == ccl.Label.ROOM:
+            room_neibs_num[node_id] += 1
+
+    return [node_id for node_id, elem_id in node_id_to_elem_id.items()
+        if elem_id // _LABEL_DIVISOR == ccl.Label.DOOR and room_neibs_num[node_id] <= 1]
+
+
+def _get_exit_ids(img_file_path, node_id_to_elem_id, node_id_to_label, node_id_to_center, graph,
+        exit_rule, exits_suffix):
+    exits_file_path = os.path.splitext(img_file_path)[0] + exits_suffix
+    if os.path.isfile(exits_file_path):
+        return _read_exits_file(exits_file_path, node_id_to_label, node_id_to_center)
+
+    if exit_rule == "outer_doors":
+        return _get_outer_doors(node_id_to_elem_id, graph)
+
+    return []
+
+
+def _format_error(e):
+    return f"{type(e).__name__}: {e}"
+
+
+def _detect_elements_or_errors(img_file_paths):
+    """Like _detect_elements, returns a list of (detection, error) with either one set.
+
+    If the batch fails, its images are run one by one, so that a bad image does not fail the
+    others.
+    """
+    try:
+        return [(detection, None) for detection in _detect_elements(img_file_paths)]
+    except Exception as e:
+        if len(img_file_paths) == 1:
+            return [(None, _format_error(e))]
+
+    return [_detect_elements_or_errors([img_file_path])[0] for img_file_path in img_file_paths]
+
+
+def _process_images(args):
+    """Returns a list of (img_file_path, timings, error), error is None if the image succeeded."""
+    img_file_paths, output_dir, exit_rule, exits_suffix = args
+
+    start = time.perf_counter()
+    detections = _detect_elements_or_errors(img_file_paths)
+    # The time of a batch is shared by its images.
+    detect_time = (time.perf_counter() - start) / len(img_file_paths)
+
+    results = []
+    for img_file_path, (detection, error) in zip(img_file_paths, detections):
+        if error is not None:
+            results.append((img_file_path, {}, error))
+            continue
+
+        panoptic_pred, instance_center_pred, cache_hit = detection
+        timings = {"cache_hit" if cache_hit else "detect_elements": detect_time}
+        try:
+            _process_image(img_file_path, panoptic_pred, instance_center_pred, output_dir, exit_rule,
+                exits_suffix, timings)
+        except Exception as e:
+            results.append((img_file_path, {}, _format_error(e)))
+            continue
+        results.append((img_file_path, timings, None))
+
+    return results
+
+
+def _process_image(img_file_path, panoptic_pred, instance_center_pred, output_dir, exit_rule, exits_suffix,
+        timings):
+    start = time.perf_counter()
+    elem_id_to_name = {}
+    for elem_names in get_elem_names(panoptic_pred, _LABEL_DIVISOR, ccl.label_to_str).values():
+        elem_id_to_name.update(elem_names)
+    node_id_to_elem_id, node_id_to_center, graph = create_graph(panoptic_pred,
+        instance_center_pred, _LABEL_DIVISOR, (ccl.Label.ROOM, ccl.Label.DOOR))
+    node_id_to_label = {node_id: elem_id_to_name[elem_id] for node_id, elem_id in node_id_to_elem_id.items()}
+    timings["create_graph"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    exit_ids = _get_exit_ids(img_file_path, node_id_to_elem_id, node_id_to_label, node_id_to_center,
+        graph, exit_rule, exits_suffix)
+    id_to_path = calc_paths(graph, node_id_to_elem_id.keys(), exit_ids)
+    timings["calc_paths"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    nodes = [(id, node_id_to_label[id], node_id_to_center[id], id in exit_ids, id_to_path[id])
+        for id in node_id_to_elem_id.keys()]
+    edges = sorted(edge for edge in graph.keys() if edge[0] < edge[1])
+    name = os.path.splitext(os.path.basename(img_file_path))[0]
+    save_graph(os.path.join(output_dir, name + ".xml"), nodes, edges, graph)
+    timings["save_graph"] = time.perf_counter() - start
+
+
+def main(_):
+    logging.get_absl_handler().setFormatter(None)
+
+    img_file_paths = _get_img_file_paths(FLAGS.input)
+    if len(img_file_paths) == 0:
+        raise ValueError(f"No images found in {FLAGS.input}")
+    os.makedirs(FLAGS.output_dir, exist_ok=True)
+
+    logging.info("Converting %d images with %d workers", len(img_file_paths), FLAGS.num_workers)
+
+    args = [(img_file_paths[i:i + FLAGS.batch_size], FLAGS.output_dir, FLAGS.exit_rule, FLAGS.exits_suffix)
+        for i in range(0, len(img_file_paths), FLAGS.batch_size)]
+    total_timings = defaultdict(float)
+    stage_counts = defaultdict(int)
+    failed_num = 0
+
+    start = time.perf_counter()
+
+    init_args = (FLAGS.model_dir, FLAGS.cache_dir, FLAGS.cache_max_size_mb, FLAGS.inference_mode)
+
+    if FLAGS.num_workers > 1:
+        # TensorFlow is not fork-safe, so the workers are spawned.
+        ctx = multiprocessing.get_context("spawn")
+        pool = ctx.Pool(FLAGS.num_workers, initializer=_init_worker, initargs=init_args)
+        results = pool.imap_unordered(_process_images, args)
+    else:
+        pool = None
+        _init_worker(*init_args)
+        results = map(_process_images, args)
+
+    try:
+        with tqdm(total=len(img_file_paths)) as progress_bar:
+            for batch_results in results:
+                for img_file_path, timings, error in batch_results:
+                    if error is not None:
+                        logging.error("Cannot convert %s: %s", img_file_path, error)
+                        failed_num += 1
+                        continue
+                    logging.debug("%s: %s", img_file_path,
+                        ", ".join(f"{stage} {t:.3f}s" for stage, t in timings.items()))
+                    for stage, t in timings.items():
+                        total_timings[stage] += t
+                        stage_counts[stage] += 1
+                progress_bar.update(len(batch_results))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    elapsed = time.perf_counter() - start
+
+    for stage, t in total_timings.items():
+        logging.info("%s: total %.2fs, mean %.3fs per image", stage, t, t / stage_counts[stage])
+    if "cache_hit" in total_timings:
+        logging.info("Cache hits: %d of %d", stage_counts["cache_hit"], len(img_file_paths))
+    logging.info("Converted %d images in %.2fs", len(img_file_paths) - failed_num, elapsed)
+    if failed_num > 0:
+        logging.warning("Failed to convert %d of %d images", failed_num, len(img_file_paths))
+
+
+if __name__ == '__main__':
+    app.run(main)
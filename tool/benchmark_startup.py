@@ -0,0 +1,143 @@
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+from absl import app
+from absl import flags
+from absl import logging
+
+flags.DEFINE_string("tool_dir",
+    default=os.path.dirname(os.path.abspath(__file__)),
+    help="Directory of the tool.py to measure. To measure an older version, check it out in a "
+    "worktree, e.g. git worktree add /tmp/baseline 02686d9, and pass /tmp/baseline/tool. "
+    "Its model directory must contain the exported model.")
+
+flags.DEFINE_string("graph",
+    default=None,
+    help="Graph xml file opened after the window is shown, as with File > Open graph. "
+    "Ignored by versions of the tool that cannot open graphs.")
+
+flags.DEFINE_boolean("load_model",
+    default=True,
+    help="Whether to also measure the time until the model is loaded. Set it to False to measure "
+    "the viewer alone, which never needs the model.")
+
+flags.DEFINE_string("baseline_tool_dir",
+    default=None,
+    help="Directory of the tool.py of an older version, e.g. the one that imports TensorFlow at "
+    "startup. If set, it is measured too and the time and peak RSS of both are compared at the "
+    "last stage of their runs.")
+
+flags.DEFINE_float("max_viewer_startup_s",
+    default=1.0,
+    help="Target time from the process start until a graph is shown, with --graph and "
+    "--noload_model.")
+
+flags.DEFINE_integer("num_runs",
+    default=5,
+    help="Number of times the tool is started, the median is reported.")
+
+FLAGS = flags.FLAGS
+
+
+# Runs in a new process, so that the interpreter start and every import are
+# measured. The timestamps are wall clock times, comparable with the parent's.
+_CHILD_CODE = """
+import json
+import resource
+import sys
+import time
+
+def _max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+graph_file_path, load_model = sys.argv[1], sys.argv[2] == "1"
+result = {}
+
+from PyQt6.QtWidgets import QApplication
+import tool
+
+app = QApplication(sys.argv[:1])
+win = tool.MainWin()
+win.show()
+app.processEvents()
+result["window_shown"] = (time.time(), _max_rss_mb())
+
+if graph_file_path and hasattr(win, "_load_graph_from_file"):
+    win._load_graph_from_file(graph_file_path)
+    app.processEvents()
+    result["graph_shown"] = (time.time(), _max_rss_mb())
+
+if load_model:
+    # Older versions load the model in MainWin.__init__, newer ones lazily.
+    if hasattr(win._model, "get"):
+        win._model.get()
+    result["model_ready"] = (time.time(), _max_rss_mb())
+
+print(json.dumps(result))
+"""
+
+
+def _run_tool(tool_dir, graph_file_path, load_model):
+    """Starts the tool in a new process, returns a dict stage -> (seconds since start, peak RSS MB)."""
+    repo_dir = os.path.dirname(os.path.abspath(tool_dir))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([tool_dir, repo_dir, env.get("PYTHONPATH", "")])
+    # The inference cache is not used, it does not change the startup.
+    env["TOOL_CACHE_DIR"] = ""
+
+    start = time.time()
+    output = subprocess.run([sys.executable, "-c", _CHILD_CODE, graph_file_path or "", "1" if load_model else "0"],
+        cwd=repo_dir, env=env, stdout=subprocess.PIPE, check=True, text=True).stdout
+
+    return {stage: (t - start, rss) for stage, (t, rss) in json.loads(output.splitlines()[-1]).items()}
+
+
+def _measure(tool_dir, graph_file_path, load_model, num_runs):
+    """Returns a dict stage -> (median seconds since start, median peak RSS MB)."""
+    stage_to_times = {}
+    stage_to_rss = {}
+
+    for i in range(num_runs):
+        stages = _run_tool(tool_dir, graph_file_path, load_model)
+        logging.info("Run {}: {}".format(i + 1,
+            ", ".join("{} {:.2f}s {:.0f}MB".format(stage, t, rss) for stage, (t, rss) in stages.items())))
+        for stage, (t, rss) in stages.items():
+            stage_to_times.setdefault(stage, []).append(t)
+            stage_to_rss.setdefault(stage, []).append(rss)
+
+    logging.info("{}, {} runs".format(tool_dir, num_runs))
+    for stage, times in stage_to_times.items():
+        logging.info("{}: median {:.2f}s after start, min {:.2f}s, peak RSS {:.0f}MB".format(
+            stage, np.median(times), np.min(times), np.median(stage_to_rss[stage])))
+
+    return {stage: (np.median(times), np.median(stage_to_rss[stage])) for stage, times in stage_to_times.items()}
+
+
+def main(_):
+    logging.get_absl_handler().setFormatter(None)
+
+    stages = _measure(FLAGS.tool_dir, FLAGS.graph, FLAGS.load_model, FLAGS.num_runs)
+
+    if "graph_shown" in stages and not FLAGS.load_model:
+        t, _ = stages["graph_shown"]
+        logging.info("Viewer: graph shown {:.2f}s after start, {} the {:.1f}s target".format(
+            t, "within" if t <= FLAGS.max_viewer_startup_s else "above", FLAGS.max_viewer_startup_s))
+
+    if FLAGS.baseline_tool_dir is None:
+        return
+
+    baseline_stages = _measure(FLAGS.baseline_tool_dir, FLAGS.graph, FLAGS.load_model, FLAGS.num_runs)
+    # The last stage of each run is when the tool is ready for use. The
+    # baseline cannot open graphs, and loads the model before showing the
+    # window, so its last stage may differ.
+    stage, (t, rss) = list(stages.items())[-1]
+    baseline_stage, (baseline_t, baseline_rss) = list(baseline_stages.items())[-1]
+    logging.info("Ready: {} {:.2f}s vs baseline {} {:.2f}s ({:.1f}x faster), peak RSS {:.0f}MB vs {:.0f}MB "
+        "({:.0%} of the baseline)".format(stage, t, baseline_stage, baseline_t, baseline_t / t, rss,
+        baseline_rss, rss / baseline_rss))
+
+if __name__ == '__main__':
+    app.run(main)
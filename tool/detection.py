@@ -0,0 +1,185 @@
+import io
+import numpy as np
+import threading
+from inference_cache import InferenceCache
+from PIL import Image
+
+# TensorFlow is imported only when the model is first needed, so that the
+# tool can start, and view or edit graphs, without paying for it.
+
+
+# The model outputs kept from every inference, without the batch dimension.
+# The model can be exported with only these outputs, see --output_keys of
+# deeplab2/export_model.py.
+OUTPUT_NAMES = ("panoptic_pred", "instance_center_pred")
+PREPROCESSING_OPTIONS = {"color_mode": "RGB"}
+# "default" resizes the image to the training resolution, "tiled" runs
+# overlapping crops at the native resolution, for large plans, and "tta"
+# averages several scales and flips, slower but more accurate.
+INFERENCE_MODES = ("default", "tiled", "tta")
+
+
+def read_image(img_file_path):
+    with open(img_file_path, "rb") as f:
+        img_bytes = f.read()
+
+    img_array = np.array(Image.open(io.BytesIO(img_bytes)).convert(PREPROCESSING_OPTIONS["color_mode"]))
+
+    return img_bytes, img_array
+
+
+class LazyModel():
+    """Imports TensorFlow and loads the SavedModel on the first call of get()."""
+    def __init__(self, model_dir):
+        self._model_dir = model_dir
+        self._model = None
+        self._lock = threading.Lock()
+
+
+    @property
+    def is_loaded(self):
+        return self._model is not None
+
+
+    def get(self):
+        with self._lock:
+            if self._model is None:
+                import tensorflow as tf
+
+                self._model = tf.saved_model.load(self._model_dir)
+
+        return self._model
+
+
+def _get_model_fn(model, mode):
+    if mode == "default":
+        return model
+    if mode == "tiled":
+        if not hasattr(model, "tiled_call"):
+            raise ValueError("The model does not support tiled inference, export it again")
+        return model.tiled_call
+    if mode == "tta":
+        if not hasattr(model, "tta_call"):
+            raise ValueError("The model does not support test-time augmentation, export it again")
+        return model.tta_call
+    raise ValueError(f"Unknown inference mode: {mode}")
+
+
+def run_model(model, img_array, mode="default"):
+    import tensorflow as tf
+
+    output = _get_model_fn(model, mode)(tf.cast(img_array, tf.uint8))
+    # output is a dict with the keys selected at export, by default:
+    # center_heatmap, instance_center_pred, instance_pred,
+    # panoptic_pred, offset_map, semantic_pred,
+    # semantic_logits, instance_scores, semantic_probs
+
+    return {name: output[name].numpy()[0] for name in OUTPUT_NAMES}
+
+
+def run_model_batch(model, img_arrays, mode="default"):
+    """Runs the model on a list of images, in one call if possible.
+
+    The images are padded to the same size and run with the batch signature of
+    the model. Returns a list of dicts name -> array, cropped to every image.
+    """
+    if len(img_arrays) == 1 or mode != "default":
+        return [run_model(model, img_array, mode) for img_array in img_arrays]
+    if not hasattr(model, "batch_call"):
+        raise ValueError("The model does not support batch inference, export it again")
+
+    import tensorflow as tf
+
+    sizes = np.array([img_array.shape[:2] for img_array in img_arrays], dtype=np.int32)
+    height, width = sizes.max(axis=0)
+    batch = np.zeros((len(img_arrays), height, width, 3), dtype=np.uint8)
+    for batch_img_array, img_array in zip(batch, img_arrays):
+        batch_img_array[:img_array.shape[0], :img_array.shape[1]] = img_array
+
+    output = model.batch_call(tf.constant(batch), tf.constant(sizes))
+    output = {name: output[name].numpy() for name in OUTPUT_NAMES}
+
+    return [{name: output[name][i, :h, :w] for name in OUTPUT_NAMES} for i, (h, w) in enumerate(sizes)]
+
+
+def _get_cache_key(img_bytes, model_fingerprint, mode):
+    options = PREPROCESSING_OPTIONS
+    if mode != "default":
+        # The default mode keeps the keys of the entries cached before the modes.
+        options = dict(options, inference_mode=mode)
+    return InferenceCache.get_key(img_bytes, model_fingerprint, options)
+
+
+def _load_outputs(cache, key):
+    outputs = cache.load(key)
+    if outputs is not None and all(name in outputs for name in OUTPUT_NAMES):
+        return outputs
+    return None
+
+
+def detect_elements(get_model, img_file_path, cache: InferenceCache = None, model_fingerprint=None,
+        mode="default"):
+    """Runs the model on an image, or loads its outputs from the cache.
+
+    Args:
+      get_model: Callable returning the model, only called on a cache miss.
+      img_file_path: Path of the image.
+      cache: Optional InferenceCache.
+      model_fingerprint: Fingerprint of the model, required with a cache.
+      mode: One of INFERENCE_MODES.
+
+    Returns:
+      img_array: The RGB image array.
+      outputs: Dict name -> array for every name in OUTPUT_NAMES.
+      cache_hit: Whether the outputs were loaded from the cache.
+    """
+    img_bytes, img_array = read_image(img_file_path)
+
+    if cache is None:
+        return img_array, run_model(get_model(), img_array, mode), False
+
+    key = _get_cache_key(img_bytes, model_fingerprint, mode)
+    outputs = _load_outputs(cache, key)
+    if outputs is not None:
+        return img_array, outputs, True
+
+    outputs = run_model(get_model(), img_array, mode)
+    cache.save(key, outputs)
+
+    return img_array, outputs, False
+
+
+def detect_elements_batch(get_model, img_file_paths, cache: InferenceCache = None,
+        model_fingerprint=None, mode="default"):
+    """Like detect_elements, for a list of images.
+
+    The images whose outputs are not cached are run together with
+    run_model_batch.
+
+    Returns:
+      A list of (img_array, outputs, cache_hit) tuples, one per image.
+    """
+    results = []
+    keys = []
+    misses = []
+
+    for img_file_path in img_file_paths:
+        img_bytes, img_array = read_image(img_file_path)
+        outputs = None
+        key = None
+        if cache is not None:
+            key = _get_cache_key(img_bytes, model_fingerprint, mode)
+            outputs = _load_outputs(cache, key)
+        if outputs is None:
+            misses.append(len(results))
+        results.append((img_array, outputs, outputs is not None))
+        keys.append(key)
+
+    if len(misses) > 0:
+        miss_outputs = run_model_batch(get_model(), [results[i][0] for i in misses], mode)
+        for i, outputs in zip(misses, miss_outputs):
+            results[i] = (results[i][0], outputs, False)
+            if cache is not None:
+                cache.save(keys[i], outputs)
+
+    return results
@@ -0,0 +1,126 @@
+from math import sqrt
+import numpy as np
+
+
+def _get_label_mask(panoptic_pred, label_divisor, labels):
+    return np.isin(panoptic_pred // label_divisor, labels)
+
+
+def find_elem_centers(panoptic_pred, instance_center_pred, label_divisor, labels):
+    """Returns a dict elem_id -> (x, y) with the pixel of maximum center score.
+
+    Ties are resolved in favour of the first pixel in row-major order, and
+    elements whose scores never exceed -1.0 get no center.
+    """
+    mask = _get_label_mask(panoptic_pred, label_divisor, labels)
+    pixel_indices = np.flatnonzero(mask)
+    if len(pixel_indices) == 0:
+        return {}
+
+    elem_ids = panoptic_pred.ravel()[pixel_indices]
+    scores = instance_center_pred.ravel()[pixel_indices]
+
+    unique_ids, inverse = np.unique(elem_ids, return_inverse=True)
+    max_scores = np.full(len(unique_ids), -1.0, dtype=scores.dtype)
+    np.maximum.at(max_scores, inverse, scores)
+
+    is_max = (scores == max_scores[inverse]) & (scores > -1.0)
+    groups, first = np.unique(inverse[is_max], return_index=True)
+    center_indices = pixel_indices[is_max][first]
+
+    ys, xs = np.unravel_index(center_indices, panoptic_pred.shape)
+
+    return {unique_ids[g].item(): (x.item(), y.item()) for g, x, y in zip(groups, xs, ys)}
+
+
+def find_elem_adjacency(panoptic_pred, label_divisor, labels):
+    """Returns a sorted array of (elem_id, neib_id) pairs of 4-connected elements.
+
+    Every pair is reported in both directions.
+    """
+    panoptic_pred = panoptic_pred.astype(np.int64)
+    mask = _get_label_mask(panoptic_pred, label_divisor, labels)
+    base = panoptic_pred.max() + 1 if panoptic_pred.size > 0 else 1
+
+    codes = []
+    for a, b, mask_a, mask_b in (
+        (panoptic_pred[:-1, :], panoptic_pred[1:, :], mask[:-1, :], mask[1:, :]),
+        (panoptic_pred[:, :-1], panoptic_pred[:, 1:], mask[:, :-1], mask[:, 1:])):
+        sel = mask_a & mask_b & (a != b)
+        a = a[sel]
+        b = b[sel]
+        codes.append(a*base + b)
+        codes.append(b*base + a)
+
+    codes = np.unique(np.concatenate(codes))
+
+    return np.stack((codes // base, codes % base), axis=1)
+
+
+def euclidean_dist(p1, p2):
+    x = p1[0] - p2[0]
+    y = p1[1] - p2[1]
+    return sqrt(x*x + y*y)
+
+
+def get_elem_names(panoptic_pred, label_divisor, label_to_str):
+    """Returns a dict label -> list of (elem_id, name) as listed in the tool.
+
+    The elements with instance 0 are named after their label group, e.g. "Rooms".
+    """
+    ids = np.unique(panoptic_pred)
+    labels = np.unique(ids // label_divisor)
+
+    # The tool used to enumerate the instances of each label together with a
+    # placeholder for the pixels of other labels, so the numbering starts at 1
+    # whenever the image contains more than one label.
+    first_index = 1 if len(labels) > 1 else 0
+
+    label_to_elem_names = {}
+
+    for label in labels.tolist():
+        label_str = label_to_str[label]
+        elem_names = []
+
+        for i, id in enumerate(ids[ids // label_divisor == label].tolist(), first_index):
+            if id % label_divisor == 0:
+                elem_names.append((id, label_str + "s"))
+            else:
+                elem_names.append((id, f"{label_str} {i}"))
+
+        label_to_elem_names[label] = elem_names
+
+    return label_to_elem_names
+
+
+def create_graph(panoptic_pred, instance_center_pred, label_divisor, labels):
+    """Creates the graph of the elements with the given labels.
+
+    Returns:
+      node_id_to_elem_id: Dict node_id -> elem_id, in ascending elem_id order.
+      node_id_to_center: Dict node_id -> (x, y).
+      graph: Dict (node_id, neib_node_id) -> distance, with both directions.
+    """
+    elem_id_to_center = find_elem_centers(panoptic_pred, instance_center_pred, label_divisor, labels)
+    elem_id_edges = find_elem_adjacency(panoptic_pred, label_divisor, labels)
+
+    elem_ids = np.unique(panoptic_pred)
+    elem_ids = elem_ids[np.isin(elem_ids // label_divisor, labels)]
+
+    node_id_to_elem_id = {}
+    elem_id_to_node_id = {}
+    node_id_to_center = {}
+
+    for node_id, elem_id in enumerate(elem_ids.tolist(), 1):
+        node_id_to_elem_id[node_id] = elem_id
+        elem_id_to_node_id[elem_id] = node_id
+        if elem_id in elem_id_to_center:
+            node_id_to_center[node_id] = elem_id_to_center[elem_id]
+
+    graph = {}
+
+    for elem_id, neib in elem_id_edges.tolist():
+        edge = (elem_id_to_node_id[elem_id], elem_id_to_node_id[neib])
+        graph[edge] = euclidean_dist(node_id_to_center[edge[0]], node_id_to_center[edge[1]])
+
+    return node_id_to_elem_id, node_id_to_center, graph
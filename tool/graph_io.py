@@ -0,0 +1,91 @@
+import xml.etree.ElementTree as ET
+from xml.dom import minidom
+
+
+def save_graph(filename, nodes, edges, graph):
+    """Saves the graph to an xml file.
+
+    Args:
+      filename: Path of the xml file.
+      nodes: Iterable of (id, label, center, is_exit, path) tuples.
+      edges: Iterable of (node_id, neib_node_id) with node_id < neib_node_id.
+      graph: Dict (node_id, neib_node_id) -> distance.
+    """
+    network_node = ET.Element('network')
+
+    for id, label, center, is_exit, path in nodes:
+        node_elem = ET.SubElement(network_node, 'node')
+
+        id_elem = ET.SubElement(node_elem, 'id')
+        id_elem.text = str(id)
+
+        label_elem = ET.SubElement(node_elem, 'label')
+        label_elem.text = label
+
+        x_node = ET.SubElement(node_elem, 'x')
+        x_node.text = str(center[0])
+
+        y_node = ET.SubElement(node_elem, 'y')
+        y_node.text = str(center[1])
+
+        exit_node = ET.SubElement(node_elem, 'exit')
+        exit_node.text = str(is_exit).lower()
+
+        if len(path) > 0:
+            path_node = ET.SubElement(node_elem, 'path')
+            path_node.text = ' '.join(map(str, path))
+
+    edge_id = 1
+
+    for edge in edges:
+        edge_elem = ET.SubElement(network_node, 'edge')
+
+        id_elem = ET.SubElement(edge_elem, 'id')
+        id_elem.text = str(edge_id)
+        edge_id += 1
+
+        from_elem = ET.SubElement(edge_elem, 'from')
+        from_elem.text = str(edge[0])
+
+        to_elem = ET.SubElement(edge_elem, 'to')
+        to_elem.text = str(edge[1])
+
+        length_elem = ET.SubElement(edge_elem, 'length')
+        length_elem.text = str(graph[edge])
+
+    xml_str = ET.tostring(network_node, encoding='unicode')
+    dom = minidom.parseString(xml_str)
+    xml_str = dom.toprettyxml(indent="  ")
+    with open(filename, 'w') as f:
+        f.write(xml_str)
+
+
+def load_graph(filename):
+    """Loads a graph saved by save_graph.
+
+    Returns:
+      nodes: List of (id, label, center, is_exit, path) tuples.
+      graph: Dict (node_id, neib_node_id) -> distance, with both directions.
+    """
+    network_node = ET.parse(filename).getroot()
+
+    nodes = []
+
+    for node_elem in network_node.iter('node'):
+        id = int(node_elem.findtext('id'))
+        label = node_elem.findtext('label') or ""
+        center = (int(float(node_elem.findtext('x'))), int(float(node_elem.findtext('y'))))
+        is_exit = node_elem.findtext('exit', 'false').strip() == 'true'
+        path = [int(v) for v in node_elem.findtext('path', '').split()]
+        nodes.append((id, label, center, is_exit, path))
+
+    graph = {}
+
+    for edge_elem in network_node.iter('edge'):
+        node_id = int(edge_elem.findtext('from'))
+        neib = int(edge_elem.findtext('to'))
+        dist = float(edge_elem.findtext('length'))
+        graph[(node_id, neib)] = dist
+        graph[(neib, node_id)] = dist
+
+    return nodes, graph
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import numpy as np
+import os
+import tempfile
+import zipfile
+import zlib
+
+
+_CACHE_FILE_EXT = ".npz"
+_TMP_FILE_PREFIX = ".tmp"
+# The variables index stores a checksum of every variable, so together with
+# the graph it identifies the model without reading all the weights.
+_MODEL_FILE_NAMES = (
+    "saved_model.pb",
+    os.path.join("variables", "variables.index"),
+)
+
+_model_dir_to_fingerprint = {}
+
+
+def get_model_fingerprint(model_dir):
+    """Returns a hash of the SavedModel graph and variables in model_dir.
+
+    Raises ValueError if model_dir has none of them, since every missing or
+    wrong model_dir would otherwise share the same fingerprint.
+    """
+    model_dir = os.path.abspath(model_dir)
+    if model_dir in _model_dir_to_fingerprint:
+        return _model_dir_to_fingerprint[model_dir]
+
+    h = hashlib.sha256()
+    found = False
+    for file_name in _MODEL_FILE_NAMES:
+        file_path = os.path.join(model_dir, file_name)
+        if not os.path.isfile(file_path):
+            continue
+        found = True
+        h.update(file_name.encode())
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+
+    if not found:
+        raise ValueError(f"No SavedModel found in {model_dir}")
+
+    fingerprint = h.hexdigest()
+    _model_dir_to_fingerprint[model_dir] = fingerprint
+    return fingerprint
+
+
+class InferenceCache():
+    """On-disk cache of the model outputs of every image.
+
+    The entries are keyed by the hash of the image bytes, the model fingerprint
+    and the preprocessing options, and stored as compressed npz files. When the
+    cache grows beyond max_size bytes, the least recently used entries are
+    evicted.
+    """
+    def __init__(self, cache_dir, max_size=1 << 30):
+        self._cache_dir = cache_dir
+        self._max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+
+    @staticmethod
+    def get_key(img_bytes, model_fingerprint, options=None):
+        h = hashlib.sha256()
+        h.update(hashlib.sha256(img_bytes).digest())
+        h.update(model_fingerprint.encode())
+        h.update(json.dumps(options or {}, sort_keys=True).encode())
+        return h.hexdigest()
+
+
+    def _get_file_path(self, key):
+        return os.path.join(self._cache_dir, key + _CACHE_FILE_EXT)
+
+
+    def load(self, key):
+        """Returns a dict name -> array, or None on a cache miss."""
+        file_path = self._get_file_path(key)
+
+        try:
+            with np.load(file_path) as data:
+                arrays = {name: data[name] for name in data.files}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile, zlib.error):
+            # A truncated or corrupt entry, e.g. from a full disk, is a miss
+            # and is removed, so that it is saved again.
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+            return None
+
+        # The modification time is the last access time used for the eviction.
+        try:
+            os.utime(file_path)
+        except OSError:
+            pass
+
+        return arrays
+
+
+    def save(self, key, arrays):
+        fd, tmp_file_path = tempfile.mkstemp(prefix=_TMP_FILE_PREFIX, suffix=_CACHE_FILE_EXT,
+            dir=self._cache_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(tmp_file_path, self._get_file_path(key))
+        except BaseException:
+            os.remove(tmp_file_path)
+            raise
+
+        self._evict()
+
+
+    def _evict(self):
+        entries = []
+        total_size = 0
+
+        for entry in os.scandir(self._cache_dir):
+            if entry.name.startswith(_TMP_FILE_PREFIX) or not entry.name.endswith(_CACHE_FILE_EXT):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_size += stat.st_size
+
+        entries.sort()
+
+        for _, size, file_path in entries:
+            if total_size <= self._max_size:
+                break
+            try:
+                os.remove(file_path)
+            except OSError:
+                continue
+            total_size -= size
@@ -0,0 +1,78 @@
+import numpy as np
+
+
+class OverlayCompositor():
+    """Draws the selected elements of a panoptic prediction over the image.
+
+    The decoded background, a dense index map of the element ids and the
+    bounding box of every element are computed once, so every selection is
+    drawn with a single lookup table pass over the bounding box of the
+    selected elements, no matter how many of them are selected.
+    """
+    def __init__(self, background, panoptic_pred, alpha=200):
+        self._background = background
+        self._alpha = alpha
+
+        ids, index_map = np.unique(panoptic_pred, return_inverse=True)
+        self._index_map = index_map.reshape(panoptic_pred.shape)
+        self._id_to_index = {id: i for i, id in enumerate(ids.tolist())}
+        self._bboxes = self._get_bboxes(self._index_map, len(ids))
+
+
+    @staticmethod
+    def _get_bboxes(index_map, num_ids):
+        height, width = index_map.shape
+        rows = np.repeat(np.arange(height), width)
+        cols = np.tile(np.arange(width), height)
+        flat_index_map = index_map.ravel()
+
+        bboxes = np.empty((num_ids, 4), dtype=np.int64)
+        bboxes[:, 0] = height
+        bboxes[:, 1] = width
+        bboxes[:, 2] = 0
+        bboxes[:, 3] = 0
+        np.minimum.at(bboxes[:, 0], flat_index_map, rows)
+        np.minimum.at(bboxes[:, 1], flat_index_map, cols)
+        np.maximum.at(bboxes[:, 2], flat_index_map, rows + 1)
+        np.maximum.at(bboxes[:, 3], flat_index_map, cols + 1)
+
+        return bboxes
+
+
+    @property
+    def background(self):
+        return self._background
+
+
+    def compose(self, id_to_color):
+        """Returns a copy of the background with the given elements blended in.
+
+        Args:
+          id_to_color: Dict elem_id -> (r, g, b) of the selected elements.
+        """
+        img_array = self._background.copy()
+
+        indices = [self._id_to_index[id] for id in id_to_color if id in self._id_to_index]
+        if len(indices) == 0:
+            return img_array
+
+        alpha_lut = np.zeros(len(self._id_to_index), dtype=np.uint16)
+        color_lut = np.zeros((len(self._id_to_index), 3), dtype=np.uint16)
+        for id, color in id_to_color.items():
+            index = self._id_to_index.get(id)
+            if index is not None:
+                alpha_lut[index] = self._alpha
+                color_lut[index] = color[:3]
+
+        bboxes = self._bboxes[indices]
+        top, left = bboxes[:, 0].min(), bboxes[:, 1].min()
+        bottom, right = bboxes[:, 2].max(), bboxes[:, 3].max()
+
+        region = self._index_map[top:bottom, left:right]
+        alpha = alpha_lut[region][:, :, np.newaxis]
+        color = color_lut[region]
+        background = img_array[top:bottom, left:right].astype(np.uint16)
+
+        img_array[top:bottom, left:right] = ((color*alpha + background*(255 - alpha) + 127) // 255).astype(np.uint8)
+
+        return img_array
@@ -0,0 +1,319 @@
+import heapq
+import math
+
+
+class Route():
+    def __init__(self, exit_id, dist, path):
+        self.exit_id = exit_id
+        self.dist = dist
+        self.path = path
+
+
+def _get_adjacency(graph, id_to_index):
+    adjacency = [[] for _ in range(len(id_to_index))]
+
+    for (node_id, neib), cost in graph.items():
+        adjacency[id_to_index[node_id]].append((id_to_index[neib], cost))
+
+    return adjacency
+
+
+def _multi_source_dijkstra(adjacency, source_indices):
+    """Runs Dijkstra with all the sources at distance 0.
+
+    Returns:
+      dists: List of the distances to the nearest source (inf if unreachable).
+      preds: List of the previous node index on the way from the nearest
+        source, -1 for the sources and the unreachable nodes.
+      sources: List of the nearest source index, -1 if unreachable.
+    """
+    n = len(adjacency)
+    dists = [math.inf]*n
+    preds = [-1]*n
+    sources = [-1]*n
+
+    heap = []
+    for i in source_indices:
+        if dists[i] > 0.0:
+            dists[i] = 0.0
+            sources[i] = i
+            heap.append((0.0, i))
+    heapq.heapify(heap)
+
+    while heap:
+        dist, i = heapq.heappop(heap)
+        if dist > dists[i]:
+            continue
+
+        for j, cost in adjacency[i]:
+            new_dist = dist + cost
+            if new_dist < dists[j]:
+                dists[j] = new_dist
+                preds[j] = i
+                sources[j] = sources[i]
+                heapq.heappush(heap, (new_dist, j))
+
+    return dists, preds, sources
+
+
+def calc_routes(graph, node_ids, exit_ids):
+    """Calculates the route from every node to its nearest exit.
+
+    All the exits are routed together with a single multi-source Dijkstra, so
+    the cost is O(E log V) regardless of the number of exits.
+
+    Args:
+      graph: Dict (node_id, neib_node_id) -> distance, with both directions.
+      node_ids: Iterable of all the node ids.
+      exit_ids: List of the exit node ids.
+
+    Returns:
+      A dict node_id -> Route for every node that can reach an exit.
+    """
+    node_ids = list(node_ids)
+    id_to_index = {id: i for i, id in enumerate(node_ids)}
+
+    adjacency = _get_adjacency(graph, id_to_index)
+    dists, preds, sources = _multi_source_dijkstra(adjacency, [id_to_index[id] for id in exit_ids])
+
+    routes = {}
+
+    for i, id in enumerate(node_ids):
+        if sources[i] == -1:
+            continue
+
+        path = [id]
+        j = preds[i]
+        while j != -1:
+            path.append(node_ids[j])
+            j = preds[j]
+
+        routes[id] = Route(node_ids[sources[i]], dists[i], path)
+
+    return routes
+
+
+def calc_paths(graph, node_ids, exit_ids):
+    """Calculates the shortest path from every node to its nearest exit.
+
+    Returns:
+      A dict node_id -> path, where path is the list of node ids from the node
+      to the exit, or an empty list if no exit is reachable.
+    """
+    node_ids = list(node_ids)
+    routes = calc_routes(graph, node_ids, exit_ids)
+
+    return {id: routes[id].path if id in routes else [] for id in node_ids}
+
+
+class DynamicRoutes():
+    """Keeps the routes to the nearest exits up to date while the graph is edited.
+
+    The shortest path tree is repaired locally after every change: a decrease
+    propagates from the endpoint that got closer to an exit, while an increase
+    or deletion of a tree edge invalidates only the subtree below it, which is
+    then reattached from its unaffected neighbours. The graph is undirected.
+
+    Every change returns the set of node ids whose path changed, so that only
+    their paths need to be fetched again.
+    """
+    def __init__(self, graph, node_ids, exit_ids):
+        self._id_to_neibs = {id: {} for id in node_ids}
+        for (node_id, neib), cost in graph.items():
+            self._id_to_neibs[node_id][neib] = cost
+
+        self._exit_ids = set(exit_ids)
+        self._id_to_dist = {id: math.inf for id in self._id_to_neibs}
+        self._id_to_pred = {id: None for id in self._id_to_neibs}
+        self._id_to_exit = {id: None for id in self._id_to_neibs}
+        self._id_to_children = {id: set() for id in self._id_to_neibs}
+        self._changed_ids = set()
+
+        heap = []
+        for id in self._exit_ids:
+            self._set_exit_root(id)
+            heap.append((0.0, id))
+        self._propagate(heap)
+        self._changed_ids.clear()
+
+
+    def _set_exit_root(self, id):
+        self._set_pred(id, None)
+        self._id_to_dist[id] = 0.0
+        self._id_to_exit[id] = id
+
+
+    def _set_pred(self, id, pred):
+        old_pred = self._id_to_pred[id]
+        if old_pred is not None:
+            self._id_to_children[old_pred].discard(id)
+        if pred is not None:
+            self._id_to_children[pred].add(id)
+        self._id_to_pred[id] = pred
+        self._changed_ids.add(id)
+
+
+    def _pop_changed_ids(self):
+        """Returns the nodes whose predecessor was set since the last call, with their subtrees."""
+        changed_ids = set()
+        stack = [id for id in self._changed_ids if id in self._id_to_pred]
+        self._changed_ids.clear()
+
+        while stack:
+            id = stack.pop()
+            if id in changed_ids:
+                continue
+            changed_ids.add(id)
+            stack.extend(self._id_to_children[id])
+
+        return changed_ids
+
+
+    def _relax(self, id, neib, heap):
+        new_dist = self._id_to_dist[id] + self._id_to_neibs[id][neib]
+        if new_dist < self._id_to_dist[neib]:
+            self._id_to_dist[neib] = new_dist
+            self._id_to_exit[neib] = self._id_to_exit[id]
+            self._set_pred(neib, id)
+            heapq.heappush(heap, (new_dist, neib))
+
+
+    def _propagate(self, heap):
+        heapq.heapify(heap)
+
+        while heap:
+            dist, id = heapq.heappop(heap)
+            if dist > self._id_to_dist[id]:
+                continue
+
+            for neib in self._id_to_neibs[id]:
+                self._relax(id, neib, heap)
+
+
+    def _invalidate(self, root_ids):
+        affected = []
+        stack = list(root_ids)
+
+        while stack:
+            id = stack.pop()
+            affected.append(id)
+            stack.extend(self._id_to_children[id])
+
+        for id in affected:
+            self._set_pred(id, None)
+            self._id_to_dist[id] = math.inf
+            self._id_to_exit[id] = None
+
+        return affected
+
+
+    def _reattach(self, affected):
+        heap = []
+
+        for id in affected:
+            if id in self._exit_ids:
+                self._set_exit_root(id)
+                heap.append((0.0, id))
+                continue
+
+            for neib in self._id_to_neibs[id]:
+                if self._id_to_dist[neib] < math.inf:
+                    self._relax(neib, id, heap)
+
+        self._propagate(heap)
+
+
+    def _decrease(self, node_id, neib):
+        heap = []
+        self._relax(node_id, neib, heap)
+        self._relax(neib, node_id, heap)
+        self._propagate(heap)
+
+
+    def _increase(self, node_id, neib):
+        if self._id_to_pred[neib] == node_id:
+            self._reattach(self._invalidate([neib]))
+        elif self._id_to_pred[node_id] == neib:
+            self._reattach(self._invalidate([node_id]))
+
+
+    def set_edge(self, node_id, neib, dist):
+        old_dist = self._id_to_neibs[node_id].get(neib, math.inf)
+        self._id_to_neibs[node_id][neib] = dist
+        self._id_to_neibs[neib][node_id] = dist
+
+        if dist < old_dist:
+            self._decrease(node_id, neib)
+        elif dist > old_dist:
+            self._increase(node_id, neib)
+
+        return self._pop_changed_ids()
+
+
+    def remove_edge(self, node_id, neib):
+        self._id_to_neibs[node_id].pop(neib)
+        self._id_to_neibs[neib].pop(node_id)
+        self._increase(node_id, neib)
+
+        return self._pop_changed_ids()
+
+
+    def add_node(self, node_id):
+        self._id_to_neibs[node_id] = {}
+        self._id_to_dist[node_id] = math.inf
+        self._id_to_pred[node_id] = None
+        self._id_to_exit[node_id] = None
+        self._id_to_children[node_id] = set()
+
+        return set()
+
+
+    def remove_node(self, node_id):
+        affected = self._invalidate([node_id])
+        affected.remove(node_id)
+
+        for neib in self._id_to_neibs.pop(node_id):
+            self._id_to_neibs[neib].pop(node_id)
+        self._exit_ids.discard(node_id)
+        self._id_to_dist.pop(node_id)
+        self._id_to_pred.pop(node_id)
+        self._id_to_exit.pop(node_id)
+        self._id_to_children.pop(node_id)
+
+        self._reattach(affected)
+
+        return self._pop_changed_ids()
+
+
+    def set_exit(self, node_id, is_exit):
+        if is_exit == (node_id in self._exit_ids):
+            return set()
+
+        if is_exit:
+            self._exit_ids.add(node_id)
+            self._set_exit_root(node_id)
+            self._propagate([(0.0, node_id)])
+        else:
+            self._exit_ids.discard(node_id)
+            self._reattach(self._invalidate([node_id]))
+
+        return self._pop_changed_ids()
+
+
+    def get_route(self, node_id):
+        """Returns the Route of the node, or None if no exit is reachable."""
+        if self._id_to_exit[node_id] is None:
+            return None
+
+        path = [node_id]
+        pred = self._id_to_pred[node_id]
+        while pred is not None:
+            path.append(pred)
+            pred = self._id_to_pred[pred]
+
+        return Route(self._id_to_exit[node_id], self._id_to_dist[node_id], path)
+
+
+    def get_path(self, node_id):
+        route = self.get_route(node_id)
+        return route.path if route is not None else []
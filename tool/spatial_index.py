@@ -0,0 +1,87 @@
+import math
+from collections import defaultdict
+
+
+class GridIndex():
+    """Uniform grid over node centers and edge segments in image coordinates.
+
+    Every edge is stored in all the cells its bounding box overlaps, so picking
+    only has to look at the cells around the cursor instead of the whole graph.
+    """
+    def __init__(self, cell_size=64):
+        self._cell_size = cell_size
+        self._cell_to_nodes = defaultdict(set)
+        self._cell_to_edges = defaultdict(set)
+        self._node_to_cell = {}
+        self._edge_to_cells = {}
+
+
+    def _get_cell(self, x, y):
+        return int(math.floor(x / self._cell_size)), int(math.floor(y / self._cell_size))
+
+
+    def _get_cells(self, x1, y1, x2, y2):
+        min_i, min_j = self._get_cell(min(x1, x2), min(y1, y2))
+        max_i, max_j = self._get_cell(max(x1, x2), max(y1, y2))
+
+        return [(i, j) for i in range(min_i, max_i + 1) for j in range(min_j, max_j + 1)]
+
+
+    def clear(self):
+        self._cell_to_nodes.clear()
+        self._cell_to_edges.clear()
+        self._node_to_cell.clear()
+        self._edge_to_cells.clear()
+
+
+    def set_node(self, id, center):
+        self.remove_node(id)
+        cell = self._get_cell(center[0], center[1])
+        self._cell_to_nodes[cell].add(id)
+        self._node_to_cell[id] = cell
+
+
+    def remove_node(self, id):
+        cell = self._node_to_cell.pop(id, None)
+        if cell is not None:
+            self._cell_to_nodes[cell].discard(id)
+
+
+    def set_edge(self, edge, p1, p2):
+        self.remove_edge(edge)
+        cells = self._get_cells(p1[0], p1[1], p2[0], p2[1])
+        for cell in cells:
+            self._cell_to_edges[cell].add(edge)
+        self._edge_to_cells[edge] = cells
+
+
+    def remove_edge(self, edge):
+        for cell in self._edge_to_cells.pop(edge, ()):
+            self._cell_to_edges[cell].discard(edge)
+
+
+    def _query(self, cell_to_items, x1, y1, x2, y2):
+        items = set()
+        for cell in self._get_cells(x1, y1, x2, y2):
+            items.update(cell_to_items.get(cell, ()))
+        return items
+
+
+    def nodes_near(self, p, radius):
+        """Returns the ids of the nodes that may be within radius of p."""
+        return self._query(self._cell_to_nodes, p[0] - radius, p[1] - radius, p[0] + radius, p[1] + radius)
+
+
+    def edges_near(self, p, radius):
+        """Returns the edges that may be within radius of p."""
+        return self._query(self._cell_to_edges, p[0] - radius, p[1] - radius, p[0] + radius, p[1] + radius)
+
+
+    def nodes_in_rect(self, x1, y1, x2, y2):
+        """Returns the ids of the nodes that may lie in the rectangle."""
+        return self._query(self._cell_to_nodes, x1, y1, x2, y2)
+
+
+    def edges_in_rect(self, x1, y1, x2, y2):
+        """Returns the edges that may overlap the rectangle."""
+        return self._query(self._cell_to_edges, x1, y1, x2, y2)
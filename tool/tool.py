@@ -3,27 +3,36 @@ import cubicasa5k.labels as ccl
 import functools
 import numpy as np
 import os
-import queue
 import sys
-import tensorflow as tf
 import xml.etree.ElementTree as ET
 from contextlib import contextmanager
+from detection import INFERENCE_MODES, LazyModel, detect_elements
 from distinctipy import distinctipy
 from enum import IntEnum
-from collections import defaultdict
+from graph_creation import create_graph, euclidean_dist, get_elem_names
+from graph_io import load_graph, save_graph
+from inference_cache import InferenceCache, get_model_fingerprint
 from math import sqrt
 from PyQt6.QtCore import *
 from PyQt6.QtGui import *
 from PyQt6.QtPrintSupport import *
 from PyQt6.QtWidgets import *
 from PIL import Image, ImageQt
-from xml.dom import minidom
+from overlay import OverlayCompositor
+from routing import DynamicRoutes
+from spatial_index import GridIndex
+from workers import Worker
 
 
 _LABEL_DIVISOR = 256
 _NODE_RADIUS = 12
+_EDGE_PICK_DIST = 12
 _SELECTED_COLOR = (0, 0, 100)
 _PATH_COLOR = (0, 136, 190)
+_MODEL_DIR = os.path.join(os.path.dirname(__file__), "model")
+_CACHE_DIR = os.environ.get("TOOL_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "msc_thesis_tool"))
+_CACHE_MAX_SIZE_MB = int(os.environ.get("TOOL_CACHE_MAX_SIZE_MB", "1024"))
+_DETECT_ELEMENTS_STR = "Detect elements"
 
 
 class ItemType(IntEnum):
@@ -49,27 +58,6 @@ def _label_to_item_type(label):
         raise ValueError(f"Unknown label: {label}")
 
 
-def _get_pixel_neibs(img_array, i, j):
-    neibs = []
-
-    if i-1 >= 0:
-        neibs.append(img_array[i-1, j])
-    if i+1 < img_array.shape[0]:
-        neibs.append(img_array[i+1, j])
-    if j-1 >= 0:
-        neibs.append(img_array[i, j-1])
-    if j+1 < img_array.shape[1]:
-        neibs.append(img_array[i, j+1])
-
-    return neibs
-
-
-def _euclidean_dist(p1, p2):
-    x = p1[0] - p2[0]
-    y = p1[1] - p2[1]
-    return sqrt(x*x + y*y)
-
-
 def _dist_to_edge_for_pick(p, p1, p2):
     x1, y1 = p1
     x2, y2 = p2
@@ -77,11 +65,71 @@ def _dist_to_edge_for_pick(p, p1, p2):
     if (x1 - x)*(x2 - x) + (y1 - y)*(y2 - y) > 0:
         return None
     dist = abs((x2 - x1)*(y1 - y) - (x1 - x)*(y2 - y1)) / sqrt((x2-x1)**2 + (y2-y1)**2)
-    if dist <= 12:
+    if dist <= _EDGE_PICK_DIST:
         return dist
     return None
 
 
+def _get_exclude_colors(nodes=()):
+    colors = [
+        (0, 0, 0),
+        (1, 1, 1),
+        (_SELECTED_COLOR[0]/255, _SELECTED_COLOR[1]/255, _SELECTED_COLOR[2]/255),
+        (_PATH_COLOR[0]/255, _PATH_COLOR[1]/255, _PATH_COLOR[2]/255),
+    ]
+
+    for node in nodes:
+        color = (node.color[0]/255, node.color[1]/255, node.color[2]/255)
+        colors.append(color)
+
+    return colors
+
+
+class DetectionResult():
+    def __init__(self, img_file_name, panoptic_pred, instance_center_pred, overlay, label_to_elem_names, colors):
+        self.img_file_name = img_file_name
+        self.panoptic_pred = panoptic_pred
+        self.instance_center_pred = instance_center_pred
+        self.overlay = overlay
+        self.label_to_elem_names = label_to_elem_names
+        self.colors = colors
+
+
+def _detect_elements_job(worker: Worker, model: LazyModel, img_file_name, cache: InferenceCache,
+        inference_mode):
+    def get_model():
+        if not model.is_loaded:
+            worker.report_status("Loading the model...")
+        return model.get()
+
+    model_fingerprint = get_model_fingerprint(_MODEL_DIR) if cache is not None else None
+    # On a cache hit neither TensorFlow nor the model are loaded.
+    img_array, outputs, _ = detect_elements(get_model, img_file_name, cache, model_fingerprint,
+        inference_mode)
+    worker.check_cancelled()
+    worker.report_progress(80)
+
+    panoptic_pred = outputs["panoptic_pred"]
+    instance_center_pred = outputs["instance_center_pred"]
+    overlay = OverlayCompositor(img_array, panoptic_pred)
+    label_to_elem_names = get_elem_names(panoptic_pred, _LABEL_DIVISOR, ccl.label_to_str)
+    worker.check_cancelled()
+    worker.report_progress(90)
+
+    ids_num = sum(len(elem_names) for elem_names in label_to_elem_names.values())
+    colors = distinctipy.get_colors(ids_num, exclude_colors=_get_exclude_colors(), rng=0)
+    colors = (np.array(colors)*255).astype(np.uint8)
+    worker.report_progress(100)
+
+    return DetectionResult(img_file_name, panoptic_pred, instance_center_pred, overlay, label_to_elem_names, colors)
+
+
+def _create_graph_job(worker: Worker, panoptic_pred, instance_center_pred):
+    graph = create_graph(panoptic_pred, instance_center_pred, _LABEL_DIVISOR, (ccl.Label.ROOM, ccl.Label.DOOR))
+    worker.report_progress(100)
+    return graph
+
+
 @contextmanager
 def _wait_cursor():
     QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
@@ -137,6 +185,8 @@ class ImgLabel(QLabel):
         self._move_node_is_allowed = False
         self._start_pos = None
         self._picked_node_id = None
+        self._rubber_band = QRubberBand(QRubberBand.Shape.Rectangle, self)
+        self._rubber_band_origin = None
     
 
     def _pick_node(self, pos):
@@ -144,12 +194,16 @@ class ImgLabel(QLabel):
         nearest_node = None
         min_dist = sys.float_info.max
 
-        for id, node in self._win.id_to_node.items():
+        scale = self._win.scale_factor
+        radius = (_NODE_RADIUS + 2) / scale
+
+        for id in self._win.spatial_index.nodes_near((pos.x()/scale, pos.y()/scale), radius):
+            node = self._win.id_to_node[id]
             x1 = node.center[0]*self._win.scale_factor
             y1 = node.center[1]*self._win.scale_factor
             x2 = pos.x()
             y2 = pos.y()
-            dist = _euclidean_dist((x1, y1), (x2, y2))
+            dist = euclidean_dist((x1, y1), (x2, y2))
             if dist < min_dist:
                 min_dist = dist
                 nearest_node_id = id
@@ -182,7 +236,11 @@ class ImgLabel(QLabel):
         nearest_edge_data = None
         min_dist = sys.float_info.max
 
-        for edge, data in self._win.edges.items():
+        scale = self._win.scale_factor
+        radius = _EDGE_PICK_DIST / scale
+
+        for edge in self._win.spatial_index.edges_near((pos.x()/scale, pos.y()/scale), radius):
+            data = self._win.edges[edge]
             node1 = self._win.id_to_node[edge[0]]
             node2 = self._win.id_to_node[edge[1]]
             x1 = node1.center[0]*self._win.scale_factor
@@ -216,15 +274,49 @@ class ImgLabel(QLabel):
         if QApplication.keyboardModifiers() in (Qt.KeyboardModifier.ControlModifier, Qt.KeyboardModifier.ShiftModifier):
             return
 
+        selection = QItemSelection()
+
         for id, node in self._win.id_to_node.items():
-            if id != picked_node_id:
+            if id != picked_node_id and node.is_selected:
                 node.is_selected = False
-                self._win.tree_view.selectionModel().select(node.item.index(), 
-                    QItemSelectionModel.SelectionFlag.Deselect | QItemSelectionModel.SelectionFlag.Rows)
+                selection.select(node.item.index(), node.item.index())
         for edge, data in self._win.edges.items():
             if edge != picked_edge:
                 data.is_selected = False
 
+        if not selection.isEmpty():
+            self._win.tree_view.selectionModel().select(selection, 
+                QItemSelectionModel.SelectionFlag.Deselect | QItemSelectionModel.SelectionFlag.Rows)
+
+        self._win.redraw()
+
+
+    def _select_in_rect(self, rect: QRect):
+        scale = self._win.scale_factor
+        x1 = rect.left() / scale
+        y1 = rect.top() / scale
+        x2 = rect.right() / scale
+        y2 = rect.bottom() / scale
+
+        def is_inside(center):
+            return x1 <= center[0] <= x2 and y1 <= center[1] <= y2
+
+        selection = QItemSelection()
+
+        for id in self._win.spatial_index.nodes_in_rect(x1, y1, x2, y2):
+            node = self._win.id_to_node[id]
+            if is_inside(node.center):
+                node.is_selected = True
+                selection.select(node.item.index(), node.item.index())
+
+        for edge in self._win.spatial_index.edges_in_rect(x1, y1, x2, y2):
+            if is_inside(self._win.id_to_node[edge[0]].center) and is_inside(self._win.id_to_node[edge[1]].center):
+                self._win.edges[edge].is_selected = True
+
+        if not selection.isEmpty():
+            self._win.tree_view.selectionModel().select(selection,
+                QItemSelectionModel.SelectionFlag.Select | QItemSelectionModel.SelectionFlag.Rows)
+
         self._win.redraw()
 
 
@@ -253,12 +345,22 @@ class ImgLabel(QLabel):
 
         if self._move_node_is_allowed or self._move_img_is_allowed:
             QApplication.setOverrideCursor(Qt.CursorShape.ClosedHandCursor)
+        elif self._picked_node_id is None and picked_edge is None and self._win.has_graph and\
+            QApplication.keyboardModifiers() != Qt.KeyboardModifier.ShiftModifier:
+            self._rubber_band_origin = event.pos()
+            self._rubber_band.setGeometry(QRect(self._rubber_band_origin, QSize()))
+            self._rubber_band.show()
     
 
     def mouseReleaseEvent(self, event: QMouseEvent):
         if self._move_img_is_allowed or self._move_node_is_allowed:
             QApplication.restoreOverrideCursor()
 
+        if self._rubber_band_origin is not None:
+            self._rubber_band.hide()
+            self._select_in_rect(QRect(self._rubber_band_origin, event.pos()).normalized())
+            self._rubber_band_origin = None
+
         self._move_node_is_allowed = False
         self._move_img_is_allowed = False
     
@@ -271,14 +373,19 @@ class ImgLabel(QLabel):
         x = int(pos.x() / self._win.scale_factor)
         y = int(pos.y() / self._win.scale_factor)
         node.center = (x, y)
+        self._win.index_node(self._picked_node_id)
 
-        for edge in self._win.graph.keys():
-            if edge[0] == self._picked_node_id:
-                self._win.graph[edge] = _euclidean_dist(node.center, self._win.id_to_node[edge[1]].center)
-            elif edge[1] == self._picked_node_id:
-                self._win.graph[edge] = _euclidean_dist(node.center, self._win.id_to_node[edge[0]].center)
+        changed_ids = set()
 
-        self._win.clear_paths()
+        for neib in self._win.id_to_neibs.get(self._picked_node_id, ()):
+            dist = euclidean_dist(node.center, self._win.id_to_node[neib].center)
+            self._win.graph[(self._picked_node_id, neib)] = dist
+            self._win.graph[(neib, self._picked_node_id)] = dist
+            self._win.index_edge((min(self._picked_node_id, neib), max(self._picked_node_id, neib)))
+            if self._win.routes is not None:
+                changed_ids |= self._win.routes.set_edge(self._picked_node_id, neib, dist)
+
+        self._win.refresh_paths(changed_ids)
         self._win.recalc_draw()
         self._win.redraw()
 
@@ -310,6 +417,8 @@ class ImgLabel(QLabel):
             self._move_node(event.pos())
         elif self._move_img_is_allowed:
             self._move_img(event.pos())
+        elif self._rubber_band_origin is not None:
+            self._rubber_band.setGeometry(QRect(self._rubber_band_origin, event.pos()).normalized())
     
        
     def _get_width_alpha(self, is_selected, highlight_for_path):
@@ -433,6 +542,7 @@ class MainWin(QMainWindow):
         self.id_to_node: dict[int, Node] = {}
         self.tree_view: QTreeView = None
         self.graph = {}
+        self.id_to_neibs: dict[int, set[int]] = {}
         self.has_graph = False
 
         self._img_label: ImgLabel = None
@@ -447,8 +557,20 @@ class MainWin(QMainWindow):
         self._graph_widgets = []
         self._create_graph_button: QPushButton = None
         self._calc_paths_button: QPushButton = None
-        self._model = tf.saved_model.load(os.path.join(os.path.dirname(__file__), "model"))
+        self._model = LazyModel(_MODEL_DIR)
         self._edges: dict[(int, int), EdgeData] = {}
+        self._routes: DynamicRoutes = None
+        self._spatial_index = GridIndex()
+        self._overlay: OverlayCompositor = None
+        self._panoptic_pred: np.ndarray = None
+        self._instance_center_pred: np.ndarray = None
+        self._thread_pool = QThreadPool()
+        self._thread_pool.setMaxThreadCount(1)
+        self._worker: Worker = None
+        self._cancel_button: QPushButton = None
+        self._inference_cache: InferenceCache = None
+        if _CACHE_DIR:
+            self._inference_cache = InferenceCache(_CACHE_DIR, _CACHE_MAX_SIZE_MB << 20)
 
         self._create_win()
     
@@ -470,6 +592,29 @@ class MainWin(QMainWindow):
         return self._scroll_area
 
 
+    @property
+    def routes(self):
+        return self._routes
+
+
+    @property
+    def spatial_index(self):
+        return self._spatial_index
+
+
+    def index_node(self, id):
+        self._spatial_index.set_node(id, self.id_to_node[id].center)
+
+
+    def index_edge(self, edge):
+        self._spatial_index.set_edge(edge, self.id_to_node[edge[0]].center, self.id_to_node[edge[1]].center)
+
+
+    def _link_nodes(self, node_id, neib):
+        self.id_to_neibs.setdefault(node_id, set()).add(neib)
+        self.id_to_neibs.setdefault(neib, set()).add(node_id)
+
+
     def _create_win(self):
         self.setWindowTitle("Route Planning for Emergency Evacuation")
         self.setMinimumSize(500, 360)
@@ -482,6 +627,8 @@ class MainWin(QMainWindow):
             triggered=self._new_file))
         file_menu.addAction(QAction(Icon("open_file.svg"), "Open...", self, shortcut="Ctrl+O", 
             triggered=self._open_file))
+        file_menu.addAction(QAction("Open graph...", self, shortcut="Ctrl+G",
+            triggered=self._open_graph))
         save_graph_action = QAction(Icon("save_graph.svg"), "Save graph", self, shortcut="Ctrl+S",
             triggered=self._save_graph)
         self._graph_widgets.append(save_graph_action)
@@ -639,17 +786,27 @@ class MainWin(QMainWindow):
         self._progress_bar = QProgressBar()
         self._status_bar.addPermanentWidget(self._progress_bar)
 
+        self._cancel_button = QPushButton("Cancel")
+        self._cancel_button.clicked.connect(self._cancel_worker)
+        self._status_bar.addPermanentWidget(self._cancel_button)
+
         splitter.setStretchFactor(0, 1)
         splitter.setStretchFactor(1, 3)
 
         h_layout = QHBoxLayout()
         v_layout.addLayout(h_layout)
 
-        self._detect_elements_button = QPushButton("Detect elements")
+        self._detect_elements_button = QPushButton(_DETECT_ELEMENTS_STR)
         self._detect_elements_button.clicked.connect(self._detect_elements)
         self._detect_elements_button.setEnabled(False)
         h_layout.addWidget(self._detect_elements_button)
 
+        # "tiled" runs the model at the native resolution, for large plans.
+        self._inference_mode_combo_box = QComboBox()
+        self._inference_mode_combo_box.addItems(INFERENCE_MODES)
+        self._inference_mode_combo_box.setToolTip("Inference mode")
+        h_layout.addWidget(self._inference_mode_combo_box)
+
         self._create_graph_button = QPushButton("Create graph")
         self._create_graph_button.clicked.connect(self._create_graph)
         self._create_graph_button.setEnabled(False)
@@ -736,6 +893,7 @@ class MainWin(QMainWindow):
 
 
     def _new_file(self):
+        self._cancel_worker()
         self._clear_list()
         self._img_label.clear()
         self._img_qt = None
@@ -749,6 +907,12 @@ class MainWin(QMainWindow):
         self.id_to_node.clear()
         self._edges.clear()
         self.graph.clear()
+        self.id_to_neibs.clear()
+        self._routes = None
+        self._spatial_index.clear()
+        self._overlay = None
+        self._panoptic_pred = None
+        self._instance_center_pred = None
 
 
     def _open_file(self):
@@ -811,54 +975,82 @@ class MainWin(QMainWindow):
         
     
     def _save_graph_to_file(self, filename):
-        network_node = ET.Element('network')
+        nodes = [(id, node.item.text(), node.center, node.mark == Mark.EXIT, node.path)
+            for id, node in self.id_to_node.items()]
+        save_graph(filename, nodes, self._edges.keys(), self.graph)
+    
 
-        for id, node in self.id_to_node.items():
-            node_elem = ET.SubElement(network_node, 'node')
+    def _load_graph_from_file(self, filename):
+        nodes, graph = load_graph(filename)
 
-            id_elem = ET.SubElement(node_elem, 'id')
-            id_elem.text = str(id)
+        if self._img_qt is None:
+            # Without a plan, the graph is drawn on a blank canvas around its nodes.
+            width = max((center[0] for _, _, center, _, _ in nodes), default=0) + 2*_NODE_RADIUS
+            height = max((center[1] for _, _, center, _, _ in nodes), default=0) + 2*_NODE_RADIUS
+            image = QImage(max(width, 1), max(height, 1), QImage.Format.Format_RGB32)
+            image.fill(Qt.GlobalColor.white)
+            self._load_img(image)
+            self.scale_factor = 1.0
+            self._img_label.adjustSize()
+            self._zoom_to_fit()
 
-            label_elem = ET.SubElement(node_elem, 'label')
-            label_elem.text = node.item.text()
+        self._clear_graph()
 
-            x_node = ET.SubElement(node_elem, 'x')
-            x_node.text = str(node.center[0])
+        parent = QStandardItem("Nodes")
+        parent.setEditable(False)
+        self._nodes_item = parent
+        self._item_model.appendRow(parent)
 
-            y_node = ET.SubElement(node_elem, 'y')
-            y_node.text = str(node.center[1])
+        colors = distinctipy.get_colors(len(nodes), exclude_colors=_get_exclude_colors(), rng=0)
+        colors = (np.array(colors)*255).astype(np.uint8)
 
-            exit_node = ET.SubElement(node_elem, 'exit')
-            exit_node.text = str(node.mark == Mark.EXIT).lower()
+        for (node_id, label, center, is_exit, path), color in zip(nodes, colors):
+            item1 = QStandardItem(label)
+            item1.setEditable(True)
+            item1.setData((ItemType.NODE, node_id))
 
-            if len(node.path) > 0:
-                path_node = ET.SubElement(node_elem, 'path')
-                path_node.text = ' '.join(map(str, node.path))
+            item2 = QStandardItem("Exit" if is_exit else "")
+            item2.setEditable(False)
+            item2.setData((ItemType.NODE, node_id))
 
-        edge_id = 1
+            parent.appendRow((item1, item2))
 
-        for edge in self._edges.keys():
-            edge_elem = ET.SubElement(network_node, 'edge')
+            node = Node(color, item1, center)
+            node.mark = Mark.EXIT if is_exit else Mark.NONE
+            node.path = path
+            self.id_to_node[node_id] = node
+            self.index_node(node_id)
 
-            id_elem = ET.SubElement(edge_elem, 'id')
-            id_elem.text = str(edge_id)
-            edge_id += 1
+        self.tree_view.expand(parent.index())
 
-            from_elem = ET.SubElement(edge_elem, 'from')
-            from_elem.text = str(edge[0])
+        for edge, dist in graph.items():
+            self.graph[edge] = dist
+            self._link_nodes(edge[0], edge[1])
+            min_node_id = min(edge[0], edge[1])
+            max_node_id = max(edge[0], edge[1])
+            if (min_node_id, max_node_id) not in self._edges:
+                self._edges[(min_node_id, max_node_id)] = EdgeData()
+                self.index_edge((min_node_id, max_node_id))
 
-            to_elem = ET.SubElement(edge_elem, 'to')
-            to_elem.text = str(edge[1])
+        self._set_graph_widgets_enabled(True)
+        self._calc_paths_button.setEnabled(True)
+        self.has_graph = True
+        self.redraw()
 
-            length_elem = ET.SubElement(edge_elem, 'length')
-            length_elem.text = str(self.graph[edge])
 
-        xml_str = ET.tostring(network_node, encoding='unicode')
-        dom = minidom.parseString(xml_str)
-        xml_str = dom.toprettyxml(indent="  ")
-        with open(filename, 'w') as f:
-            f.write(xml_str)
-    
+    def _open_graph(self):
+        filename, _ = QFileDialog.getOpenFileName(self, "Open graph", "", "(*.xml)")
+        if not filename:
+            return
+
+        self._cancel_worker()
+
+        with _wait_cursor():
+            try:
+                self._load_graph_from_file(filename)
+            except (OSError, ValueError, ET.ParseError):
+                QMessageBox.information(self, "Information", "Cannot load %s." % filename)
+
 
     def _save_graph(self):
         filename, _ = QFileDialog.getSaveFileName(self, "Save graph", "", "(*.xml)")
@@ -914,8 +1106,6 @@ class MainWin(QMainWindow):
 
 
     def _selection_changed(self):
-        background = Image.open(self._img_file_name)
-
         items = self._get_selected_childless_items(0)
 
         for elem in self.id_to_elem.values():
@@ -923,14 +1113,8 @@ class MainWin(QMainWindow):
 
         for node in self.id_to_node.values():
             node.is_selected = False
-            
-        if len(items) == 0:
-            self.recalc_draw()
-            self._load_img(ImageQt.ImageQt(background))
-            return
 
-        panoptic_pred = self._output["panoptic_pred"].numpy()[0][:, :, np.newaxis]
-        foreground_array = np.zeros((panoptic_pred.shape[0], panoptic_pred.shape[1], 4)).astype(np.uint8)
+        id_to_color = {}
 
         for item in items:
             item_data = item.data()
@@ -942,15 +1126,14 @@ class MainWin(QMainWindow):
                 self.id_to_node[id].is_selected = True
             else:
                 self.id_to_elem[id].is_selected = True
+                id_to_color[id] = self.id_to_elem[id].color
 
-                color = self.id_to_elem[id].color
-                foreground_array += np.where(panoptic_pred == id,
-                    (color[0], color[1], color[2], 200), (0, 0, 0, 0)).astype(np.uint8)
-
-        foreground = Image.fromarray(foreground_array)
-        background.paste(foreground, (0, 0), foreground)
         self.recalc_draw()
-        self._load_img(ImageQt.ImageQt(background))
+
+        if self._overlay is None:
+            return
+
+        self._load_img(ImageQt.ImageQt(Image.fromarray(self._overlay.compose(id_to_color))))
 
     
     def _get_common_edges(self, node_ids):
@@ -1005,21 +1188,6 @@ class MainWin(QMainWindow):
         menu.exec(self.tree_view.viewport().mapToGlobal(position))
 
 
-    def _get_exclude_colors(self):
-        colors = [
-            (0, 0, 0),
-            (1, 1, 1),
-            (_SELECTED_COLOR[0]/255, _SELECTED_COLOR[1]/255, _SELECTED_COLOR[2]/255),
-            (_PATH_COLOR[0]/255, _PATH_COLOR[1]/255, _PATH_COLOR[2]/255),
-        ]
-
-        for node in self.id_to_node.values():
-            color = (node.color[0]/255, node.color[1]/255, node.color[2]/255)
-            colors.append(color)
-
-        return colors
-
-
     def new_node_at_pos(self, pos):
         x = int(pos.x() / self.scale_factor)
         y = int(pos.y() / self.scale_factor)
@@ -1037,11 +1205,15 @@ class MainWin(QMainWindow):
         parent = self._get_nodes_item()
         parent.appendRow((item1, item2))
 
-        colors = distinctipy.get_colors(1, exclude_colors=self._get_exclude_colors(), rng=0)
+        colors = distinctipy.get_colors(1, exclude_colors=_get_exclude_colors(self.id_to_node.values()), rng=0)
         colors = (np.array(colors)*255).astype(np.uint8)
         self.id_to_node[node_id] = Node(colors[0], item1, (x, y))
+        self.index_node(node_id)
 
-        self.clear_paths()
+        changed_ids = set()
+        if self._routes is not None:
+            changed_ids = self._routes.add_node(node_id)
+        self.refresh_paths(changed_ids)
         self.redraw()
 
     
@@ -1062,22 +1234,26 @@ class MainWin(QMainWindow):
         if ret == QMessageBox.StandardButton.No:
             return
 
+        changed_ids = set()
+
         for item in items:
             _, id = item.data()
             item.parent().removeRow(item.row())
             self.id_to_node.pop(id)
-
-            edges_to_remove = []
-            for edge in self.graph.keys():
-                if edge[0] == id or edge[1] == id:
-                    edges_to_remove.append(edge)
-            
-            for edge in edges_to_remove:
-                self.graph.pop(edge)
-                if edge in self._edges:
-                    self._edges.pop(edge)
+            self._spatial_index.remove_node(id)
+
+            for neib in self.id_to_neibs.pop(id, set()):
+                self.id_to_neibs[neib].discard(id)
+                for edge in ((id, neib), (neib, id)):
+                    self.graph.pop(edge, None)
+                    if edge in self._edges:
+                        self._edges.pop(edge)
+                        self._spatial_index.remove_edge(edge)
+
+            if self._routes is not None:
+                changed_ids |= self._routes.remove_node(id)
         
-        self.clear_paths()
+        self.refresh_paths(changed_ids)
         self.redraw()
 
     
@@ -1089,13 +1265,19 @@ class MainWin(QMainWindow):
         if len(edges) == 0:
             return
 
+        changed_ids = set()
+
         for edge in edges:
             self._edges[edge] = EdgeData()
+            self.index_edge(edge)
             dist = self._calc_edge_dist(edge)
             self.graph[(edge[0], edge[1])] = dist
             self.graph[(edge[1], edge[0])] = dist
+            self._link_nodes(edge[0], edge[1])
+            if self._routes is not None:
+                changed_ids |= self._routes.set_edge(edge[0], edge[1], dist)
         
-        self.clear_paths()
+        self.refresh_paths(changed_ids)
         self.redraw()
 
 
@@ -1110,12 +1292,19 @@ class MainWin(QMainWindow):
         if ret == QMessageBox.StandardButton.No:
             return
 
+        changed_ids = set()
+
         for edge in edges:
             self._edges.pop(edge)
+            self._spatial_index.remove_edge(edge)
             self.graph.pop(edge)
             self.graph.pop((edge[1], edge[0]))
+            self.id_to_neibs[edge[0]].discard(edge[1])
+            self.id_to_neibs[edge[1]].discard(edge[0])
+            if self._routes is not None:
+                changed_ids |= self._routes.remove_edge(edge[0], edge[1])
 
-        self.clear_paths()
+        self.refresh_paths(changed_ids)
         self.redraw()
     
 
@@ -1132,10 +1321,25 @@ class MainWin(QMainWindow):
     
     
     def clear_paths(self):
+        self._routes = None
+
         for node in self.id_to_node.values():
             node.path.clear()
 
         self._calc_paths_button.setEnabled(True)
+
+
+    def refresh_paths(self, node_ids=None):
+        """Fetches the paths of the given nodes from the routes, of all the nodes if node_ids is None."""
+        if self._routes is None:
+            self.clear_paths()
+            return
+
+        if node_ids is None:
+            node_ids = self.id_to_node.keys()
+
+        for id in node_ids:
+            self.id_to_node[id].path = self._routes.get_path(id)
      
     
     def _mark_as_exit(self):
@@ -1143,16 +1347,19 @@ class MainWin(QMainWindow):
         if len(items) == 0:
             return
 
-        clear_paths = False
+        update_paths = False
+        changed_ids = set()
 
         for item in items:
             item.setText("Exit")
             _, id = item.data()
             self.id_to_node[id].mark = Mark.EXIT
-            clear_paths = True
+            if self._routes is not None:
+                changed_ids |= self._routes.set_exit(id, True)
+            update_paths = True
         
-        if clear_paths:
-            self.clear_paths()
+        if update_paths:
+            self.refresh_paths(changed_ids)
 
         self.redraw()
     
@@ -1162,71 +1369,58 @@ class MainWin(QMainWindow):
         if len(items) == 0:
             return
 
-        clear_paths = False
+        update_paths = False
+        changed_ids = set()
 
         for item in items:
             item.setText("")
             _, id = item.data()
             self.id_to_node[id].mark = Mark.NONE
-            clear_paths = True
+            if self._routes is not None:
+                changed_ids |= self._routes.set_exit(id, False)
+            update_paths = True
 
-        if clear_paths:
-            self.clear_paths()
+        if update_paths:
+            self.refresh_paths(changed_ids)
 
         self.redraw()
 
     
-    def _detect_elements_core(self):
+    def _detect_elements_finished(self, worker: Worker, result: DetectionResult):
+        if worker is not self._worker:
+            return
+        self._worker_done()
+
+        if result.img_file_name != self._img_file_name:
+            return
+
         self._clear_list()
         self._clear_graph()
         self.id_to_elem.clear()
 
-        img_array = np.array(Image.open(self._img_file_name).convert("RGB"))
-
-        self._output = self._model(tf.cast(img_array, tf.uint8))
-        # self._output is a dict with keys: 
-        # center_heatmap, instance_center_pred, instance_pred, 
-        # panoptic_pred, offset_map, semantic_pred, 
-        # semantic_logits, instance_scores, semantic_probs
-
-        panoptic_pred = self._output["panoptic_pred"].numpy()[0]
-
-        ids = np.unique(panoptic_pred)
-        ids.sort()
-
-        labels = np.unique(ids // _LABEL_DIVISOR)
-        labels.sort()
+        self._panoptic_pred = result.panoptic_pred
+        self._instance_center_pred = result.instance_center_pred
+        self._overlay = result.overlay
 
         id_to_item = {}
 
-        for label in labels:
+        for label, elem_names in result.label_to_elem_names.items():
             if label == ccl.Label.BACKGROUND:
                 continue
 
             item_type = _label_to_item_type(label)
-            label_str = ccl.label_to_str[label]
-            parent_str = label_str + "s"
+            parent_str = ccl.label_to_str[label] + "s"
             parent = QStandardItem(parent_str)
             parent.setEditable(False)
             self._item_model.appendRow(parent)
 
-            instance_pred = np.where(panoptic_pred // _LABEL_DIVISOR == label, 
-                panoptic_pred % _LABEL_DIVISOR, -1)
-            instances = np.unique(instance_pred)
-            instances.sort()
-
-            for i, instance in enumerate(instances):
-                if instance == -1:
-                    continue
-
-                id = label*_LABEL_DIVISOR + instance
-
-                if instance == 0:
+            for id, name in elem_names:
+                if id % _LABEL_DIVISOR == 0:
                     parent.setData((item_type, id))
                     id_to_item[id] = parent
                     continue
 
-                item1 = QStandardItem(f"{label_str} {i}")
+                item1 = QStandardItem(name)
                 item1.setEditable(True)
                 item1.setData((item_type, id))
                 id_to_item[id] = item1
@@ -1239,10 +1433,9 @@ class MainWin(QMainWindow):
         
         self.tree_view.expandAll()
 
-        colors = distinctipy.get_colors(len(ids), exclude_colors=self._get_exclude_colors(), rng=0)
-        colors = (np.array(colors)*255).astype(np.uint8)
+        ids = [id for elem_names in result.label_to_elem_names.values() for id, _ in elem_names]
 
-        for id, color in zip(ids, colors):
+        for id, color in zip(ids, result.colors):
             self.id_to_elem[id] = Elem(color, id_to_item.get(id, None))
 
         self._create_graph_button.setEnabled(True)
@@ -1253,15 +1446,27 @@ class MainWin(QMainWindow):
 
 
     def _detect_elements(self):
-        with _wait_cursor():
-            self._detect_elements_core()
+        worker = Worker(_detect_elements_job, self._model, self._img_file_name, self._inference_cache,
+            self._inference_mode_combo_box.currentText())
+        worker.signals.finished.connect(self._detect_elements_finished)
+        worker.signals.status.connect(self._detect_elements_status)
+        self._start_worker(worker, "Detecting elements...")
+
+
+    def _detect_elements_status(self, worker: Worker, msg):
+        if worker is not self._worker:
+            return
+        # Only a cache miss loads the model, so the loading state is shown
+        # once the job knows it needs it.
+        self._detect_elements_button.setText(f"{_DETECT_ELEMENTS_STR} (loading model...)")
+        self._status_bar.showMessage(msg)
 
 
     def _calc_edge_dist(self, edge):
         center1 = self.id_to_node[edge[0]].center
         center2 = self.id_to_node[edge[1]].center
 
-        return _euclidean_dist(center1, center2)
+        return euclidean_dist(center1, center2)
     
 
     def _clear_graph(self):
@@ -1273,83 +1478,99 @@ class MainWin(QMainWindow):
 
         self.id_to_node.clear()
         self.graph.clear()
+        self.id_to_neibs.clear()
         self._edges.clear()
+        self._routes = None
+        self._spatial_index.clear()
     
         
     def _show_progress_bar(self, msg):
         self._status_bar.show()
         self._status_bar.showMessage(msg)
-        self._status_bar.repaint()
 
 
     def _hide_progress_bar(self):
         self._progress_bar.reset()
         self._status_bar.hide()
         self._status_bar.clearMessage()
-        self._status_bar.repaint()
     
 
-    def _set_progress_bar_value(self, value):
-        value = int(value)
+    def _set_progress_bar_value(self, worker: Worker, value):
+        if worker is not self._worker:
+            return
         if value > self._progress_bar.value():
             self._progress_bar.setValue(value)
-            self._progress_bar.repaint()
-    
 
-    def _create_graph_core(self):
-        self._show_progress_bar("Creating graph...")
-        self._clear_graph()
 
-        panoptic_pred = self._output["panoptic_pred"].numpy()[0]
-        instance_center_pred = self._output["instance_center_pred"].numpy()[0]
+    def _set_busy(self, busy):
+        has_elems = self._panoptic_pred is not None
 
-        elem_id_to_center_pred_max = {}
-        elem_id_to_center = {}
-        elem_id_graph = {}
+        self._detect_elements_button.setEnabled(not busy and self._img_file_name is not None)
+        self._inference_mode_combo_box.setEnabled(not busy)
+        self._create_graph_button.setEnabled(not busy and has_elems)
+        self._set_graph_widgets_enabled(not busy and self.has_graph)
+        self._calc_paths_button.setEnabled(not busy and self.has_graph and self._routes is None)
 
-        step = 1
-        total_steps = panoptic_pred.shape[0]*panoptic_pred.shape[1]
 
-        for i in range(panoptic_pred.shape[0]):
-            for j in range(panoptic_pred.shape[1]):
-                self._set_progress_bar_value(100*step/total_steps); step += 1
+    def _start_worker(self, worker: Worker, msg):
+        self._cancel_worker()
 
-                elem_id = panoptic_pred[i][j]
-                label = elem_id // _LABEL_DIVISOR
-                if label not in (ccl.Label.ROOM, ccl.Label.DOOR):
-                    continue
+        worker.signals.progress.connect(self._set_progress_bar_value)
+        worker.signals.failed.connect(self._worker_failed)
+        worker.signals.cancelled.connect(self._worker_cancelled)
+        self._worker = worker
+
+        self._progress_bar.reset()
+        self._show_progress_bar(msg)
+        self._set_busy(True)
+        self._thread_pool.start(worker)
+
+
+    def _worker_done(self):
+        self._worker = None
+        self._detect_elements_button.setText(_DETECT_ELEMENTS_STR)
+        self._hide_progress_bar()
+        self._set_busy(False)
 
-                if instance_center_pred[i][j] > elem_id_to_center_pred_max.get(elem_id, -1.0):
-                    elem_id_to_center_pred_max[elem_id] = instance_center_pred[i][j]
-                    elem_id_to_center[elem_id] = (j, i)
 
-                neibs = _get_pixel_neibs(panoptic_pred, i, j)
+    def _cancel_worker(self):
+        if self._worker is None:
+            return
+
+        # The worker stops at its next stage boundary, its results are ignored.
+        self._worker.cancel()
+        self._worker_done()
+
+
+    def _worker_cancelled(self, worker: Worker):
+        if worker is self._worker:
+            self._worker_done()
+
+
+    def _worker_failed(self, worker: Worker, msg):
+        if worker is not self._worker:
+            return
+        self._worker_done()
+        QMessageBox.critical(self, "Error", msg)
+
+
+    def _create_graph_finished(self, worker: Worker, result):
+        if worker is not self._worker:
+            return
+        self._worker_done()
 
-                for neib in neibs:
-                    if neib == elem_id:
-                        continue
-                    neib_label = neib // _LABEL_DIVISOR
-                    if neib_label not in (ccl.Label.ROOM, ccl.Label.DOOR):
-                        continue
-                    if (elem_id, neib) not in elem_id_graph:
-                        elem_id_graph[(elem_id, neib)] = 1.0
+        self._clear_graph()
 
-        elem_id_to_node_id = {}
-        node_id = 0
+        node_id_to_elem_id, node_id_to_center, graph = result
 
         parent = QStandardItem("Nodes")
         parent.setEditable(False)
         self._nodes_item = parent
         self._item_model.appendRow(parent)
 
-        for elem_id, elem in self.id_to_elem.items():
-            label = elem_id // _LABEL_DIVISOR
-            if label not in (ccl.Label.ROOM, ccl.Label.DOOR):
-                continue
-
-            node_id += 1
-
-            label_str = self.id_to_elem[elem_id].item.text()
+        for node_id, elem_id in node_id_to_elem_id.items():
+            elem = self.id_to_elem[elem_id]
+            label_str = elem.item.text()
 
             item1 = QStandardItem(label_str)
             item1.setEditable(True)
@@ -1361,28 +1582,19 @@ class MainWin(QMainWindow):
 
             parent.appendRow((item1, item2))
 
-            elem_id_to_node_id[elem_id] = node_id
-            self.id_to_node[node_id] = Node(elem.color, item1)
+            self.id_to_node[node_id] = Node(elem.color, item1, node_id_to_center.get(node_id))
+            self.index_node(node_id)
 
         self.tree_view.expand(parent.index())
         
-        graph = {}
-
-        for (elem_id, neib), dist in elem_id_graph.items():
-            graph[(elem_id_to_node_id[elem_id], elem_id_to_node_id[neib])] = dist
-
-        for elem_id, center in elem_id_to_center.items():
-            self.id_to_node[elem_id_to_node_id[elem_id]].center = center
-        
-        for edge, _ in graph.items():
-            dist = self._calc_edge_dist(edge)
+        for edge, dist in graph.items():
             self.graph[edge] = dist
+            self._link_nodes(edge[0], edge[1])
             min_node_id = min(edge[0], edge[1])
             max_node_id = max(edge[0], edge[1])
             self._edges[(min_node_id, max_node_id)] = EdgeData()
+            self.index_edge((min_node_id, max_node_id))
 
-        self._hide_progress_bar()
-        
         self._set_graph_widgets_enabled(True)
         self._calc_paths_button.setEnabled(True)
         self.has_graph = True
@@ -1390,86 +1602,14 @@ class MainWin(QMainWindow):
 
     
     def _create_graph(self):
-        with _wait_cursor():
-            self._create_graph_core()
-
-
-    def _dijkstra(self, exit_id, id_to_neibs):
-        id_to_dist = {id: sys.float_info.max for id in self.id_to_node.keys()}
-
-        q = queue.PriorityQueue()
-
-        id_to_dist[exit_id] = 0.0
-        q.put((0.0, exit_id))
-
-        while not q.empty():
-            _, id = q.get()
-            dist = id_to_dist[id]
-
-            for neib in id_to_neibs[id]:
-                cost = self.graph[(id, neib)]
-                new_dist = dist + cost
-
-                if new_dist < id_to_dist[neib]:
-                    id_to_dist[neib] = new_dist
-                    q.put((new_dist, neib))
-        
-        return id_to_dist
-
-
-    def _calc_path(self, id: int, id_to_dist_dicts, exit_ids, id_to_neibs):
-        best_exit_index = None
-        min_dist = sys.float_info.max
-        node = self.id_to_node[id]
-
-        node.path = []
-
-        for i, id_to_dist in enumerate(id_to_dist_dicts):
-            dist = id_to_dist[id]
-            if dist < min_dist:
-                min_dist = dist
-                best_exit_index = i
-        
-        if best_exit_index is None:
-            return
-        
-        best_id_to_dist = id_to_dist_dicts[best_exit_index]
-        path = [id]
-        cur_id = id
-        exit_id = exit_ids[best_exit_index]
-
-        while cur_id != exit_id:
-            min_dist = sys.float_info.max
-            best_neib = None
-
-            for neib in id_to_neibs[cur_id]:
-                neib_dist = best_id_to_dist[neib]
-                if neib_dist < min_dist:
-                    min_dist = neib_dist
-                    best_neib = neib
-            
-            if best_neib is None:
-                return
-            
-            path.append(best_neib)
-            cur_id = best_neib
-
-        node.path = path
+        worker = Worker(_create_graph_job, self._panoptic_pred, self._instance_center_pred)
+        worker.signals.finished.connect(self._create_graph_finished)
+        self._start_worker(worker, "Creating graph...")
 
 
     def _calc_paths_core(self, exit_ids):
-        id_to_dist_dicts = []
-        id_to_neibs = defaultdict(list)
-
-        for (node_id, neib), _ in self.graph.items():
-            id_to_neibs[node_id].append(neib)
-        
-        for exit_id in exit_ids:
-            id_to_dist = self._dijkstra(exit_id, id_to_neibs)
-            id_to_dist_dicts.append(id_to_dist)
-        
-        for id in self.id_to_node.keys():
-            self._calc_path(id, id_to_dist_dicts, exit_ids, id_to_neibs)
+        self._routes = DynamicRoutes(self.graph, self.id_to_node.keys(), exit_ids)
+        self.refresh_paths()
     
 
     def calc_paths(self):
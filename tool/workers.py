@@ -0,0 +1,83 @@
+import time
+import traceback
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal
+
+
+class Cancelled(Exception):
+    pass
+
+
+class WorkerSignals(QObject):
+    # Every signal carries the worker, so that the receiver can ignore the
+    # signals of workers it has already cancelled.
+    progress = pyqtSignal(object, int)
+    finished = pyqtSignal(object, object)
+    failed = pyqtSignal(object, str)
+    status = pyqtSignal(object, str)
+    cancelled = pyqtSignal(object)
+
+
+class Worker(QRunnable):
+    """Runs fn(worker, *args) on a QThreadPool thread.
+
+    fn must not touch any widget. It reports its progress with
+    report_progress(), which is throttled, and report_status() for the
+    stages worth telling the user about. It calls check_cancelled() between
+    its stages to stop early once cancel() has been called.
+    """
+    def __init__(self, fn, *args, progress_interval=0.1):
+        super().__init__()
+        self.signals = WorkerSignals()
+        self._fn = fn
+        self._args = args
+        self._progress_interval = progress_interval
+        self._is_cancelled = False
+        self._last_progress = None
+        self._last_progress_time = 0.0
+
+
+    @property
+    def is_cancelled(self):
+        return self._is_cancelled
+
+
+    def cancel(self):
+        self._is_cancelled = True
+
+
+    def check_cancelled(self):
+        if self._is_cancelled:
+            raise Cancelled()
+
+
+    def report_progress(self, value):
+        value = int(value)
+        now = time.monotonic()
+
+        if value == self._last_progress:
+            return
+        if value < 100 and now - self._last_progress_time < self._progress_interval:
+            return
+
+        self._last_progress = value
+        self._last_progress_time = now
+        self.signals.progress.emit(self, value)
+
+
+    def report_status(self, msg):
+        self.signals.status.emit(self, msg)
+
+
+    def run(self):
+        try:
+            self.check_cancelled()
+            result = self._fn(self, *self._args)
+            self.check_cancelled()
+        except Cancelled:
+            self.signals.cancelled.emit(self)
+            return
+        except Exception:
+            self.signals.failed.emit(self, traceback.format_exc())
+            return
+
+        self.signals.finished.emit(self, result)